@@ -5,14 +5,16 @@ import streamlit as st
 st.set_page_config(layout="wide", page_title="Race & Training Planner")
 
 import requests
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 import pandas as pd
+import numpy as np
 import altair as alt
 import logging
 import os
 from dotenv import load_dotenv
 from snowflake.snowpark.session import Session
 from snowflake.snowpark.functions import col
+from snowflake.connector.errors import ProgrammingError
 from streamlit_cookies_manager import EncryptedCookieManager
 import uuid
 import matplotlib.pyplot as plt
@@ -22,8 +24,46 @@ import threading
 from queue import Queue
 import json
 import time
-from collections import defaultdict
+import hashlib
+import hmac
+import secrets
+import heapq
+import sqlite3
+import zlib
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 from streamlit.runtime.scriptrunner import add_script_run_ctx,get_script_run_ctx
+from planner import (
+    PlanComputationCancelled,
+    PlanTimeBudgetExceeded,
+    TSS_BY_ZONE_BY_SPORT,
+    ZONES,
+    buildCycleIndex,
+    checkPlanCancelled,
+    compute_training_plan,
+    cycleByEndDate,
+    decode_plan_value,
+    deserialize_plan,
+    encode_plan_value,
+    expandTimeline,
+    final_date,
+    format_plan_trace,
+    freeze_plan,
+    has_pending_weeks,
+    hashPlanInputs,
+    iter_completed_plan,
+    log_debug,
+    log_error,
+    log_info,
+    log_warning,
+    new_plan_computation,
+    planTrace,
+    serialize_plan,
+    timelineFromIntervalSuggestions,
+)
 
 
 
@@ -62,12 +102,69 @@ st.markdown(custom_css, unsafe_allow_html=True)
 # else:
 #     # st.warning("Cookies are not ready or supported!")
 #     pass
-STRAVA_API_URL = "https://www.strava.com/api/v3"
+STRAVA_API_URL = os.getenv("STRAVA_API_URL", "https://www.strava.com/api/v3")
+# Seconds between two checks of the background plan completion
+PLAN_POLL_INTERVAL = 0.5
+# Number of completed plans shared between the sessions
+PLAN_CACHE_SIZE = 64
+# Port of the Strava webhook receiver, disabled when 0
+STRAVA_WEBHOOK_PORT = int(os.getenv("STRAVA_WEBHOOK_PORT", 0))
+# Token Strava sends back when the push subscription is created
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.getenv("STRAVA_WEBHOOK_VERIFY_TOKEN")
+# Secret path of the callback URL given to Strava, the receiver answers 404 anywhere else
+STRAVA_WEBHOOK_PATH = os.getenv("STRAVA_WEBHOOK_PATH")
+# Port of the Strava usage metrics, served on the loopback interface only, disabled when 0
+STRAVA_METRICS_PORT = int(os.getenv("STRAVA_METRICS_PORT", 0))
+# Session recorded on the activities ingested from the webhook
+WEBHOOK_SESSION_ID = "webhook"
+STRAVA_TOKEN_URL = "https://www.strava.com/oauth/token"
+# Seconds before its expiry at which an access token is refreshed
+STRAVA_TOKEN_REFRESH_MARGIN = 300
+# Activities per page of the activity list, the most Strava serves
+STRAVA_PAGE_SIZE = 200
+# Pages of the activity list requested at the same time
+STRAVA_FETCH_CONCURRENCY = int(os.getenv("STRAVA_FETCH_CONCURRENCY", 4))
+# Priorities of the Strava requests, a user waiting for the answer comes before the background ingestion
+STRAVA_PRIORITY_INTERACTIVE = 0
+STRAVA_PRIORITY_BACKFILL = 1
+# Requests allowed by Strava per 15 minutes and per day, until its responses tell the actual ones
+STRAVA_DEFAULT_RATE_LIMITS = (100, 1000)
+# Share of each window kept for the interactive requests, the backfill waits beyond it
+STRAVA_INTERACTIVE_RESERVE = 0.2
+# Seconds a request waits for budget, by priority, before being answered as rate limited
+STRAVA_MAX_WAIT_BY_PRIORITY = {STRAVA_PRIORITY_INTERACTIVE: 30, STRAVA_PRIORITY_BACKFILL: 900}
+# Days of activities downloaded at the first login of an athlete
+STRAVA_HISTORY_DAYS = 365
+# Days between two comparisons of the recent stored activities with Strava, to catch edits and deletions
+STRAVA_RECONCILE_INTERVAL_DAYS = int(os.getenv("STRAVA_RECONCILE_INTERVAL_DAYS", 7))
+# Days of recent activities compared with Strava at a reconciliation
+STRAVA_RECONCILE_WINDOW_DAYS = 30
+# Days of recent activities whose streams are downloaded to know their time in each zone
+STRAVA_STREAM_DAYS = 42
+# Streams binned into zones, with the sample times and the moving flags
+STRAVA_STREAM_KEYS = "time,moving,heartrate,watts"
+# Seconds between two samples above which the gap is a pause and not training
+STREAM_MAX_SAMPLE_GAP = 30
+# Samples averaged by the rolling window of the TSS, 30 s at 1 Hz
+TSS_ROLLING_WINDOW = 30
+# Bound of the Strava zones the threshold is derived from, and the fraction of the threshold it stands at:
+# the power zones are Coggan's (zone 4 starts at 91 % of the FTP), the 4th heart rate zone is the threshold one
+STREAM_THRESHOLD_BY_KIND = {"watts": (2, 0.91), "heartrate": (2, 1.0)}
+# Power is averaged at the 4th power (normalized power), the heart rate at the square
+STREAM_TSS_EXPONENT_BY_KIND = {"watts": 4, "heartrate": 2}
+# Local copy of the stored weekly activity rollups, the recommendations are computed from it while it is fresh
+ACTIVITY_CACHE_PATH = os.getenv("ACTIVITY_CACHE_PATH", "activity_cache.sqlite")
+# Minutes during which the local activities of an athlete are used without syncing with Strava
+ACTIVITY_CACHE_FRESHNESS_MINUTES = int(os.getenv("ACTIVITY_CACHE_FRESHNESS_MINUTES", 60))
+# Athletes kept in the local cache, the least recently used ones are evicted first
+ACTIVITY_CACHE_MAX_ATHLETES = int(os.getenv("ACTIVITY_CACHE_MAX_ATHLETES", 500))
+# Days after which an athlete who did not come back is evicted from the local cache
+ACTIVITY_CACHE_MAX_IDLE_DAYS = 30
 # Use Streamlit secrets management
 client_id = st.secrets.get("strava", {}).get("client_id", os.getenv("STRAVA_CLIENT_ID"))
 client_secret = st.secrets.get("strava", {}).get("client_secret", os.getenv("STRAVA_CLIENT_SECRET"))
 redirect_uri = st.secrets.get("strava", {}).get("redirect_uri", os.getenv("STRAVA_REDIRECT_URI"))
-scopes = "read,activity:read_all,activity:write"
+scopes = "read,profile:read_all,activity:read_all,activity:write"
 
 imgur_client_id = st.secrets.get("imgur", {}).get("client_id", os.getenv("IMGUR_CLIENT_ID"))
 imgur_client_secret = st.secrets.get("imgur", {}).get("client_secret", os.getenv("IMGUR_CLIENT_SECRET"))
@@ -90,22 +187,6 @@ if "result_queue" not in st.session_state:
     st.session_state["result_queue"] = Queue()
 
 
-def log_debug(message):
-    logging.debug(message)
-
-
-def log_info(message):
-    # add timestamp to message
-    message = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}"
-    logging.info(message)
-
-
-def log_error(message):
-    logging.error(message)
-
-def log_warning(message):
-    logging.warning(message)
-    
 def get_or_create_session_id(cookies):
     # Generate a temporary session ID
     session_id = str(uuid.uuid4())
@@ -119,17 +200,26 @@ def get_or_create_session_id(cookies):
             return session_id  # Return the temporary session ID after timeout
         time.sleep(interval)
 
-    # Overwrite the temporary session ID with the one from the cookies
-    if "session_id" not in cookies:
+    # Overwrite the temporary session ID with the one from the cookies, unreadable when encrypted with another password
+    if not cookies.get("session_id"):
         cookies["session_id"] = session_id
         cookies.save()
     else:
         session_id = cookies["session_id"]
 
     return session_id
+
+
+@st.cache_resource
+def get_process_cookies_password():
+    """Cookies password of this process when none is configured, the cookies of other processes cannot be read"""
+    log_warning("The cookies password is not configured, returning athletes log in with Strava again after a restart")
+    return secrets.token_urlsafe(32)
+
+
 cookies = EncryptedCookieManager(
     prefix="my_app",  # Replace with your app's name or namespace
-    password="supersecret",  # Ensure this is secure
+    password=st.secrets.get("cookies", {}).get("password", os.getenv("COOKIES_PASSWORD")) or get_process_cookies_password(),
 )
 
 session_id = get_or_create_session_id(cookies)
@@ -152,9 +242,6 @@ def create_snowflake_session(connection_parameters):
             log_error(f"Failed to create Snowflake session: {e}")
             raise
 
-def final_date(d):
-    return d if isinstance(d, date) and not isinstance(d, datetime) else d.date()
-
 # Function to convert seconds to HH:MM:SS format
 def seconds_to_hhmmss(seconds):
     return str(timedelta(seconds=int(seconds)))
@@ -168,2816 +255,114 @@ def format_y_ticks(max_seconds):
 # Update the X-axis ticks dynamically
 def format_x_ticks(max_seconds):
     max_seconds = int(max_seconds)
-    ticks = [i for i in range(0, max_seconds + 1, max_seconds // 5)]  # 5 ticks
-    return {tick: seconds_to_hhmmss(tick) for tick in ticks}
-
-ATHLETE_LEVELS = ["Beginner", "Intermediate", "Confirmed"]
-
-TRAINING_SPORTS = ["Run", "Bike"]
-
-CYCLE_TYPES = ["Transition", "Fondamental", "Specific", "Pre-Compet", "Compet"]
-
-OBJECTIVE_SIZE = ["S", "M", "L", "XL"]
-
-OBJECTIVE_RACE = ["Finish", "Perf"]
-
-WEEK_DAYS = [
-    "Monday",
-    "Tuesday",
-    "Wednesday",
-    "Thursday",
-    "Friday",
-    "Saturday",
-    "Sunday",
-]
-
-ZONES = {
-    "Run": {
-        1: "Active Recovery",
-        2: "Endurance",
-        3: "Tempo",
-        4: "Lactate Threshold",
-        5: "VO2 Max",
-        6: "Anaerobic Capacity",
-        7: "Neuromuscular Power",
-    },
-    "Bike": {
-        1: "Active Recovery",
-        2: "Endurance",
-        3: "Tempo",
-        4: "Lactate Threshold",
-        5: "VO2 Max",
-        6: "Anaerobic Capacity",
-        7: "Neuromuscular Power",
-    },
-}
-
-TSS_BY_ZONE_BY_SPORT = {
-    "Run": {1: 50, 2: 60, 3: 80, 4: 100, 5: 150, 6: 250, 7: 500},
-    "Bike": {1: 50, 2: 60, 3: 80, 4: 100, 5: 150, 6: 250, 7: 500},
-}
-
-ZONE_RECOVERY_FACTOR_BY_SPORT = {
-    "Run": {1: 0, 2: 0.2, 3: 0.5, 4: 0.75, 5: 1, 6: 2, 7: 20},
-    "Bike": {1: 0, 2: 0.2, 3: 0.5, 4: 0.75, 5: 1, 6: 2, 7: 20},
-}
-
-TYPICAL_DURATION_FOR_INTERVALS_BY_ZONE_BY_SPORT = {
-    "Run": {1: 3600, 2: 3600, 3: 1200, 4: 600, 5: 180, 6: 60, 7: 12},
-    "Bike": {1: 3600, 2: 3600, 3: 1200, 4: 600, 5: 180, 6: 60, 7: 12},
-}
-
-SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH = {
-    "Run": {
-        "Beginner": {1: 8, 2: 9, 3: 11, 4: 12, 5: 13, 6: 14, 7: 20},
-        "Intermediate": {1: 9, 2: 10, 3: 12, 4: 14, 5: 16, 6: 18, 7: 24},
-        "Confirmed": {1: 10, 2: 11, 3: 13, 4: 15, 5: 17, 6: 19, 7: 26},
-    },
-    "Bike": {
-        "Beginner": {1: 18, 2: 22, 3: 26, 4: 29, 5: 33, 6: 38, 7: 45},
-        "Intermediate": {1: 22, 2: 26, 3: 30, 4: 34, 5: 38, 6: 42, 7: 50},
-        "Confirmed": {1: 26, 2: 30, 3: 34, 4: 38, 5: 42, 6: 46, 7: 55},
-    },
-}
-
-LONG_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE = {
-    "Run": {
-        "Finish": {
-            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
-        },
-        "Perf": {
-            "S": {"Beginner": 1.3, "Intermediate": 1.7, "Confirmed": 2},
-            "M": {"Beginner": 0.9, "Intermediate": 1.1, "Confirmed": 1.5},
-            "L": {"Beginner": 0.65, "Intermediate": 0.75, "Confirmed": 0.85},
-            "XL": {"Beginner": 0.65, "Intermediate": 0.70, "Confirmed": 0.75},
-        },
-    },
-    "Bike": {
-        "Finish": {
-            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
-        },
-        "Perf": {
-            "S": {"Beginner": 1.3, "Intermediate": 1.7, "Confirmed": 2},
-            "M": {"Beginner": 0.9, "Intermediate": 1.1, "Confirmed": 1.5},
-            "L": {"Beginner": 0.65, "Intermediate": 0.75, "Confirmed": 0.85},
-            "XL": {"Beginner": 0.65, "Intermediate": 0.70, "Confirmed": 0.75},
-        },
-    },
-}
-
-
-RACE_INTENSITY_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE = {
-    "Run": {
-        "Finish": {
-            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
-        },
-        "Perf": {
-            "S": {"Beginner": 0.8, "Intermediate": 0.8, "Confirmed": 0.8},
-            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "L": {"Beginner": 0.55, "Intermediate": 0.55, "Confirmed": 0.55},
-            "XL": {"Beginner": 0.40, "Intermediate": 0.40, "Confirmed": 0.40},
-        },
-    },
-    "Bike": {
-        "Finish": {
-            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
-        },
-        "Perf": {
-            "S": {"Beginner": 0.8, "Intermediate": 0.8, "Confirmed": 0.8},
-            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
-            "L": {"Beginner": 0.55, "Intermediate": 0.55, "Confirmed": 0.55},
-            "XL": {"Beginner": 0.40, "Intermediate": 0.40, "Confirmed": 0.40},
-        },
-    },
-}
-
-
-REGULAR_MAX_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL = {
-    "Run": {
-        "Finish": {
-            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
-            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
-            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
-            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
-        },
-        "Perf": {
-            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
-            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
-            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
-            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
-        },
-    },
-    "Bike": {
-        "Finish": {
-            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
-            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
-            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
-            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
-        },
-        "Perf": {
-            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
-            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
-            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
-            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
-        },
-    },
-}
-
-REGULAR_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL = {
-    "Run": {
-        "Finish": {
-            "S": {"Beginner": 45, "Intermediate": 60, "Confirmed": 75},
-            "M": {"Beginner": 55, "Intermediate": 70, "Confirmed": 85},
-            "L": {"Beginner": 65, "Intermediate": 80, "Confirmed": 95},
-            "XL": {"Beginner": 75, "Intermediate": 82, "Confirmed": 90},
-        },
-        "Perf": {
-            "S": {"Beginner": 60, "Intermediate": 70, "Confirmed": 80},
-            "M": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
-            "L": {"Beginner": 80, "Intermediate": 90, "Confirmed": 100},
-            "XL": {"Beginner": 90, "Intermediate": 100, "Confirmed": 110},
-        },
-    },
-    "Bike": {
-        "Finish": {
-            "S": {"Beginner": 45, "Intermediate": 60, "Confirmed": 75},
-            "M": {"Beginner": 55, "Intermediate": 70, "Confirmed": 85},
-            "L": {"Beginner": 65, "Intermediate": 80, "Confirmed": 95},
-            "XL": {"Beginner": 75, "Intermediate": 82, "Confirmed": 90},
-        },
-        "Perf": {
-            "S": {"Beginner": 60, "Intermediate": 70, "Confirmed": 80},
-            "M": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
-            "L": {"Beginner": 80, "Intermediate": 90, "Confirmed": 100},
-            "XL": {"Beginner": 90, "Intermediate": 100, "Confirmed": 110},
-        },
-    },
-}
-
-MAX_TSS_PER_DAY_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL = {
-    "Run": {
-        "Finish": {
-            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
-            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
-            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
-            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
-        },
-        "Perf": {
-            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
-            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
-            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
-            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
-        },
-    },
-    "Bike": {
-        "Finish": {
-            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
-            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
-            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
-            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
-        },
-        "Perf": {
-            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
-            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
-            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
-            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
-        },
-    },
-}
-
-
-MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE = {
-    "Perf": {
-        "S": {
-            "Fondamental": 365,
-            "Specific": 90,
-            "Pre-Compet": 0,
-            "Compet": 7,
-            "Transition": 0,
-        },
-        "M": {
-            "Fondamental": 365,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-        "L": {
-            "Fondamental": 365,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-        "XL": {
-            "Fondamental": 720,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-    },
-    "Finish": {
-        "S": {
-            "Fondamental": 365,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-        "M": {
-            "Fondamental": 365,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-        "L": {
-            "Fondamental": 365,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-        "XL": {
-            "Fondamental": 720,
-            "Specific": 90,
-            "Pre-Compet": 7,
-            "Compet": 7,
-            "Transition": 0,
-        },
-    },
-}
-
-COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE = {
-    "Run": {
-        "Perf": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
-        "Finish": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
-    },
-    "Bike": {
-        "Perf": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
-        "Finish": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
-    },
-}
-
-ZONE_REPARTITION_BY_TIME_BY_WEEK_BY_CYCLE = {
-    "Confirmed": {
-        "Fondamental": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Specific": {
-            "S": {1: 0.4, 2: 0.2, 3: 0.2, 4: 0.12, 5: 0.06, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Pre-Compet": {
-            "S": {1: 0.4, 2: 0.2, 3: 0.2, 4: 0.12, 5: 0.06, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Compet": {
-            "S": {1: 0.4, 2: 0.2, 3: 0.2, 4: 0.12, 5: 0.06, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Transition": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-    },
-    "Beginner": {
-        "Fondamental": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Specific": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Pre-Compet": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Compet": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Transition": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-    },
-    "Intermediate": {
-        "Fondamental": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Specific": {
-            "S": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.35, 3: 0.13, 4: 0.07, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Pre-Compet": {
-            "S": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.35, 3: 0.13, 4: 0.07, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Compet": {
-            "S": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.35, 3: 0.13, 4: 0.07, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-        "Transition": {
-            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
-        },
-    },
-}
-
-KEY_WORKOUTS_BY_CYCLE = {
-    "Fondamental": ["LongIntensity"],
-    "Specific": ["Long", "RaceIntensity"],
-    "Pre-Compet": ["ShortIntensity", "RaceIntensity"],
-    "Compet": [],
-    "Transition": ["Long", "Tempo"],
-}
-
-
-def determineEventSize(distance, sport, duration=None):
-    if sport == "Run":
-        if distance <= 12:
-            return "S"
-        elif distance <= 23:
-            return "M"
-        elif distance <= 45:
-            return "L"
-        else:
-            return "XL"
-    elif sport == "Bike":
-        if distance <= 40:
-            return "S"
-        elif distance <= 80:
-            return "M"
-        elif distance <= 130:
-            return "L"
-        else:
-            return "XL"
-
-
-def determineRaceZone(eventSize, objective):
-    if objective == "Finish":
-        return 2
-    elif objective == "Perf":
-        if eventSize == "S":
-            return 5
-        elif eventSize == "M":
-            return 4
-        elif eventSize == "L":
-            return 3
-        else:
-            return 2
-
-
-def calculateEventTss(raceZone, sport, targetTimeInMinutes):
-    return TSS_BY_ZONE_BY_SPORT[sport][raceZone] * targetTimeInMinutes / 60
-
-
-def computeFondamentalWeeksRequired(
-    currentLoad,
-    currentCycleNumber,
-    currentIndexInCycle,
-    endLoad,
-    weeklyTssIncreaseRate,
-    cycleLength,
-    nextRestingWeek,
-    lastWeeksTakeways,
-):
-    workingLoads = []
-    indexInCycle = currentIndexInCycle
-    cycleNumber = currentCycleNumber
-
-    if currentLoad < endLoad * 0.95:
-        while True:
-            if nextRestingWeek == 0:
-                indexInCycle += 1
-                restingLoad = currentLoad * 0.6
-                workingLoads.append(
-                    {
-                        "theoreticalWeeklyTSS": int(restingLoad),
-                        "theoreticalResting": True,
-                        "cycleNumber": cycleNumber,
-                        "indexInCycle": indexInCycle,
-                    }
-                )
-                # After inserting a resting week, now set nextRestingWeek to cycleLength - 1
-                nextRestingWeek = cycleLength - 1
-                cycleNumber += 1
-                indexInCycle = 0
-            else:
-                # Working week logic
-                currentLoad *= 1 + weeklyTssIncreaseRate
-                indexInCycle += 1
-                workingLoads.append(
-                    {
-                        "theoreticalWeeklyTSS": min(endLoad, int(currentLoad)),
-                        "theoreticalResting": False,
-                        "cycleNumber": cycleNumber,
-                        "indexInCycle": indexInCycle,
-                        "keyWorkouts": KEY_WORKOUTS_BY_CYCLE["Fondamental"],
-                    }
-                )
-                nextRestingWeek -= 1
-                if currentLoad > endLoad * 0.95:
-                    break
-
-    for week in workingLoads:
-        week["cycleType"] = "Fondamental"
-    return workingLoads, nextRestingWeek, cycleNumber
-
-
-def analyzeMacrocycle(macrocycle, completedWorkouts, raceZone, mainSport):
-    pass
-
-
-def checkWorkoutValidity(actualWorkout, theoreticalWorkout):
-    if actualWorkout["activity"] != theoreticalWorkout["activity"]:
-        return 0
-    if theoreticalWorkout["workoutType"] == "Long":
-        if actualWorkout["tss"] > theoreticalWorkout["tss"] * 0.8:
-            actualWorkout["workoutType"] = "Long"
-            return 1
-        else:
-            return 0
-    if theoreticalWorkout["workoutType"] == "LongIntensity":
-        if (
-            actualWorkout["secondsInZone"][4]
-            * 3600
-            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][4]
-            + actualWorkout["secondsInZone"][3]
-            * 3600
-            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][3]
-            > theoreticalWorkout["tss"] * 0.8
-        ):
-            actualWorkout["workoutType"] = "LongIntensity"
-            return 1
-        else:
-            return 0
-    if theoreticalWorkout["workoutType"] == "ShortIntensity":
-        if (
-            actualWorkout["secondsInZone"][5]
-            * 3600
-            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][5]
-            + actualWorkout["secondsInZone"][6]
-            * 3600
-            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][6]
-            + actualWorkout["secondsInZone"][7]
-            * 3600
-            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][7]
-            > theoreticalWorkout["tss"] * 0.8
-        ):
-            actualWorkout["workoutType"] = "ShortIntensity"
-            return 1
-        else:
-            return 0
-    if "tss" in actualWorkout:
-        if actualWorkout["tss"] > theoreticalWorkout["tss"] * 0.8:
-            return 1
-        else:
-            return 0
-
-
-def analyzeMicrocycle(microcycle, completedWorkouts, raceZone, mainSport):
-    actualWeekWorkouts = [
-        workout
-        for workout in completedWorkouts
-        if workout["date"] >= microcycle["startDate"]
-        and workout["date"] <= microcycle["endDate"]
-    ]
-    totalTSS = sum([workout.get("tss", 0) for workout in actualWeekWorkouts])
-    microcycle["actualTSS"] = totalTSS
-
-    # to a time repartition tss aggregation
-    actualSecondsInZone = {zone: 0 for zone in ZONES[mainSport].keys()}
-    for workout in actualWeekWorkouts:
-        for zone, tss in workout["secondsInZone"].items():
-            actualSecondsInZone[zone] += workout["secondsInZone"][zone]
-    microcycle["actualSecondsInZone"] = actualSecondsInZone
-
-    theroeticalTimeSpentWeekInSeconds = (
-        microcycle["theoreticalWeeklyTSS"]
-        * 3600
-        / sum(
-            [
-                TSS_BY_ZONE_BY_SPORT[mainSport][zone]
-                * microcycle["timeInZoneRepartition"][zone]
-                for zone in ZONES[mainSport].keys()
-            ]
-        )
-    )
-    microcycle["theoreticalTimeSpentWeek"] = timedelta(
-        seconds=theroeticalTimeSpentWeekInSeconds
-    )
-
-    theoreticalTimeInZone = {
-        zone: microcycle["timeInZoneRepartition"][zone]
-        * theroeticalTimeSpentWeekInSeconds
-        for zone in ZONES[mainSport].keys()
-    }
-    microcycle["theoreticalTimeInZone"] = theoreticalTimeInZone
-
-    microcycle["deltaTimeInZone"] = {
-        zone: microcycle["actualSecondsInZone"][zone] - theoreticalTimeInZone[zone]
-        for zone in ZONES[mainSport].keys()
-    }
-
-    maxTSSWorkout = 0
-    # Check if the theoreticalLongWorkoutTSS was respected
-    microcycle["longWorkoutDone"] = False
-    for workout in actualWeekWorkouts:
-        if workout.get("tss", 0) > maxTSSWorkout:
-            maxTSSWorkout = workout.get("tss", 0)
-        if workout.get("tss", 0) > microcycle["theoreticalLongWorkoutTSS"] * 0.85:
-            microcycle["longWorkoutDone"] = True
-            break
-    microcycle["actualLongWorkoutTSS"] = maxTSSWorkout
-
-    # Check if the theoreticalRaceIntensityTSS was respected
-    maxRaceIntensityTSS = 0
-    microcycle["RaceIntensityDone"] = False
-    for workout in actualWeekWorkouts:
-        if (
-            raceZone in workout["secondsInZone"]
-            and workout["secondsInZone"][raceZone] > maxRaceIntensityTSS
-        ):
-            maxRaceIntensityTSS = (
-                workout["secondsInZone"][raceZone]
-                * TSS_BY_ZONE_BY_SPORT[mainSport][raceZone]
-                / 3600
-            )
-            if maxRaceIntensityTSS > microcycle["theoreticalRaceIntensityTSS"] * 0.85:
-                microcycle["RaceIntensityDone"] = True
-                break
-    microcycle["actualRaceIntensityTSS"] = maxRaceIntensityTSS
-
-    # Check if the long intensity workout was respected
-    maxLongIntensityTSS = 0
-    microcycle["LongIntensityDone"] = False
-    for workout in actualWeekWorkouts:
-        if (
-            4 in workout["secondsInZone"] and 3 in workout["secondsInZone"]
-        ) and workout["secondsInZone"][4] + workout["secondsInZone"][
-            3
-        ] > maxLongIntensityTSS:
-            maxLongIntensityTSS = (
-                workout["secondsInZone"][4] * TSS_BY_ZONE_BY_SPORT[mainSport][4]
-                + workout["secondsInZone"][3] * TSS_BY_ZONE_BY_SPORT[mainSport][3]
-            ) / 60
-            if maxLongIntensityTSS > microcycle["theoreticalLongIntensityTSS"] * 0.85:
-                microcycle["LongIntensityDone"] = True
-                break
-    microcycle["actualLongIntensityTSS"] = maxLongIntensityTSS
-
-    # Check if the short intensity workout was respected
-    maxShortIntensityTSS = 0
-    microcycle["ShortIntensityDone"] = False
-    for workout in actualWeekWorkouts:
-        if (
-            5 in workout["secondsInZone"]
-            and 6 in workout["secondsInZone"]
-            and 7 in workout["secondsInZone"]
-        ) and workout["secondsInZone"][5] + workout["secondsInZone"][6] + workout[
-            "secondsInZone"
-        ][7] > maxShortIntensityTSS:
-            maxShortIntensityTSS = (
-                workout["secondsInZone"][5] * TSS_BY_ZONE_BY_SPORT[mainSport][5]
-                + workout["secondsInZone"][6] * TSS_BY_ZONE_BY_SPORT[mainSport][6]
-                + workout["secondsInZone"][7] * TSS_BY_ZONE_BY_SPORT[mainSport][7]
-            ) / 60
-            if maxShortIntensityTSS > microcycle["theoreticalShortIntensityTSS"] * 0.85:
-                microcycle["ShortIntensityDone"] = True
-                break
-    microcycle["actualShortIntensityTSS"] = maxShortIntensityTSS
-
-    # Check if it is a rest week
-
-    if microcycle["theoreticalResting"]:
-        if totalTSS <= microcycle["theoreticalWeeklyTSS"] * 1.2:
-            microcycle["actualResting"] = True
-        else:
-            microcycle["actualResting"] = False
-            microcycle["nextWeekGuidelines"] = "Rest"
-    else:
-        if totalTSS <= microcycle["theoreticalWeeklyTSS"] * 0.6:
-            microcycle["actualResting"] = True
-            microcycle["nextWeekGuidelines"] = "Normal"
-        else:
-            microcycle["actualResting"] = False
-
-    missingKeyWorkouts = []
-    missingKeyWorkoutsPlanned = []
-    for workout in microcycle["keyWorkouts"]:
-        # Find the theoretical workout in the microcycle dayByDay
-        theoreticalWorkout = None
-        for day in microcycle["dayByDay"]:
-            for plannedWorkout in microcycle["dayByDay"][day]:
-                if plannedWorkout["workoutType"] == workout:
-                    theoreticalWorkout = plannedWorkout
-                    break
-        if theoreticalWorkout is None:
-            missingKeyWorkoutsPlanned.append(workout)
-
-        done = False
-        if theoreticalWorkout is not None:
-            for actualWorkout in actualWeekWorkouts:
-                if checkWorkoutValidity(actualWorkout, theoreticalWorkout) > 0.8:
-                    done = True
-                    break
-        if not done:
-            missingKeyWorkouts.append(workout)
-    microcycle["missingKeyWorkouts"] = missingKeyWorkouts
-
-    microcycle["analyzed"] = True
-
-
-def planWeekLoads(
-    loadsInfo,
-    datesInfo,
-    raceInfo,
-    weekInfo,
-    currentPlannedMacrocycles,
-    currentPlannedMicrocycles,
-    completedWorkouts,
-    race_number
-):
-    log_debug(f"Planning week with loadsInfo: {loadsInfo}, datesInfo: {datesInfo}, raceInfo: {raceInfo}, weekInfo: {weekInfo}, currentPlannedMacrocycles: {currentPlannedMacrocycles}, currentPlannedMicrocycles: {currentPlannedMicrocycles}, completedWorkouts: {completedWorkouts}")
-
-    totalMacrocycles = currentPlannedMacrocycles.copy()
-    totalMicrocycles = currentPlannedMicrocycles.copy()
-
-    pastMacrocycles = [
-        macrocycle
-        for macrocycle in totalMacrocycles
-        if macrocycle["endDate"] < datesInfo["currentDate"]
-    ]
-    pastMicrocycles = [
-        microcycle
-        for microcycle in totalMicrocycles
-        if microcycle["endDate"] < datesInfo["currentDate"]
-    ]
-
-    currentMacrocycle = {}
-    for i, macrocycle in enumerate(totalMacrocycles):
-        if (
-            macrocycle["endDate"] >= datesInfo["currentDate"]
-            and macrocycle["startDate"] <= datesInfo["currentDate"]
-        ):
-            currentMacrocycle = totalMacrocycles[i]
-            break
-    currentMicrocycle = {}
-    for i, microcycle in enumerate(totalMicrocycles):
-        if (
-            microcycle["endDate"] >= datesInfo["currentDate"]
-            and microcycle["startDate"] <= datesInfo["currentDate"]
-        ):
-            currentMicrocycle = totalMicrocycles[i]
-            break
-
-    futureMacrocycles = [
-        macrocycle
-        for macrocycle in totalMacrocycles
-        if macrocycle["startDate"] > datesInfo["currentDate"]
-    ]
-    futureMicrocycles = [
-        microcycle
-        for microcycle in totalMicrocycles
-        if microcycle["startDate"] > datesInfo["currentDate"]
-    ]
-
-    # Check if the past was analyzed, if not analyze it
-    if pastMacrocycles:
-        for macrocycle in pastMacrocycles:
-            if "analyzed" not in macrocycle or not macrocycle["analyzed"]:
-                analyzeMacrocycle(
-                    macrocycle,
-                    completedWorkouts,
-                    raceInfo["raceZone"],
-                    raceInfo["mainSport"],
-                )
-                macrocycle["analyzed"] = True
-    if pastMicrocycles:
-        for microcycle in pastMicrocycles:
-            if "analyzed" not in microcycle or not microcycle["analyzed"]:
-                analyzeMicrocycle(
-                    microcycle,
-                    completedWorkouts,
-                    raceInfo["raceZone"],
-                    raceInfo["mainSport"],
-                )
-
-    # First compare what was completed to what was planned
-    lastWeeksTakeaways = currentLoadStatus(pastMicrocycles)
-    if "declaredHandableLoad" in loadsInfo:
-        # startLoad = loadsInfo["declaredHandableLoad"]
-        startLoad = loadsInfo["startLoad"]
-    else:
-        startLoad = lastWeeksTakeaways["currentHandableLoad"]
-    # Compare this with the current microcycle, are we corresponding to the plan?
-
-    if "nextRestingWeek" in loadsInfo and loadsInfo["nextRestingWeek"] is not None:
-        nextRestingWeek = loadsInfo["nextRestingWeek"]
-    else:
-        nextRestingWeek = (
-            lastWeeksTakeaways["nextRestingWeek"] - 1
-            if lastWeeksTakeaways["nextRestingWeek"] > 0
-            else 0
-        )
-
-    if currentMicrocycle != {}:
-        compareCurrentWeekWithPlannedWeekAndReplanIfNeeded(
-            completedWorkouts=completedWorkouts,
-            currentMicrocycle=currentMicrocycle,
-            startLoad=startLoad,
-            currentDay=datesInfo["currentDate"].weekday(),
-            lastWeeksTakeaways=lastWeeksTakeaways,
-            maxTssPerDay=loadsInfo["maxTssPerDay"],
-            mainSport=raceInfo["mainSport"],
-        )
-
-    nextRestingWeek = nextRestingWeek - 1 if nextRestingWeek > 0 else 0
-    if currentMicrocycle.get("actualResting", None) or currentMicrocycle.get(
-        "theoreticalResting", None
-    ):
-        nextRestingWeek = loadsInfo["cycleLength"]
-
-    # Compute what would be the ideal fondamental weeks
-    fondamentalWeeks, nextRestingWeek, lastCycleNumber = (
-        computeFondamentalWeeksRequired(
-            startLoad * (1 + loadsInfo["weeklyTssIncreaseRate"]),
-            currentMicrocycle.get("cycleNumber", 1),
-            currentMicrocycle.get("indexInCycle", 0),
-            loadsInfo["endLoad"],
-            loadsInfo["weeklyTssIncreaseRate"],
-            loadsInfo["cycleLength"],
-            nextRestingWeek,
-            lastWeeksTakeaways,
-        )
-    )
-    numberOfFondamentalWeeks = len(fondamentalWeeks)
-
-    log_debug("Fondamental weeks computed")
-    log_debug(fondamentalWeeks)
-
-    # Let's compute what should be the next week macrocycle
-    currentStep = CYCLE_TYPES[-1]
-    currentPlanningDate = datesInfo["endDate"]
-
-    dateOfStartPreComp = (
-        datesInfo["endDate"]
-        - timedelta(
-            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                raceInfo["objective"]
-            ][raceInfo["eventSize"]]["Pre-Compet"]
-        )
-        - timedelta(
-            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                raceInfo["objective"]
-            ][raceInfo["eventSize"]]["Compet"]
-        )
-        + timedelta(days=1)
-    )
-    
-    
-    daysAhead = 7 - datesInfo["currentDate"].weekday() % 7
-    if daysAhead == 0:
-        daysAhead = 7
-    nextMondayDate = final_date(datesInfo["currentDate"] + timedelta(days=(daysAhead)))
-
-    mondayBeginningOfPreComp = final_date(dateOfStartPreComp - timedelta(
-        days=dateOfStartPreComp.weekday()
-    ))
-    numberOfWeeksAvailableFondSpe =round((
-        mondayBeginningOfPreComp
-        - nextMondayDate
-    ).days / 7) # begins after the current week
-    if currentMicrocycle == {} and race_number != 0 and datesInfo["currentDate"].weekday() < 6:
-        numberOfWeeksAvailableFondSpe += 1
-    if dateOfStartPreComp.weekday() != 0:
-        numberOfWeeksAvailableFondSpe += 1
-    log_info(
-        f"next monday date: {nextMondayDate} Date of start precomp: {dateOfStartPreComp}, monday before precomp: {mondayBeginningOfPreComp}, number of weeks available fond spe: {numberOfWeeksAvailableFondSpe}, current microcycle: {currentMicrocycle}, race number: {race_number}, date of start precomp weekday: {dateOfStartPreComp.weekday()}, current date {datesInfo['currentDate']}, number of days: {(dateOfStartPreComp - date(datesInfo['currentDate'].year, datesInfo['currentDate'].month, datesInfo['currentDate'].day)).days}"
-    )
-
-    specificWeeks = []
-
-    if numberOfFondamentalWeeks > numberOfWeeksAvailableFondSpe:
-        fondamentalWeeks = fondamentalWeeks[:numberOfWeeksAvailableFondSpe]
-        # if last week is rest, change it to a normal week
-        lastRestingWeekIndex = 0
-        for i in range(len(fondamentalWeeks)):
-            if fondamentalWeeks[i].get("actualResting", None) or fondamentalWeeks[
-                i
-            ].get("theoreticalResting", None):
-                lastRestingWeekIndex = i
-
-        nextRestingWeek = len(fondamentalWeeks) - lastRestingWeekIndex - 2
-        if len(fondamentalWeeks) > 1:
-            currentCycleNumber = (
-                fondamentalWeeks[-1]["cycleNumber"] + 1
-                if fondamentalWeeks[-1]["indexInCycle"] == loadsInfo["cycleLength"] - 1
-                else fondamentalWeeks[-1]["cycleNumber"]
-            )
-            currentIndexInCycle = (
-                fondamentalWeeks[-1]["indexInCycle"] + 1
-                if fondamentalWeeks[-1]["indexInCycle"] < loadsInfo["cycleLength"] - 1
-                else 1
-            )
-        else:
-            currentCycleNumber = 1
-            currentIndexInCycle = 1
-    else:
-        if len(fondamentalWeeks) > 1:
-            number_of_specific_weeks = (
-                numberOfWeeksAvailableFondSpe - numberOfFondamentalWeeks
-            )
-            currentCycleNumber = (
-                fondamentalWeeks[-1]["cycleNumber"] + 1
-                if fondamentalWeeks[-1]["indexInCycle"] == loadsInfo["cycleLength"] - 1
-                else fondamentalWeeks[-1]["cycleNumber"]
-            )
-            currentIndexInCycle = (
-                fondamentalWeeks[-1]["indexInCycle"] + 1
-                if fondamentalWeeks[-1]["indexInCycle"] < loadsInfo["cycleLength"] - 1
-                else 1
-            )
-            lastRestingWeekIndex = 0
-            for i in range(len(fondamentalWeeks)):
-                if fondamentalWeeks[i].get("actualResting", None) or fondamentalWeeks[
-                    i
-                ].get("theoreticalResting", None):
-                    lastRestingWeekIndex = i
-            nextRestingWeek = len(fondamentalWeeks) - lastRestingWeekIndex - 2
-        else:
-            number_of_specific_weeks = numberOfWeeksAvailableFondSpe
-            currentCycleNumber = 1
-            currentIndexInCycle = 1
-            nextRestingWeek = loadsInfo["cycleLength"] - 1
-        
-        if race_number == 0 and loadsInfo["declaredNextRestingWeek"] is not None:
-            nextRestingWeek = loadsInfo["declaredNextRestingWeek"]
-        
-        specificWeeks = getSpecificWeeks(
-            number_of_specific_weeks,
-            loadsInfo["endLoad"],
-            loadsInfo["cycleLength"],
-            nextRestingWeek,
-            currentCycleNumber + 1,
-            currentIndexInCycle,
-        )
-        
-    log_info(f"number of fondamentalWeeks: {len(fondamentalWeeks)}, number of specific weeks: {len(specificWeeks)}")
-
-    planBeforePreComp = fondamentalWeeks + specificWeeks
-
-    # Add the key workouts formats:
-    currentHandableBiggestWorkout = lastWeeksTakeaways.get(
-        "biggestWorkout", loadsInfo["currentLongRunTSS"]
-    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
-    currentHandableShortIntensity = lastWeeksTakeaways.get(
-        "currentShortIntensity", 10
-    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
-    currentHandableRaceIntensity = lastWeeksTakeaways.get(
-        "currentRaceIntensity", 15
-    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
-    currentHandableLongIntensity = lastWeeksTakeaways.get(
-        "currentLongIntensity", 15
-    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
-
-    if loadsInfo.get("currentLongRunTSS", None) is not None:
-        currentHandableBiggestWorkout = loadsInfo["currentLongRunTSS"]
-    if loadsInfo.get("currentShortIntensityTSS", None) is not None:
-        currentHandableShortIntensity = loadsInfo["currentShortIntensityTSS"]
-    if loadsInfo.get("currentRaceIntensityTSS", None) is not None:
-        currentHandableRaceIntensity = loadsInfo["currentRaceIntensityTSS"]
-    if loadsInfo.get("currentLongIntensityTSS", None) is not None:
-        currentHandableLongIntensity = loadsInfo["currentLongIntensityTSS"]
-
-    for i, week in enumerate(planBeforePreComp):
-        ratio = 1
-        if week["theoreticalResting"]:
-            ratio = 0.7
-        if "Long" in week.get("keyWorkouts", []):
-            week["theoreticalLongWorkoutTSS"] = currentHandableBiggestWorkout * ratio
-            number_of_future_weeks_having_long_in_key_workouts = 0
-            for future_week in planBeforePreComp[i + 1 :]:
-                if "Long" in future_week.get("keyWorkouts", []):
-                    number_of_future_weeks_having_long_in_key_workouts += 1
-
-            currentHandableBiggestWorkout += (
-                loadsInfo.get("finalLongRunTSS", loadsInfo["maxTssPerWorkout"])
-                - currentHandableBiggestWorkout
-            ) / (number_of_future_weeks_having_long_in_key_workouts + 1)
-
-        if "ShortIntensity" in week.get("keyWorkouts", []):
-            week["theoreticalShortIntensityTSS"] = currentHandableShortIntensity * ratio
-            number_of_future_weeks_having_short_in_key_workouts = 0
-            for future_week in planBeforePreComp[i + 1 :]:
-                if "ShortIntensity" in future_week.get("keyWorkouts", []):
-                    number_of_future_weeks_having_short_in_key_workouts += 1
-
-            currentHandableShortIntensity += (
-                loadsInfo.get("finalShortIntensityTSS", loadsInfo["maxTssPerWorkout"])
-                - currentHandableShortIntensity
-            ) / (number_of_future_weeks_having_short_in_key_workouts + 1)
-
-        if "theoreticalRaceIntensityTSS" in week.get("keyWorkouts", []):
-            week["theoreticalRaceIntensityTSS"] = currentHandableRaceIntensity * ratio
-            number_of_future_week_having_race_in_key_workouts = 0
-            for future_week in planBeforePreComp[i + 1 :]:
-                if "RaceIntensity" in future_week.get("keyWorkouts", []):
-                    number_of_future_week_having_race_in_key_workouts += 1
-            currentHandableRaceIntensity += (
-                loadsInfo.get("finalRaceIntensityTSS", loadsInfo["maxTssPerWorkout"])
-                - currentHandableRaceIntensity
-            ) / (number_of_future_week_having_race_in_key_workouts + 1)
-
-        if "LongIntensity" in week.get("keyWorkouts", []):
-            week["theoreticalLongIntensityTSS"] = currentHandableLongIntensity * ratio
-            number_of_future_week_having_long_intensity_in_key_workouts = 0
-            for future_week in planBeforePreComp[i + 1 :]:
-                if "LongIntensity" in future_week.get("keyWorkouts", []):
-                    number_of_future_week_having_long_intensity_in_key_workouts += 1
-            currentHandableLongIntensity += (
-                loadsInfo.get("finalLongIntensityTSS", loadsInfo["maxTssPerWorkout"])
-                - currentHandableLongIntensity
-            ) / (number_of_future_week_having_long_intensity_in_key_workouts + 1)
-
-    log_debug("Current Step before checking competition cycle")
-    log_debug(currentStep)
-    if currentStep == "Compet":  # Edit or Create the competition cycle
-        # Try to find the competition cycle
-        found = False
-        for i, macrocycle in enumerate(totalMacrocycles):
-            if macrocycle["cycleType"] == "Compet":
-                found = True
-                competitionMacrocycle = update_macrocycle(
-                    macrocycle,
-                    {
-                        "endDate": datesInfo["endDate"],
-                        "startDate": max(final_date(datesInfo["endDate"]
-                        - timedelta(
-                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                                raceInfo["objective"]
-                            ][raceInfo["eventSize"]]["Compet"]
-                        ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
-                        "totalTSS": raceInfo["eventTSS"]
-                        * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
-                            raceInfo["mainSport"]
-                        ][raceInfo["objective"]][raceInfo["eventSize"]],
-                    },
-                )
-        # if not present, create it
-        if not found:
-            log_debug("Creating competition macrocycle")
-            competitionMacrocycle = {
-                "cycleType": "Compet",
-                "startDate": max(final_date(datesInfo["endDate"]
-                - timedelta(
-                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                        raceInfo["objective"]
-                    ][raceInfo["eventSize"]]["Compet"]
-                ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
-                "endDate": datesInfo["endDate"],
-                "totalTSS": raceInfo["eventTSS"]
-                * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
-                    raceInfo["mainSport"]
-                ][raceInfo["objective"]][raceInfo["eventSize"]],
-            }
-
-        # Do the same with the microcycle
-        found = False
-        for i, microcycle in enumerate(totalMicrocycles):
-            if microcycle["cycleType"] == "Compet":
-                found = True
-                competitionMicrocycle = update_microcycle(
-                    microcycle,
-                    {
-                        "endDate": datesInfo["endDate"],
-                        "startDate": max(final_date(datesInfo["endDate"]
-                        - timedelta(
-                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                                raceInfo["objective"]
-                            ][raceInfo["eventSize"]]["Compet"]
-                        ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
-                        "theoreticalWeeklyTSS": raceInfo["eventTSS"]
-                        * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
-                            raceInfo["mainSport"]
-                        ][raceInfo["objective"]][raceInfo["eventSize"]],
-                    },
-                )
-                currentPlanningDate = competitionMicrocycle["startDate"]
-        if not found:
-            log_debug("Creating competition microcycle")
-            competitionMicrocycle = {
-                "cycleType": "Compet",
-                "startDate": max(final_date(datesInfo["endDate"]
-                - timedelta(
-                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                        raceInfo["objective"]
-                    ][raceInfo["eventSize"]]["Compet"]
-                ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
-                "endDate": datesInfo["endDate"],
-                "theoreticalWeeklyTSS": raceInfo["eventTSS"]
-                * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
-                    raceInfo["mainSport"]
-                ][raceInfo["objective"]][raceInfo["eventSize"]],
-            }
-            currentPlanningDate = competitionMicrocycle["startDate"]
-        log_info("Current planning date")
-        log_info(currentPlanningDate)
-        log_info(datesInfo["currentDate"])
-        if datesInfo["currentDate"] >= datetime(
-            currentPlanningDate.year, currentPlanningDate.month, currentPlanningDate.day
-        ):
-            # We are in the competition cycle
-            log_info("We are in the competition cycle")
-            planAnotherWeek = False
-        else:
-            log_info("We are before the competition cycle")
-            currentStep = "Pre-Compet"
-    precompetMicrocycle = {}
-    precompetMacrocycle = {}
-    if currentStep == "Pre-Compet":
-        found = False
-        for i, macrocycle in enumerate(totalMacrocycles):
-            if macrocycle["cycleType"] == "Pre-Compet":
-                found = True
-                log_debug("Updating precompet macrocycle")
-                precompetMacrocycle = update_macrocycle(
-                    macrocycle,
-                    {
-                        "endDate": competitionMacrocycle["startDate"]
-                        - timedelta(days=1),
-                        "startDate": max(final_date(competitionMacrocycle["startDate"]
-                        - timedelta(
-                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                                raceInfo["objective"]
-                            ][raceInfo["eventSize"]]["Pre-Compet"]
-                        )), final_date(datesInfo["currentDate"])),
-                        "totalTSS": loadsInfo["endLoad"]
-                        / 2
-                        * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
-                            - timedelta(
-                                days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                                    raceInfo["objective"]
-                                ][raceInfo["eventSize"]]["Pre-Compet"]
-                            )), final_date(datesInfo["currentDate"]))).days + 1)
-                        / 7,
-                        "theoreticalResting": True,
-                    },
-                )
-        if not found:
-            log_debug("Creating precompet macrocycle")
-            precompetMacrocycle = {
-                "cycleType": "Pre-Compet",
-                "startDate": max(final_date(competitionMacrocycle["startDate"]
-                - timedelta(
-                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                        raceInfo["objective"]
-                    ][raceInfo["eventSize"]]["Pre-Compet"]
-                )), final_date(datesInfo["currentDate"])),
-                "endDate": competitionMacrocycle["startDate"] - timedelta(days=1),
-                "theoreticalWeeklyTSS": loadsInfo["endLoad"]
-                / 2
-                * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
-                - timedelta(
-                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                        raceInfo["objective"]
-                    ][raceInfo["eventSize"]]["Pre-Compet"]
-                )), final_date(datesInfo["currentDate"]))).days + 1)
-                / 7,
-                "theoreticalResting": True,
-            }
-        found = False
-        for i, microcycle in enumerate(totalMicrocycles):
-            if microcycle["cycleType"] == "Pre-Compet":
-                log_debug("Updating precompet microcycle")
-                found = True
-                precompetMicrocycle = update_microcycle(
-                    microcycle,
-                    {
-                        "endDate": competitionMicrocycle["startDate"]
-                        - timedelta(days=1),
-                        "startDate": max(final_date(competitionMicrocycle["startDate"]
-                        - timedelta(
-                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                                raceInfo["objective"]
-                            ][raceInfo["eventSize"]]["Pre-Compet"]
-                        )), final_date(datesInfo["currentDate"])),
-                        "theoreticalWeeklyTSS": loadsInfo["endLoad"]
-                        / 2
-                        * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
-                            - timedelta(
-                                days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                                    raceInfo["objective"]
-                                ][raceInfo["eventSize"]]["Pre-Compet"]
-                            )), final_date(datesInfo["currentDate"]))).days + 1)
-                        / 7,
-                        "theoreticalResting": True,
-                    },
-                )
-                currentPlanningDate = precompetMicrocycle["startDate"]
-        if not found:
-            log_debug("Creating precompet microcycle")
-            precompetMicrocycle = {
-                "cycleType": "Pre-Compet",
-                "startDate": max(final_date(competitionMicrocycle["startDate"]
-                - timedelta(
-                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                        raceInfo["objective"]
-                    ][raceInfo["eventSize"]]["Pre-Compet"]
-                )), final_date(datesInfo["currentDate"])),
-                "endDate": competitionMicrocycle["startDate"] - timedelta(days=1),
-                "theoreticalWeeklyTSS": loadsInfo["endLoad"]
-                / 2
-                * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
-                - timedelta(
-                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
-                        raceInfo["objective"]
-                    ][raceInfo["eventSize"]]["Pre-Compet"]
-                )), final_date(datesInfo["currentDate"]))).days + 1)
-                / 7,
-                "theoreticalResting": True,
-            }
-            currentPlanningDate = precompetMicrocycle["startDate"]
-        log_debug(f"Current planning date {currentPlanningDate}. Current date {datesInfo['currentDate']}")
-
-        if datesInfo["currentDate"] >= datetime(
-            currentPlanningDate.year, currentPlanningDate.month, currentPlanningDate.day
-        ):
-            # We are in the precompet cycle
-            log_debug("We are in the precompet cycle")
-            planAnotherWeek = False
-        else:
-            log_debug("We are before the precompet cycle")
-            currentStep = "Before Pre Comp"
-    
-    newPlanBeforePreComp = []
-    
-    if currentStep == "Before Pre Comp":
-        # We begin next monday after current date
-
-        if currentMicrocycle == {} and race_number == 0:
-            # Add a currentMicrocycle
-            currentMicrocycleBeforePreComp = {
-                "cycleType": "Fondamental",
-                "startDate": datesInfo["currentDate"],
-                "endDate": datesInfo["currentDate"]+timedelta(days=6-datesInfo["currentDate"].weekday()),
-                "theoreticalWeeklyTSS": startLoad*((6-datesInfo["currentDate"].weekday())/7) if loadsInfo.get("nextRestingWeek", 4) >=1  else startLoad*((6-datesInfo["currentDate"].weekday())/7/2),
-                "theoreticalResting": loadsInfo.get("nextRestingWeek", 4) <1,
-                "keyWorkouts": [],
-                "dayByDay": {},
-            }
-            log_debug(f"Creating current microcycle {currentMicrocycleBeforePreComp}")
-            newPlanBeforePreComp.append(currentMicrocycleBeforePreComp)
-        
-        
-        beginningOfNextWeek = (
-            datesInfo["currentDate"]
-            + timedelta(days=(7 - datesInfo["currentDate"].weekday()))
-        )
-        # Remove comp and precomp from the futureMicrocycles
-        futureMicrocycles = [
-            microcycle
-            for microcycle in futureMicrocycles
-            if microcycle["cycleType"] not in ["Pre-Compet", "Compet"]
-        ]
-        # order them by date
-        futureMicrocycles = sorted(futureMicrocycles, key=lambda x: x["startDate"])
-        # Compare week after week the planBeforePreComp with the futureMicrocycles (except precomp and comp) and update if needed
-        
-        for i, newMicrocycle in enumerate(planBeforePreComp):
-            # Try get matching microcycle
-            currentPlanningDate = beginningOfNextWeek + timedelta(days=7 * i)
-            if i < len(futureMicrocycles):
-                oldMicrocycle = futureMicrocycles[i]
-                endDate = currentPlanningDate + timedelta(days=6)
-                theoreticalWeeklyTSS = newMicrocycle["theoreticalWeeklyTSS"]
-                keyWorkouts = newMicrocycle.get("keyWorkouts", [])
-                # if we are the last week of the planBeforePreComp, we have to adapt the date of the end to a day before the beginning of pre compet
-                if i == len(planBeforePreComp) - 1:
-                    endDate = precompetMicrocycle["startDate"] - timedelta(days=1)
-                    theoreticalWeeklyTSS = (
-                        theoreticalWeeklyTSS * (endDate.weekday() + 1) / 7
-                    )
-                    if endDate.weekday() <= 3:
-                        if "Long" in keyWorkouts:
-                            keyWorkouts.remove("Long")
-                newMicrocycle = update_microcycle(
-                    oldMicrocycle,
-                    {
-                        "startDate": currentPlanningDate,
-                        "endDate": endDate,
-                        "theoreticalWeeklyTSS": theoreticalWeeklyTSS,
-                        "theoreticalResting": newMicrocycle["theoreticalResting"],
-                        "keyWorkouts": keyWorkouts,
-                        "theoreticalLongWorkoutTSS": newMicrocycle.get(
-                            "theoreticalLongWorkoutTSS", 0
-                        ),
-                    },
-                )
-                log_debug(
-                    f"Updating microcycle {newMicrocycle}, currentPlanningDate: {currentPlanningDate}"
-                )
-            else:
-                newMicrocycle["startDate"] = currentPlanningDate
-                newMicrocycle["endDate"] = currentPlanningDate + timedelta(days=6)
-                log_debug(
-                    f"Creating microcycle {newMicrocycle}, currentPlanningDate: {currentPlanningDate}"
-                )
-                if i == len(planBeforePreComp) - 1:
-                    newMicrocycle["endDate"] = precompetMicrocycle[
-                        "startDate"
-                    ] - timedelta(days=1)
-                    newMicrocycle["theoreticalWeeklyTSS"] = (
-                        newMicrocycle["theoreticalWeeklyTSS"]
-                        * (newMicrocycle["endDate"].weekday() + 1)
-                        / 7
-                    )
-                    if newMicrocycle["endDate"].weekday() <= 3:
-                        if "Long" in newMicrocycle.get("keyWorkouts", []):
-                            newMicrocycle["keyWorkouts"].remove("Long")
-            newPlanBeforePreComp.append(newMicrocycle)
-
-    totalMacrocycles = (
-        pastMacrocycles
-        + [currentMacrocycle]
-        + futureMacrocycles
-        + [precompetMacrocycle]
-        + [competitionMacrocycle]
-    )
-    log_info(f"pastMicrocycles: {pastMicrocycles}, currentMicrocycle: {currentMicrocycle}, newPlanBeforePreComp: {newPlanBeforePreComp}, precompetMicrocycle: {precompetMicrocycle}, competitionMicrocycle: {competitionMicrocycle}")
-    for microcycle in newPlanBeforePreComp:
-        if microcycle != {}:
-            microcycle = planFutureWeekDayByDay(microcycle, weekInfo, raceInfo, loadsInfo, datesInfo)
-    if precompetMicrocycle != {}:
-        precompetMicrocycle = planFutureWeekDayByDay(precompetMicrocycle, weekInfo, raceInfo, loadsInfo, datesInfo)
-    if competitionMicrocycle != {}:
-        competitionMicrocycle = planFutureWeekDayByDay(competitionMicrocycle, weekInfo, raceInfo, loadsInfo, datesInfo)
-    log_debug(f"competitionMicrocycle: {competitionMicrocycle}")
-    log_debug(f"pastMicrocycles: {pastMicrocycles}, currentMicrocycle: {currentMicrocycle}, newPlanBeforePreComp: {newPlanBeforePreComp}, precompetMicrocycle: {precompetMicrocycle}, competitionMicrocycle: {competitionMicrocycle}")
-    totalMicrocycles = pastMicrocycles
-
-    # Add currentMicrocycle if it's not empty
-    if currentMicrocycle != {}:
-        totalMicrocycles.append(currentMicrocycle)
-
-    # Add all non-empty items in the correct order
-    totalMicrocycles.extend(newPlanBeforePreComp)
-
-    if precompetMicrocycle != {}:
-        totalMicrocycles.append(precompetMicrocycle)
-
-    if competitionMicrocycle != {}:
-        totalMicrocycles.append(competitionMicrocycle)
-
-    
-    log_debug(f"Total microcycles: {totalMicrocycles}")
-
-    return totalMacrocycles, totalMicrocycles
-
-
-def planFutureWeekDayByDay(futureMicrocycle, weekInfo, raceInfo, loadsInfo, datesInfo):
-    log_info(f"Planning future week day by day for {futureMicrocycle}")
-
-    remaining_tss = futureMicrocycle["theoreticalWeeklyTSS"]
-    availableDays = weekInfo["availableDays"].copy()
-    dayAvailableDurations = weekInfo["dayAvailableDurations"].copy()
-
-    futureMicrocycle["timeInZoneRepartition"] = (
-        ZONE_REPARTITION_BY_TIME_BY_WEEK_BY_CYCLE[
-            raceInfo["fitnessLevel"]
-        ][futureMicrocycle["cycleType"]][raceInfo["eventSize"]]
-    )
-    theroeticalTimeSpentWeekInSeconds = (
-        futureMicrocycle["theoreticalWeeklyTSS"]
-        * 3600
-        / sum(
-            [
-                TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][zone]
-                * futureMicrocycle["timeInZoneRepartition"][zone]
-                for zone in ZONES[raceInfo["mainSport"]].keys()
-            ]
-        )
-    )
-    theoreticalTimeInZone = {
-        zone: futureMicrocycle["timeInZoneRepartition"][zone]
-        * theroeticalTimeSpentWeekInSeconds
-        for zone in ZONES[raceInfo["mainSport"]].keys()
-    }
-    log_debug(f"Theoretical time in zone {theoreticalTimeInZone}")
-
-    dayByDay = {}
-    if "compet" == futureMicrocycle["cycleType"].lower():
-        # Let's plan the competition
-        log_info("Planning competition")
-        # Let's plan the competition
-        competitionTSS = raceInfo["eventTSS"]
-        targetTimeInSeconds = raceInfo["targetTimeInMinutes"] * 60
-        competitionZone = raceInfo["raceZone"]
-        weekDaysMapping = ("Monday", "Tuesday", 
-                   "Wednesday", "Thursday",
-                   "Friday", "Saturday",
-                   "Sunday")
-        
-        dayByDay[weekDaysMapping[futureMicrocycle["endDate"].weekday()]] = [{
-            "workoutType": "Competition",
-            "activity": raceInfo["mainSport"],
-            "tss": competitionTSS,
-            "secondsInZone": {competitionZone: targetTimeInSeconds},
-            "theoreticalDistance": raceInfo["raceDistanceKm"],
-            "theoreticalTime": timedelta(seconds=targetTimeInSeconds),
-        }]
-        if futureMicrocycle["endDate"].weekday() >= 1:
-            dayByDay[weekDaysMapping[futureMicrocycle["endDate"].weekday()-1]] = [{
-                "workoutType": "Activation",
-                "activity": raceInfo["mainSport"],
-                "tss": competitionTSS,
-                "secondsInZone": {1: 1800, 6: 120},
-                "theoreticalDistance": 5,
-                "theoreticalTime": timedelta(seconds=1920),
-            }]
-
-        
-        
-        # if the duration of the microcycle is more than 5 days, d-2, d-3, d-4 is a rest day, but d-5 is a very long zone 2, about 60% of the long workout
-        if (futureMicrocycle["endDate"] - futureMicrocycle["startDate"])>timedelta(days=5):
-            tz1 = loadsInfo["finalLongRunTSS"]*0.5*0.3 / TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1]*3600
-            tz2 = loadsInfo["finalLongRunTSS"]*0.5*0.7 / TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]*3600
-            theoreticalDistance = tz1 / 3600 * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][raceInfo["fitnessLevel"]][1] + tz2 / 3600 * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][raceInfo["fitnessLevel"]][2]
-            dayByDay[weekDaysMapping[futureMicrocycle["endDate"].weekday()-5]] = [{
-                "workoutType": "Long",
-                "activity": raceInfo["mainSport"],
-                "tss": loadsInfo["finalLongRunTSS"]*0.5,
-                "secondsInZone": {1: tz1, 2: tz2},
-                "theoreticalDistance": theoreticalDistance,
-                "theoreticalTime": timedelta(seconds=tz1 + tz2),
-            }]
-        remaining_tss = 0
-        futureMicrocycle["dayByDay"] = dayByDay
-        return futureMicrocycle
-    
-    if "Long" in futureMicrocycle.get("keyWorkouts", []):
-        log_debug("Planning long workout")
-        # let's split futureMicrocycle["theoreticalLongWorkoutTSS"] TSS in zones 1 2 and 3 with 30% 50% and 20% of the time respectively
-
-        z1Percentage = 0.3
-        z2Percentage = 0.5
-        z3Percentage = 0.2
-        
-        intervalsSuggestions = []
-
-        tz1 = (
-            futureMicrocycle["theoreticalLongWorkoutTSS"]
-            * 3600
-            / (
-                TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1]
-                + TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]
-                * (z1Percentage / z2Percentage)
-                + TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3]
-                * (z1Percentage / z3Percentage)
-            )
-        )
-        tz2 = tz1 * z1Percentage / z2Percentage
-        tz3 = tz1 * z1Percentage / z3Percentage
-
-        if theoreticalTimeInZone[3] < tz3:
-            # Rebalance to zone 2
-            tz2 += (
-                (tz3 - theoreticalTimeInZone[3])
-                * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3]
-                / TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]
-            )
-
-        # Compute the theoretical distance run
-        theoreticalDistance = (
-            tz1
-            / 3600
-            * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                raceInfo["fitnessLevel"]
-            ][1]
-            + tz2
-            / 3600
-            * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                raceInfo["fitnessLevel"]
-            ][2]
-            + tz3
-            / 3600
-            * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                raceInfo["fitnessLevel"]
-            ][3]
-        )
-
-        activity_tss = (
-            tz1 / 3600 * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1]
-            + tz2 / 3600 * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]
-            + tz3 / 3600 * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3]
-        )
-        
-        # take half of the tz1 as a warmup in intervals suggestions
-        intervalsSuggestions.append({
-            "intervalType": "Warmup",
-            "description": "Warmup",
-            "duration": tz1/2,
-            "zone": 1,
-            "tss": tz1/2/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1],
-            "secondsInZone": {1: tz1/2}
-        })
-        # take a third of tz2 next
-        intervalsSuggestions.append({
-            "intervalType": "Main",
-            "description": "Main",
-            "duration": tz2/3,
-            "zone": 2,
-            "tss": tz2/3/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2],
-            "secondsInZone": {2: tz2/3}
-        })
-        #then half of tz3
-        intervalsSuggestions.append({
-            "intervalType": "Main",
-            "description": "Main",
-            "duration": tz3/2,
-            "zone": 3,
-            "tss": tz3/2/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3],
-            "secondsInZone": {3: tz3/2}
-        })
-        #then another third of tz2
-        intervalsSuggestions.append({
-            "intervalType": "Main",
-            "description": "Main",
-            "duration": tz2/3,
-            "zone": 2,
-            "tss": tz2/3/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2],
-            "secondsInZone": {2: tz2/3}
-        })
-        # then rest of tz3
-        intervalsSuggestions.append({
-            "intervalType": "Main",
-            "description": "Main",
-            "duration": tz3/2,
-            "zone": 3,
-            "tss": tz3/2/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3],
-            "secondsInZone": {3: tz3/2}
-        })
-        # rest of tz2
-        intervalsSuggestions.append({
-            "intervalType": "Main",
-            "description": "Main",
-            "duration": tz2/3,
-            "zone": 2,
-            "tss": tz2/3/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2],
-            "secondsInZone": {2: tz2/3}
-        })
-        # rest of tz1
-        intervalsSuggestions.append({
-            "intervalType": "Cooldown",
-            "description": "Cooldown",
-            "duration": tz1/2,
-            "zone": 1,
-            "tss": tz1/2/3600*TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1],
-            "secondsInZone": {1: tz1/2}
-        })
-
-        dayByDay[weekInfo["longWorkoutDay"]] = [
-            {
-                "workoutType": "Long",
-                "activity": raceInfo["mainSport"],
-                "tss": activity_tss,
-                "secondsInZone": {1: tz1, 2: tz2, 3: tz3},
-                "theoreticalDistance": theoreticalDistance,
-                "theoreticalTime": timedelta(seconds=tz1 + tz2 + tz3),
-                "intervalSuggestions": intervalsSuggestions
-            }
-        ]
-
-        remaining_tss -= activity_tss
-
-        theoreticalTimeInZone[1] -= tz1
-        theoreticalTimeInZone[2] -= tz2
-        theoreticalTimeInZone[3] -= tz3
-        if weekInfo["longWorkoutDay"] in availableDays:
-            availableDays.remove(weekInfo["longWorkoutDay"])
-            dayAvailableDurations[weekInfo["longWorkoutDay"]] -= tz1 + tz2 + tz3
-        log_debug(dayByDay)
-
-    remaining_number_of_workouts = round(
-        remaining_tss
-        / REGULAR_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL[
-            raceInfo["mainSport"]
-        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
-    )
-    if remaining_number_of_workouts == 0:
-        futureMicrocycle["dayByDay"] = dayByDay
-        return futureMicrocycle
-    else:
-        tss_per_activity = round(remaining_tss / remaining_number_of_workouts)
-
-    if "ShortIntensity" in futureMicrocycle.get("keyWorkouts", []):
-        log_debug("Planning short intensity workout")
-        # let's split futureMicrocycle["theoreticalShortIntensityTSS"] TSS in zones 5 6 and 7 with 50% 30% and 20% of the time respectively
-
-        total_tss, secondsInZone, intervalsSuggestions = createWorkout(
-            loadsInfo["minTssPerWorkout"],
-            loadsInfo["maxTssPerWorkout"],
-            tss_per_activity,
-            theoreticalTimeInZone,
-            min_time_in_zones={},
-            max_time_in_zones={5: 1200, 6: 600, 7: 300},
-            cumulative_max_tss_in_zones=[
-                {
-                    "zones": [5, 6, 7],
-                    "max": futureMicrocycle["theoreticalShortIntensityTSS"],
-                }
-            ],
-            zones=[7, 6, 5],
-            warmup_duration=600,
-            cooldown_duration=600,
-            activity=raceInfo["mainSport"],
-        )
-        log_debug(
-            f"Short intensity workout, seconds in zone {secondsInZone}, total tss {total_tss}"
-        )
-        theoreticalDistance = sum(
-            [
-                secondsInZone[zone]
-                / 3600
-                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                    raceInfo["fitnessLevel"]
-                ][zone]
-                for zone in ZONES[raceInfo["mainSport"]].keys()
-            ]
-        )
-
-        # let's find the good day
-        total_seconds = sum(
-            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
-        )
-        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
-        if best_fit is not None:
-            if dayByDay.get(best_fit[0], None) is None:
-                dayByDay[best_fit[0]] = []
-            dayByDay[best_fit[0]].append(
-                {
-                    "workoutType": "ShortIntensity",
-                    "activity": raceInfo["mainSport"],
-                    "tss": total_tss,
-                    "secondsInZone": secondsInZone,
-                    "theoreticalDistance": theoreticalDistance,
-                    "theoreticalTime": timedelta(seconds=total_seconds),
-                    "intervalSuggestions": intervalsSuggestions,
-                }
-            )
-            for zone in ZONES[raceInfo["mainSport"]].keys():
-                theoreticalTimeInZone[zone] -= secondsInZone[zone]
-
-            dayAvailableDurations[best_fit[0]] -= total_seconds
-            # if dayAvailableDurations[best_fit[0]] <= 0:
-            availableDays.remove(best_fit[0])
-
-        log_debug(dayByDay)
-    if "LongIntensity" in futureMicrocycle.get("keyWorkouts", []):
-        log_debug("Planning long intensity workout")
-        total_tss, secondsInZone, intervalsSuggestions = createWorkout(
-            loadsInfo["minTssPerWorkout"],
-            loadsInfo["maxTssPerWorkout"],
-            tss_per_activity,
-            theoreticalTimeInZone,
-            min_time_in_zones={},
-            max_time_in_zones={4: 1800, 3: 7200},
-            cumulative_max_tss_in_zones=[
-                {
-                    "zones": [4, 3],
-                    "max": futureMicrocycle["theoreticalLongIntensityTSS"],
-                }
-            ],
-            zones=[4, 3],
-            warmup_duration=600,
-            cooldown_duration=600,
-            activity=raceInfo["mainSport"],
-        )
-        log_debug(
-            f"Long intensity workout, seconds in zone {secondsInZone}, total tss {total_tss}"
-        )
-        theoreticalDistance = sum(
-            [
-                secondsInZone[zone]
-                / 3600
-                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                    raceInfo["fitnessLevel"]
-                ][zone]
-                for zone in ZONES[raceInfo["mainSport"]].keys()
-            ]
-        )
-        # let's find the good day
-        total_seconds = sum(
-            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
-        )
-        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
-        if best_fit is not None:
-            if dayByDay.get(best_fit[0], None) is None:
-                dayByDay[best_fit[0]] = []
-            dayByDay[best_fit[0]].append(
-                {
-                    "workoutType": "LongIntensity",
-                    "activity": raceInfo["mainSport"],
-                    "tss": total_tss,
-                    "secondsInZone": secondsInZone,
-                    "theoreticalDistance": theoreticalDistance,
-                    "theoreticalTime": timedelta(seconds=total_seconds),
-                    "intervalSuggestions": intervalsSuggestions,
-                }
-            )
-            for zone in ZONES[raceInfo["mainSport"]].keys():
-                theoreticalTimeInZone[zone] -= secondsInZone[zone]
-
-            dayAvailableDurations[best_fit[0]] -= total_seconds
-            # if dayAvailableDurations[best_fit[0]] <= 0:
-            availableDays.remove(best_fit[0])
-        log_debug(dayByDay)
-
-    if "RaceIntensity" in futureMicrocycle.get("keyWorkouts", []):
-        log_debug("Planning race intensity workout")
-        total_tss, secondsInZone, intervalsSuggestions = createWorkout(
-            loadsInfo["minTssPerWorkout"],
-            loadsInfo["maxTssPerWorkout"],
-            tss_per_activity,
-            theoreticalTimeInZone,
-            min_time_in_zones={},
-            max_time_in_zones={raceInfo["raceZone"]: 1800},
-            zones=[raceInfo["raceZone"]],
-            warmup_duration=600,
-            cooldown_duration=600,
-            activity=raceInfo["mainSport"],
-        )
-        theoreticalDistance = sum(
-            [
-                secondsInZone[zone]
-                / 3600
-                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                    raceInfo["fitnessLevel"]
-                ][zone]
-                for zone in ZONES[raceInfo["mainSport"]].keys()
-            ]
-        )
-        total_seconds = sum(
-            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
-        )
-        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
-        if best_fit is not None:
-            if dayByDay.get(best_fit[0], None) is None:
-                dayByDay[best_fit[0]] = []
-            dayByDay[best_fit[0]].append(
-                {
-                    "workoutType": "RaceIntensity",
-                    "activity": raceInfo["mainSport"],
-                    "tss": total_tss,
-                    "secondsInZone": secondsInZone,
-                    "theoreticalDistance": theoreticalDistance,
-                    "theoreticalTime": timedelta(seconds=total_seconds),
-                    "intervalSuggestions": intervalsSuggestions,
-                }
-            )
-            for zone in ZONES[raceInfo["mainSport"]].keys():
-                theoreticalTimeInZone[zone] -= secondsInZone[zone]
-
-            dayAvailableDurations[best_fit[0]] -= total_seconds
-            # if dayAvailableDurations[best_fit[0]] <= 0:
-            availableDays.remove(best_fit[0])
-        log_debug(dayByDay)
-    remaining_tss = futureMicrocycle["theoreticalWeeklyTSS"] - sum(
-        [workout["tss"] for day in dayByDay.values() for workout in day]
-    )
-    # Let's plan the remaining time in zones
-    while remaining_tss > 30:
-        log_debug("Planning a new workout")
-        zones = []
-        for zone in ZONES[raceInfo["mainSport"]].keys():
-            if theoreticalTimeInZone[zone] > 0:
-                zones.append(zone)
-        zones = sorted(zones, key=lambda x: x, reverse=True)
-
-        total_tss, secondsInZone, intervalsSuggestions = createWorkout(
-            loadsInfo["minTssPerWorkout"],
-            100,
-            tss_per_activity,
-            theoreticalTimeInZone,
-            min_time_in_zones={},
-            max_time_in_zones={},
-            cumulative_max_tss_in_zones=[{"zones": [3, 4, 5, 6, 7], "max": 40}],
-            zones=zones,
-            warmup_duration=600,
-            cooldown_duration=600,
-            activity=raceInfo["mainSport"],
-        )
-        log_debug(f"New workout, seconds in zone {secondsInZone}, total tss {total_tss}")
-
-        theoreticalDistance = sum(
-            [
-                secondsInZone[zone]
-                / 3600
-                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
-                    raceInfo["fitnessLevel"]
-                ][zone]
-                for zone in ZONES[raceInfo["mainSport"]].keys()
-            ]
-        )
-        total_seconds = sum(
-            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
-        )
-        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
-        log_debug("Best fit")
-        log_debug(best_fit)
-        if best_fit is not None:
-            if dayByDay.get(best_fit[0], None) is None:
-                dayByDay[best_fit[0]] = []
-            dayByDay[best_fit[0]].append(
-                {
-                    "workoutType": "Remaining",
-                    "activity": raceInfo["mainSport"],
-                    "tss": total_tss,
-                    "secondsInZone": secondsInZone,
-                    "theoreticalDistance": theoreticalDistance,
-                    "theoreticalTime": timedelta(seconds=total_seconds),
-                    "intervalSuggestions": intervalsSuggestions,
-                }
-            )
-            for zone in ZONES[raceInfo["mainSport"]].keys():
-                theoreticalTimeInZone[zone] -= secondsInZone[zone]
-
-            dayAvailableDurations[best_fit[0]] -= total_seconds
-            if best_fit[0] in availableDays:
-                availableDays.remove(best_fit[0])
-        remaining_tss -= total_tss
-
-        log_debug(dayByDay)
-
-    futureMicrocycle["dayByDay"] = dayByDay
-
-    return futureMicrocycle
-
-
-def findBestFitDay(total_seconds, available_days, available_durations):
-    log_debug(
-        f"Finding best fit day, total seconds: {total_seconds}, available days: {available_days}, available durations: {available_durations}"
-    )
-    best_fit = None
-    if len(available_days) == 0:
-        # find the one that has the most available duration
-        for day in available_durations.keys():
-            if best_fit is None:
-                best_fit = (day, available_durations[day])
-            elif available_durations[day] > best_fit[1]:
-                best_fit = (day, available_durations[day])
-    else:
-        for day in available_days:
-            duration = available_durations[day]
-            if duration >= total_seconds:
-                if best_fit is None:
-                    best_fit = (day, duration)
-                elif duration < best_fit[1]:
-                    best_fit = (day, duration)
-    log_debug(f"Best fit day: {best_fit}")
-    return best_fit
-
-
-def createWorkout(
-    min_tss,
-    max_tss,
-    target_tss,
-    remaining_time_in_zone,
-    min_time_in_zones,
-    max_time_in_zones,
-    cumulative_max_tss_in_zones=[],
-    zones=[3, 2, 1],
-    warmup_duration=1200,
-    cooldown_duration=600,
-    activity="Run",
-):
-    log_debug("Creating workout with params: ")
-    log_debug(
-        f"min_tss: {min_tss}, max_tss: {max_tss}, target_tss: {target_tss}, remaining_time_in_zone: {remaining_time_in_zone}, min_time_in_zones: {min_time_in_zones}, max_time_in_zones: {max_time_in_zones}, cumulative_max_tss_in_zones: {cumulative_max_tss_in_zones}, zones: {zones}, warmup_duration: {warmup_duration}, cooldown_duration: {cooldown_duration}, activity: {activity}"
-    )
-    total_tss = 0
-    secondsInZone = {zone: 0 for zone in ZONES[activity].keys()}
-    intervalsSuggestions = []
-    remaining_tss = target_tss
-    log_debug("TSS to reach")
-    log_debug(remaining_tss)
-
-    # Warmup
-    secondsInZone[1] = warmup_duration
-    warmup_tss = round(TSS_BY_ZONE_BY_SPORT[activity][1] * warmup_duration / 3600)
-    total_tss += warmup_tss
-    remaining_tss -= warmup_tss
-    intervalsSuggestions.append(
-        {
-            "intervalType": "Warmup",
-            "description": "Warmup",
-            "zone": 1,
-            "tss": warmup_tss,
-            "secondsInZone": {1: warmup_duration},
-        }
-    )
-
-    # Cooldown
-    secondsInZone[1] = secondsInZone[1] + cooldown_duration
-    cooldown_tss = round(TSS_BY_ZONE_BY_SPORT[activity][1] * cooldown_duration / 3600)
-    total_tss += cooldown_tss
-    remaining_tss -= cooldown_tss
-
-    log_debug("Remaining TSS after warmup and cooldown")
-    log_debug(remaining_tss)
-
-    for zone in zones:
-        log_debug(f"Zone {zone}, remaining time in zone {remaining_time_in_zone[zone]}")
-        if remaining_time_in_zone[zone] > 0:
-            # Depending on zone, we also add some associated Z1 rest time to recover between intervals
-            recovery_factor = ZONE_RECOVERY_FACTOR_BY_SPORT[activity][zone]
-            max_seconds_in_remaining_tss = (
-                3600
-                * remaining_tss
-                / (
-                    TSS_BY_ZONE_BY_SPORT[activity][zone]
-                    + recovery_factor * TSS_BY_ZONE_BY_SPORT[activity][1]
-                )
-            )
-
-            # take into account cumulative max tss in zones
-            biggest_constraint_from_cumulative_max_tss = 99999999
-            for constraint in cumulative_max_tss_in_zones:
-                if zone in constraint["zones"]:
-                    log_debug("Constraint")
-                    log_debug(constraint)
-                    other_zones = [z for z in constraint["zones"] if z != zone]
-                    log_debug("Other zones")
-                    log_debug(other_zones)
-                    other_zones_tss = sum(
-                        [
-                            TSS_BY_ZONE_BY_SPORT[activity][z] * secondsInZone[z] / 3600
-                            for z in other_zones
-                        ]
-                    )
-                    log_debug("Other zones tss")
-                    log_debug(other_zones_tss)
-                    constraint_associated_tss = constraint["max"] - other_zones_tss
-                    log_debug("Constraint associated tss")
-                    log_debug(constraint_associated_tss)
-                    associated_time_in_seconds = (
-                        constraint_associated_tss
-                        * 3600
-                        / TSS_BY_ZONE_BY_SPORT[activity][zone]
-                    )
-                    log_debug("Associated time")
-                    log_debug(associated_time_in_seconds)
-                    if (
-                        associated_time_in_seconds
-                        < biggest_constraint_from_cumulative_max_tss
-                    ):
-                        biggest_constraint_from_cumulative_max_tss = (
-                            associated_time_in_seconds
-                        )
-
-            log_debug(
-                f"min time in zone {min_time_in_zones.get(zone, 0)}, max time in zone {max_time_in_zones.get(zone, 9999999)}, remaining time in zone {remaining_time_in_zone[zone]}, max seconds in remaining tss {max_seconds_in_remaining_tss}, biggest constraint from cumulative max tss {biggest_constraint_from_cumulative_max_tss}"
-            )
-
-            seconds_in_zone = round(
-                min(
-                    biggest_constraint_from_cumulative_max_tss,
-                    remaining_time_in_zone[zone],
-                    max_seconds_in_remaining_tss,
-                )
-            )
-
-            tss = round(TSS_BY_ZONE_BY_SPORT[activity][zone] * seconds_in_zone / 3600)
-            total_tss += tss
-            remaining_tss -= tss
-            secondsInZone[zone] = round(secondsInZone[zone] + seconds_in_zone)
-
-            # Add recovery time
-            secondsInZone[1] = secondsInZone[1] + seconds_in_zone * recovery_factor
-            recovery_tss = round(
-                TSS_BY_ZONE_BY_SPORT[activity][1]
-                * seconds_in_zone
-                * recovery_factor
-                / 3600
-            )
-            total_tss += recovery_tss
-            remaining_tss -= recovery_tss
-            
-            numberOfIntervals = int(seconds_in_zone/TYPICAL_DURATION_FOR_INTERVALS_BY_ZONE_BY_SPORT[activity][zone])+1
-            if numberOfIntervals > 0:
-                secondsInIntervals = round(seconds_in_zone / numberOfIntervals)
-            else:
-                secondsInIntervals = 0
-            log_debug(f"Zone: {zone}, Number of intervals: {numberOfIntervals}, seconds in intervals: {secondsInIntervals}")
-            for i in range(numberOfIntervals):
-                intervalsSuggestions.append(
-                    {
-                        "intervalType": "Interval",
-                        "description": f"Interval {i+1}",
-                        "zone": zone,
-                        "tss": round(tss/numberOfIntervals),
-                        "secondsInZone": {zone: secondsInIntervals},
-                    }
-                )
-                intervalsSuggestions.append(
-                    {
-                        "intervalType": "Recovery",
-                        "description": f"Recovery {i+1}",
-                        "zone": 1,
-                        "tss": round(recovery_tss/numberOfIntervals),
-                        "secondsInZone": {1: secondsInIntervals},
-                    }
-                )
-            
-            
-            
-            
-            log_debug(
-                f"seconds_in_zone {seconds_in_zone}, tss {tss}, recovery_tss {recovery_tss}"
-            )
-
-    # if we are under the min tss, we add half Z1 half Z2 time
-    if remaining_tss > 0:
-        log_debug("Adding z1 and Z2 time")
-        log_debug("Remaining TSS for this activity: ")
-        log_debug(remaining_tss)
-        log_debug("Remaining time in zone")
-        log_debug(remaining_time_in_zone)
-        tssz1toadd = remaining_tss / 2
-        tssz2toadd = remaining_tss / 2
-        secondsInZone[1] = secondsInZone[1] + round(
-            tssz1toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][1]
-        )
-        secondsInZone[2] = secondsInZone[2] + round(
-            tssz2toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][2]
-        )
-        total_tss += remaining_tss
-        remaining_tss = 0
-        
-        # add the z2 between the warmup and the first interval, and the z1 after the last interval
-        intervalsSuggestions.insert(1,
-            {
-                "intervalType": "Z2",
-                "description": "Z2",
-                "zone": 2,
-                "tss": round(tssz2toadd),
-                "secondsInZone": {2: round(tssz2toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][2])},
-            }
-        )
-        intervalsSuggestions.append(
-            {
-                "intervalType": "Z1",
-                "description": "Z1",
-                "zone": 1,
-                "tss": round(tssz1toadd),
-                "secondsInZone": {1: round(tssz1toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][1])},
-            }
-        )
-        
-    intervalsSuggestions.append(
-        {
-            "intervalType": "Cooldown",
-            "description": "Cooldown",
-            "zone": 1,
-            "tss": cooldown_tss,
-            "secondsInZone": {1: cooldown_duration},
-        }
-    )
-
-    return total_tss, secondsInZone, intervalsSuggestions
-
-
-def currentLoadStatus(pastMicrocycles, cycleLength=4, mainSport="Run"):
-    currentHandableLoad = 0
-    lastRestingWeek = 0
-    missingKeyWorkouts = []
-    TSSBalance = 0
-    nextWeekGuidelines = []
-    TSSPerZoneBalance = {zone: 0 for zone in ZONES[mainSport].keys()}
-    biggestWorkout = 0
-    biggestRaceIntensity = 0
-    biggestLongIntensityWorkout = 0
-    biggestShortIntensityWorkout = 0
-
-    for week in pastMicrocycles[-4:]:
-        if "actualTSS" in week:
-            if week["actualTSS"] > currentHandableLoad:
-                currentHandableLoad = week["actualTSS"]
-    # let's look backward in pastMicrocycles to find the last resting week
-    for i, week in enumerate(pastMicrocycles):
-        if week["actualResting"]:
-            lastRestingWeek = i
-            break
-    nextRestingWeek = max(
-        min(cycleLength - (len(pastMicrocycles) - lastRestingWeek), cycleLength), 0
-    )
-
-    for week in pastMicrocycles[-2:]:
-        if "keyWorkoutsMissing" in week:
-            for workout in week["keyWorkoutsMissing"]:
-                missingKeyWorkouts.append(workout)
-    for week in pastMicrocycles[-5:]:
-        TSSBalance += week["actualTSS"] - week["theoreticalWeeklyTSS"]
-
-    if len(pastMicrocycles) > 0:
-        nextWeekGuidelines = pastMicrocycles[-1]["nextWeekGuidelines"]
-    else:
-        nextWeekGuidelines = "Normal"
-
-    for week in pastMicrocycles[-4:]:
-        TSSPerZoneBalance = {
-            zone: TSSPerZoneBalance[zone]
-            + week["deltaTimeInZone"][zone]
-            * TSS_BY_ZONE_BY_SPORT[mainSport][zone]
-            / 3600
-            for zone in ZONES[mainSport].keys()
-        }
-
-    for week in pastMicrocycles[-3:]:
-        if week["longWorkoutDone"]:
-            biggestWorkout = max(week["theoreticalLongWorkoutTSS"], biggestWorkout)
-        else:
-            biggestWorkout = max(week["actualLongWorkoutTSS"], biggestWorkout)
-        if week["RaceIntensityDone"]:
-            biggestRaceIntensity = max(
-                week["theoreticalRaceIntensityTSS"], biggestRaceIntensity
-            )
-        else:
-            biggestRaceIntensity = max(
-                week["actualRaceIntensityTSS"], biggestRaceIntensity
-            )
-        if week["LongIntensityDone"]:
-            biggestLongIntensityWorkout = max(
-                week["theoreticalLongIntensityTSS"], biggestLongIntensityWorkout
-            )
-        else:
-            biggestLongIntensityWorkout = max(
-                week["actualLongIntensityTSS"], biggestLongIntensityWorkout
-            )
-        if week["ShortIntensityDone"]:
-            biggestShortIntensityWorkout = max(
-                week["theoreticalShortIntensityTSS"], biggestShortIntensityWorkout
-            )
-        else:
-            biggestShortIntensityWorkout = max(
-                week["actualShortIntensityTSS"], biggestShortIntensityWorkout
-            )
-
-    return {
-        "currentHandableLoad": currentHandableLoad,
-        "nextRestingWeek": nextRestingWeek,
-        "missingKeyWorkouts": missingKeyWorkouts,
-        "TSSBalance": TSSBalance,
-        "nextWeekGuidelines": nextWeekGuidelines,
-        "TSSPerZoneBalance": TSSPerZoneBalance,
-        "biggestWorkout": biggestWorkout,
-        "biggestRaceIntensity": biggestRaceIntensity,
-        "biggestLongIntensityWorkout": biggestLongIntensityWorkout,
-        "biggestShortIntensityWorkout": biggestShortIntensityWorkout,
-    }
-
-
-def compareCurrentWeekWithPlannedWeekAndReplanIfNeeded(
-    completedWorkouts,
-    currentMicrocycle,
-    startLoad,
-    currentDay,
-    lastWeeksTakeaways,
-    maxTssPerDay=200,
-    mainSport="Run",
-):
-    # variable days begins at currentday and goes up to 6
-    remainingDays = [currentDay + i for i in range(6 - currentDay)]
-    dayByDay = currentMicrocycle["dayByDay"]
-    theroeticalTimeSpentWeekInSeconds = currentMicrocycle["theoreticalWeeklyTSS"] / sum(
-        [
-            TSS_BY_ZONE_BY_SPORT[mainSport][zone]
-            * currentMicrocycle["timeInZoneRepartition"][zone]
-            / 3600
-            for zone in ZONES[mainSport].keys()
-        ]
-    )
-    theroetical_time_in_zone = {zone: 0 for zone in ZONES[mainSport].keys()}
-    for zone in ZONES[mainSport].keys():
-        theroetical_time_in_zone[zone] = (
-            currentMicrocycle["timeInZoneRepartition"][zone]
-            * theroeticalTimeSpentWeekInSeconds
-        )
-    theoretical_time_in_zone_to_current_day = {
-        zone: 0 for zone in ZONES[mainSport].keys()
-    }
-    for day in dayByDay:
-        if day < currentDay:
-            for workout in dayByDay[day]:
-                for zone in workout["secondsInZone"].keys():
-                    theoretical_time_in_zone_to_current_day[zone] += workout[
-                        "secondsInZone"
-                    ][zone]
-    onTrack = True
-    missingKeyWorkouts = []
-    missingWorkouts = []
-    nextWeekGuidelines = ""
-    weekWorkouts = [
-        workout
-        for workout in completedWorkouts
-        if workout["date"] >= currentMicrocycle["startDate"]
-        and workout["date"] <= currentMicrocycle["endDate"]
-    ]
-
-    done_time_in_zone = {zone: 0 for zone in ZONES[mainSport].keys()}
-    for workout in weekWorkouts:
-        for zone in workout["secondsInZone"].keys():
-            done_time_in_zone[zone] += workout["secondsInZone"][zone]
-
-    remaining_time_in_zone = {
-        zone: theroetical_time_in_zone[zone] - done_time_in_zone[zone]
-        for zone in ZONES[mainSport].keys()
-    }
-
-    # The key workouts that we should have already done
-    past_theoretical_key_workouts = []
-    for workout in currentMicrocycle["keyWorkouts"]:
-        # find the theoretical workout in the dayByDay
-        for day in dayByDay:
-            if day < currentDay:
-                for plannedWorkout in dayByDay[day]:
-                    if plannedWorkout["workoutType"] == workout:
-                        past_theoretical_key_workouts.append(plannedWorkout)
-
-    past_theoretical_workouts = []
-    for day in dayByDay:
-        if day < currentDay:
-            for workout in dayByDay[day]:
-                past_theoretical_workouts.append(workout)
-
-    weekWorkoutsSuppl = weekWorkouts.copy()
-    # check if the key workouts were done
-    for workout in past_theoretical_key_workouts:
-        done = False
-        for actualWorkout in weekWorkoutsSuppl:
-            if checkWorkoutValidity(actualWorkout, workout) > 0.8:
-                done = True
-                # remove the workout from the weekWorkoutsSuppl
-                weekWorkoutsSuppl.remove(actualWorkout)
-                break
-        if not done:
-            if workout["workoutType"] in currentMicrocycle["keyWorkouts"]:
-                missingKeyWorkouts.append(workout)
-    for workout in past_theoretical_workouts:
-        done = False
-        for actualWorkout in weekWorkoutsSuppl:
-            if checkWorkoutValidity(actualWorkout, workout) > 0.8:
-                done = True
-                # remove the workout from the weekWorkoutsSuppl
-                weekWorkoutsSuppl.remove(actualWorkout)
-                break
-        if not done:
-            missingWorkouts.append(workout)
-
-    # weekWorkoutsSuppl contains the workouts that were not planned.
-
-    # Check if we have to high difference in the time in zone to this day, and if yes, replan
-    difference_time_in_zone = {
-        zone: theoretical_time_in_zone_to_current_day[zone] - done_time_in_zone[zone]
-        for zone in ZONES[mainSport].keys()
-    }
-
-    planned_activities_lost = []
-    # Treat the key workouts first and try replanning it if failed
-    for keyWorkout in currentMicrocycle["keyWorkouts"]:
-        if keyWorkout in missingKeyWorkouts:
-            # find the keyWorkout in the dayByDay
-            for day in dayByDay:
-                for workout in dayByDay[day]:
-                    if workout["workoutType"] == keyWorkout:
-                        keyWorkoutActivity = workout
-
-            bestDay = findBestDayToReplace(
-                dayByDay, currentMicrocycle["keyWorkouts"], keyWorkout, remainingDays
-            )
-            activitiesLost = dayByDay[bestDay]
-            for activity in activitiesLost:
-                planned_activities_lost.append(activity)
-            dayByDay[bestDay] = [keyWorkoutActivity]
-
-    # Treat the other workouts
-    for workout in missingWorkouts:
-        bestDay = findBestDayToReplace(
-            dayByDay, currentMicrocycle["keyWorkouts"], workout, remainingDays
-        )
-        if bestDay:
-            activitiesLost = dayByDay[bestDay]
-            for activity in activitiesLost:
-                planned_activities_lost.append(activity)
-            dayByDay[bestDay] = [workout]
-
-    # check the state of the new plan, with the completed activities and the remaining planned activities after these changes
-    newPlannedTSS = sum(
-        [workout["tss"] for day in dayByDay for workout in dayByDay[day]]
-    ) + sum([workout["tss"] for workout in weekWorkouts])
-    tss_difference = newPlannedTSS - currentMicrocycle["theoreticalWeeklyTSS"]
-
-    missingWorkoutsCopy = missingWorkouts.copy()
-    planned_activities_lost_copy = planned_activities_lost.copy()
-
-    while (
-        tss_difference > currentMicrocycle["theoreticalWeeklyTSS"] / 7
-    ):  # If we miss more than 1 day of TSS, we have to add back a missing workout
-        # add back a missingWorkouts or a planned_activity_lost if we can find a day that when we add is not more than loadsInfo["maxTssPerDay"]
-        for missingWorkout in missingWorkouts:
-            for day in dayByDay:
-                if day > currentDay:
-                    dayTss = sum([workout["tss"] for workout in dayByDay[day]])
-                    if (
-                        dayTss + missingWorkout["tss"] < maxTssPerDay
-                    ):  # if this workout can feet in this day
-                        dayByDay[day].append(missingWorkout)
-                        missingWorkouts.remove(missingWorkout)
-                        tss_difference -= missingWorkout["tss"]
-                        break
-            missingWorkouts.remove(
-                missingWorkout
-            )  # we did not manage to replan it, so remove it from the missingWorkouts
-        for (
-            activity
-        ) in planned_activities_lost:  # do the same with the planned_activities_lost
-            for day in dayByDay:
-                if day > currentDay:
-                    dayTss = sum([workout["tss"] for workout in dayByDay[day]])
-                    if dayTss + activity["tss"] < maxTssPerDay:
-                        dayByDay[day].append(activity)
-                        planned_activities_lost.remove(activity)
-                        tss_difference -= activity["tss"]
-                        break
-            planned_activities_lost.remove(activity)
-        if not missingWorkouts and not planned_activities_lost:
-            break
-
-    newPlannedTimeInZone = {zone: 0 for zone in ZONES[mainSport].keys()}
-    for day in dayByDay:  # take the future plan
-        if day > currentDay:
-            for workout in dayByDay[day]:
-                for zone in workout["secondsInZone"].keys():
-                    newPlannedTimeInZone[zone] += workout["secondsInZone"][zone]
-    for workout in weekWorkouts:
-        for zone in workout["secondsInZone"].keys():
-            newPlannedTimeInZone[zone] += workout["secondsInZone"][zone]
-    time_in_zone_difference = {
-        zone: newPlannedTimeInZone[zone] - theroetical_time_in_zone[zone]
-        for zone in ZONES[mainSport].keys()
-    }
-
-    for zone in ZONES[mainSport].keys():
-        # check also if the lastWeeksTakeaways["TSSPerZoneBalance"] does not compensate
-        if (
-            abs(time_in_zone_difference[zone]) > 0.1 * theroetical_time_in_zone[zone]
-            and abs(
-                lastWeeksTakeaways["TSSPerZoneBalance"][zone]
-                + time_in_zone_difference[zone]
-            )
-            < 0.1 * theroetical_time_in_zone[zone]
-        ):
-            # find remaining activities that have this zone and replan accordingly to the difference
-            activities_having_this_zone = []
-            for day in dayByDay:
-                if day > currentDay:
-                    for workout in dayByDay[day]:
-                        if workout["secondsInZone"][zone] > 0:
-                            activities_having_this_zone.append(workout)
-
-            if (
-                len(activities_having_this_zone) == 0
-                and time_in_zone_difference[zone] > 0
-            ):
-                # insert it in any easy workout
-                for day in dayByDay:
-                    if day > currentDay:
-                        for workout in dayByDay[day]:
-                            if workout["workoutType"] == "Easy":
-                                workout["secondsInZone"][zone] += (
-                                    time_in_zone_difference[zone]
-                                )
-                                tss_change = (
-                                    time_in_zone_difference[zone]
-                                    * TSS_BY_ZONE_BY_SPORT[workout["activity"]][zone]
-                                    / 3600
-                                )
-                                workout["tss"] += tss_change
-            elif len(activities_having_this_zone) > 0:
-                shared_load = time_in_zone_difference[zone] / len(
-                    activities_having_this_zone
-                )
-                for activity in activities_having_this_zone:
-                    # but keep minimum 0
-                    to_add_or_remove = max(
-                        shared_load, -activity["secondsInZone"][zone]
-                    )
-                    activity["secondsInZone"][zone] += to_add_or_remove
-                    tss_change = (
-                        TSS_BY_ZONE_BY_SPORT[activity["activity"]][zone]
-                        / 3600
-                        * to_add_or_remove
-                    )
-                    activity["tss"] += tss_change
-
-    if currentMicrocycle["theoreticalResting"]:
-        # Check if we are not already higher than the planned TSS
-        if (
-            sum([workout["tss"] for workout in completedWorkouts])
-            > 1.3 * currentMicrocycle["theoreticalWeeklyTSS"]
-        ):
-            onTrack = False
-            if nextWeekGuidelines == "":
-                nextWeekGuidelines = "rest"
-
-    currentMicrocycle["onTrack"] = onTrack
-    currentMicrocycle["missingKeyWorkouts"] = missingKeyWorkouts
-    currentMicrocycle["nextWeekGuidelines"] = nextWeekGuidelines
-
-
-def findBestDayToReplace(
-    dayByDay, microcycleKeyWorkouts, workoutToReschedule, remainingDays
-):
-    # first look for a rest day
-    for day in remainingDays:
-        if not dayByDay[day]:
-            return day
-    for day in remainingDays:
-        # if we have only an easy workout, replace it
-        if len(dayByDay[day]) == 1 and dayByDay[day][0]["workoutType"] == "Easy":
-            return day
-    if workoutToReschedule in microcycleKeyWorkouts:
-        # else look for a less important day
-        days_score = {day: 0 for day in remainingDays}
-        for day in remainingDays:
-            types = [workout["workoutType"] for workout in dayByDay[day]]
-            # if there is one type of types that is before in the list of microcycleKeyWorkouts than keyWorkout add a score of the difference of the indexes
-            for i, workout in enumerate(microcycleKeyWorkouts):
-                if workout in types:
-                    days_score[day] += i - types.index(workout)
-        return min(days_score, key=days_score.get)
-    else:
-        return None
-
-
-def update_macrocycle(macrocycle, new_values):
-    # Store the current state before updating
-    previous_version = {
-        "startDate": macrocycle.get("startDate"),
-        "endDate": macrocycle.get("endDate"),
-        "totalTSS": macrocycle.get("totalTSS"),
-        "cycleLength": macrocycle.get("cycleLength"),
-        "cycleType": macrocycle.get("cycleType"),
-        "cycleNumber": macrocycle.get("cycleNumber"),
-        "analyzed": macrocycle.get("analyzed"),
-        "updateDate": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-    }
-
-    # Append to previousVersion if there is an update
-    if "previousVersion" not in macrocycle:
-        macrocycle["previousVersion"] = []
-
-    if any(macrocycle.get(key) != new_values.get(key) for key in new_values):
-        macrocycle["previousVersion"].append(previous_version)
-
-    # Update the macrocycle with new values
-    macrocycle.update(new_values)
-
-    return macrocycle
-
-
-def update_microcycle(microcycle, new_values):
-    # Store the current state before updating
-    previous_version = {
-        "startDate": microcycle.get("startDate"),
-        "endDate": microcycle.get("endDate"),
-        "theoreticalWeeklyTSS": microcycle.get("theoreticalWeeklyTSS"),
-        "theoreticalResting": microcycle.get("theoreticalResting"),
-        "indexInCycle": microcycle.get("indexInCycle"),
-        "keyWorkouts": microcycle.get("keyWorkouts"),
-        "cycleType": microcycle.get("cycleType"),
-        "cycleNumber": microcycle.get("cycleNumber"),
-        "theoreticalLongWorkoutTSS": microcycle.get("theoreticalLongWorkoutTSS"),
-        "theoreticalRaceIntensityTSS": microcycle.get("theoreticalRaceIntensityTSS"),
-        "analyzed": microcycle.get("analyzed"),
-        "timeInZoneRepartition": microcycle.get("timeInZoneRepartition"),
-        "dayByDay": microcycle.get("dayByDay"),
-        "updateDate": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-    }
-
-    # Append to previousVersion if there is an update
-    if "previousVersion" not in microcycle:
-        microcycle["previousVersion"] = []
-
-    if any(microcycle.get(key) != new_values.get(key) for key in new_values):
-        microcycle["previousVersion"].append(previous_version)
-
-    # Update the microcycle with new values
-    microcycle.update(new_values)
-
-    return microcycle
-
-
-def fix_ending(weeks, cycleLength):
-    # Count how many worked weeks at the end
-    worked_streak = 0
-    for w in reversed(weeks):
-        if w["theoreticalResting"]:
-            break
-        worked_streak += 1
-
-    # Set allowed max to cycleLength - 1
-    allowed_max = cycleLength - 1
-
-    if worked_streak > allowed_max:
-        # Convert some ending worked weeks to resting weeks
-        to_convert = worked_streak - allowed_max
-        for i in range(len(weeks) - 1, -1, -1):
-            if to_convert <= 0:
-                break
-            w = weeks[i]
-            if not w["theoreticalResting"]:
-                w["theoreticalResting"] = True
-                w["theoreticalWeeklyTSS"] = w["theoreticalWeeklyTSS"] * 0.6
-                to_convert -= 1
-    return weeks
-
-
-def getSpecificWeeks(
-    availableWeekNumber,
-    load,
-    cycleLength,
-    nextRestingWeek,
-    currentCycleNumber,
-    currentIndexInCycle,
-    is_top_level=True,
-):
-    if availableWeekNumber == 0:
-        return []
-
-    pattern = (
-        ["W"] * nextRestingWeek + ["R"] + ["W"] * (cycleLength - nextRestingWeek - 1)
-    )
-
-    def build_week(week_type, cycle_num, index_in_cycle):
-        if week_type == "R":
-            return {
-                "cycleType": "Specific",
-                "cycleNumber": cycle_num,
-                "indexInCycle": index_in_cycle,
-                "theoreticalWeeklyTSS": load * 0.6,
-                "theoreticalResting": True,
-            }
-        else:
-            return {
-                "cycleType": "Specific",
-                "cycleNumber": cycle_num,
-                "indexInCycle": index_in_cycle,
-                "theoreticalWeeklyTSS": load,
-                "theoreticalResting": False,
-                "keyWorkouts": ["RaceIntensity", "Long", "ShortIntensity"],
-            }
-
-    def pattern_to_weeks(pat, cycle_num, start_idx):
-        weeks = []
-        for i, wtype in enumerate(pat):
-            weeks.append(build_week(wtype, cycle_num, start_idx + i))
-        return weeks
-
-    if availableWeekNumber >= cycleLength:
-        # Full cycle
-        full_cycle = pattern_to_weeks(pattern, currentCycleNumber, currentIndexInCycle)
-        remaining = availableWeekNumber - cycleLength
-
-        # Recurse for remaining weeks
-        next_weeks = getSpecificWeeks(
-            remaining,
-            load,
-            cycleLength,
-            nextRestingWeek,
-            currentCycleNumber + 1,
-            1,
-            is_top_level=False,
-        )
-        weeks = full_cycle + next_weeks
-
-        if is_top_level:
-            weeks = fix_ending(weeks, cycleLength)
-        return weeks
-    else:
-        # Partial cycle
-        partial = pattern[:availableWeekNumber]
-
-        def ends_in_resting(p):
-            return p[-1] == "R"
-
-        if ends_in_resting(partial) and len(partial) > 1:
-            # Try alternative partial
-            alt_partial = pattern[-availableWeekNumber:]
-            if not ends_in_resting(alt_partial):
-                partial = alt_partial
-            else:
-                # Fallback: all worked
-                partial = ["W"] * availableWeekNumber
-
-        weeks = pattern_to_weeks(partial, currentCycleNumber, currentIndexInCycle)
-
-        if is_top_level:
-            weeks = fix_ending(weeks, cycleLength)
+    ticks = [i for i in range(0, max_seconds + 1, max_seconds // 5)]  # 5 ticks
+    return {tick: seconds_to_hhmmss(tick) for tick in ticks}
 
-        return weeks
+def load_persisted_plan(athlete_id, connection_parameters):
+    """
+    Load the last plan persisted for the athlete, or an empty plan if there is none.
+    """
+    try:
+        session = create_snowflake_session(connection_parameters)
+        rows = session.sql("SELECT plan FROM plans WHERE strava_id = ?", [athlete_id]).collect()
+        if not rows:
+            return []
+        plan = freeze_plan(deserialize_plan(rows[0]["PLAN"]))
+        log_info(f"Loaded persisted plan of {len(plan)} microcycles for athlete {athlete_id}")
+        return plan
+    except Exception as e:
+        log_error(f"Error loading persisted plan: {e}")
+        return []
 
-# @st.cache_data
-def compute_training_plan(inputs):
-    result = []
-    total_number_of_hours = 0
-    for i in range(len(inputs["races"])):
-        log_info(f"Computing training plan for {i} race")
-        log_info(f"Inputs: {inputs}")
-        if inputs["races"][i]["distance"] >= 0:
-            new_weeks = compute_training_plan_1_race(inputs, i)
-            for week in new_weeks:
-                total_number_of_hours += week["theoreticalWeeklyTSS"]/60
-            result = result + new_weeks
-    log_info(f"Total number of hours: {total_number_of_hours}")
-    st.session_state["total_number_of_hours"] = int(total_number_of_hours)
-    return result
 
-# @st.cache_data
-def compute_training_plan_1_race(inputs, i):
-    raceDistanceKm = inputs["races"][i]["distance"]
-    targetTimeInMinutes = (
-        inputs["races"][i]["target_minutes"] + inputs["races"][i]["target_hours"] * 60
-    )
-    mainSport = inputs["races"][i]["sport"]
-    objective = inputs["races"][i]["objective"]
-    fitnessLevel = inputs["level"]
-    if inputs["races"][i]["other_sports"] != []:
-        mainSportShare = 1 - sum(inputs["races"][i]["other_sport_shares"].values())
-    else:
-        mainSportShare = 1
-    eventSize = determineEventSize(raceDistanceKm, mainSport)
-    raceZone = determineRaceZone(eventSize, objective)
-    eventTSS = calculateEventTss(raceZone, mainSport, targetTimeInMinutes)
-
-    raceInfo = {
-        "raceDistanceKm": raceDistanceKm,
-        "targetTimeInMinutes": targetTimeInMinutes,
-        "eventSize": eventSize,
-        "raceZone": raceZone,
-        "eventTSS": eventTSS,
-        "objective": objective,
-        "fitnessLevel": fitnessLevel,
-        "mainSportShare": mainSportShare,
-        "mainSport": mainSport,
-    }
+STRAVA_SPORT_TYPES = {
+    "Run": "Run",
+    "TrailRun": "Run",
+    "VirtualRun": "Run",
+    "Ride": "Bike",
+    "VirtualRide": "Bike",
+    "GravelRide": "Bike",
+    "MountainBikeRide": "Bike",
+    "EBikeRide": "Bike",
+}
 
-    startLoad = inputs["races"][i]["weekly_start_hours"] * 70
-    endLoad = inputs["races"][i]["weekly_end_hours"] * 70
-    weeklyTssIncreaseRate = (
-        0.05
-        if inputs["increase"] == "Low"
-        else 0.07
-        if inputs["increase"] == "Medium"
-        else 0.1
-    )
-    cycleLength = 4 if inputs["recuperation_level"] == "Low" else 3
-    if i == 0:
-        nextRestingWeek = inputs["next_resting_week"]
-    else:
-        nextRestingWeek = 0
-    declaredHandableLoad = inputs["weekly_hours"] * (
-        60 if "intensity_workouts" not in inputs else 60
-        if inputs["intensity_workouts"] == 0
-        else 65
-        if inputs["intensity_workouts"] == 1
-        else 70
-        if inputs["intensity_workouts"] == 2
-        else 75
-        if inputs["intensity_workouts"] == 3
-        else 80
-        if inputs["intensity_workouts"] == 4
-        else 85
-        if inputs["intensity_workouts"] == 5
-        else 90
-    )
-    declaredNextRestingWeek = inputs["next_resting_week"]
-    currentLongRunTss = (
-        (inputs["longest_workout_hours"] * 60 + inputs["longest_workout_minutes"])
-        / 60
-        * 65
-    )
 
-    currentLongRaceIntensityTss = 0.2 * eventTSS
-    minTssPerWorkout = 30
-    maxTssPerWorkout = REGULAR_MAX_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL[
-        raceInfo["mainSport"]
-    ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
-    # maxTempoTssInLong = 50
-    maxTssPerDay = (
-        MAX_TSS_PER_DAY_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL[
-            raceInfo["mainSport"]
-        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
-    )
-    finalLongRunTss = (
-        LONG_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE[
-            raceInfo["mainSport"]
-        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
-        * eventTSS
-    )
-    finalRaceIntensityTss = (
-        RACE_INTENSITY_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE[
-            raceInfo["mainSport"]
-        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
-        * eventTSS
-    )
-    finalShortIntensityTss = 50
-    finalLongIntensityTss = 70
-
-    loadsInfo = {
-        "startLoad": startLoad,
-        "endLoad": endLoad,
-        "weeklyTssIncreaseRate": weeklyTssIncreaseRate,
-        "cycleLength": cycleLength,
-        "nextRestingWeek": nextRestingWeek,
-        "declaredHandableLoad": declaredHandableLoad,
-        "declaredNextRestingWeek": declaredNextRestingWeek,
-        "minTssPerWorkout": minTssPerWorkout,
-        "maxTssPerWorkout": maxTssPerWorkout,
-        # "maxTempoTssInLong": maxTempoTssInLong,
-        "maxTssPerDay": maxTssPerDay,
-        "currentLongRunTSS": currentLongRunTss,
-        "currentRaceIntensityTSS": currentLongRaceIntensityTss,
-        "finalLongRunTSS": finalLongRunTss,
-        "finalRaceIntensityTSS": finalRaceIntensityTss,
-        "finalShortIntensityTSS": finalShortIntensityTss,
-        "finalLongIntensityTSS": finalLongIntensityTss,
+def activity_to_completed_workout(activity):
+    """
+    Convert a stored Strava activity to the completed workout format used by the planner.
+    The zones come from the binned streams, without them the moving time is counted as endurance (Z2).
+    """
+    sport = STRAVA_SPORT_TYPES.get(activity["type"])
+    if sport is None:
+        return None
+    if activity.get("seconds_in_zone"):
+        return {
+            "id": activity["id"],
+            "date": datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ").date(),
+            "activity": sport,
+            "tss": activity["tss"],
+            "secondsInZone": {int(zone): seconds for zone, seconds in json.loads(activity["seconds_in_zone"]).items()},
+        }
+    moving_time = activity["moving_time"] or 0
+    return {
+        "id": activity["id"],
+        "date": datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ").date(),
+        "activity": sport,
+        "tss": moving_time * TSS_BY_ZONE_BY_SPORT[sport][2] / 3600,
+        "secondsInZone": {2: moving_time},
     }
 
-    raceDate = inputs["races"][i]["date"]
-    
-    if i > 0:
-        # startDate is the next monday after the previous race, between 4 and 11 days after
-        lastRaceDate = inputs["races"][i - 1]["date"]
-
-        # startDate = lastRaceDate + timedelta(days=(7 - lastRaceDate.weekday() if lastRaceDate.weekday() >= 4 else 0))
-        startDate = lastRaceDate + timedelta(days=(6 - lastRaceDate.weekday()))
-        startDate = datetime(startDate.year, startDate.month, startDate.day)
-        # currentDate = lastRaceDate + timedelta(days=(7 - lastRaceDate.weekday() if lastRaceDate.weekday() >= 4 else 0))
-        currentDate = lastRaceDate + timedelta(days=(6 - lastRaceDate.weekday()))
-        # convert currentDate to datetime
-        currentDate = datetime(currentDate.year, currentDate.month, currentDate.day)
-    else:
-        startDate = datetime.today()
-        currentDate = datetime.today()
-        # currentDate = datetime(year=2024, month=12, day=19)
-    
-    
-    # currentDate = datetime(currentDate.year, currentDate.month, currentDate.day)
-    datesInfo = {
-        "startDate": startDate,
-        "endDate": raceDate,
-        "currentDate": currentDate,
-        "currentWeekStart": currentDate - timedelta(currentDate.weekday()),
-        "currentWeekEnd": currentDate + timedelta(6 - currentDate.weekday()),
-        "raceWeekStart": raceDate - timedelta(raceDate.weekday()),
-        "raceWeekEnd": raceDate + timedelta(6 - raceDate.weekday()),
-        "numberOfWeeks": (
-            datetime(year=raceDate.year, month=raceDate.month, day=raceDate.day)
-            - timedelta(raceDate.weekday())
-            - currentDate
-            - timedelta(currentDate.weekday())
-        ).days
-        // 7,
-    }
 
-    longWorkoutDay = inputs["week_organization"]["long_workout_day"]
-    availableDays = inputs["week_organization"]["workout_days"]
-    dayAvailableDurations = inputs["week_organization"]["workout_durations"]
-    # convert the dayAvailableDurations from hours to seconds
-    dayAvailableDurations = {
-        day: dayAvailableDurations[day] * 60 * 60 for day in dayAvailableDurations
-    }
-    weekInfo = {
-        "longWorkoutDay": longWorkoutDay,
-        "availableDays": availableDays,
-        "dayAvailableDurations": dayAvailableDurations,
-    }
+def load_completed_workouts(athlete_id, connection_parameters, days=365):
+    """
+    Load the completed workouts of the athlete from the stored activities.
+    """
+    try:
+        session = create_snowflake_session(connection_parameters)
+        since = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        rows = session.sql(
+            "SELECT id, start_date, moving_time, type, seconds_in_zone, tss FROM activities WHERE athlete_id = ? AND start_date >= ?",
+            [athlete_id, since],
+        ).collect()
+        workouts = []
+        for row in rows:
+            workout = activity_to_completed_workout(
+                {
+                    "id": row["ID"],
+                    "start_date": row["START_DATE"],
+                    "moving_time": row["MOVING_TIME"],
+                    "type": row["TYPE"],
+                    "seconds_in_zone": row["SECONDS_IN_ZONE"],
+                    "tss": row["TSS"],
+                }
+            )
+            if workout is not None:
+                workouts.append(workout)
+        log_info(f"Loaded {len(workouts)} completed workouts for athlete {athlete_id}")
+        return sorted(workouts, key=lambda workout: workout["date"])
+    except Exception as e:
+        log_error(f"Error loading completed workouts: {e}")
+        return []
 
-    currentPlannedMacrocycles = []
-    currentPlannedMicrocycles = []
-    completedWorkouts = []
-    totalMacrocycles, totalMicrocycles = planWeekLoads(
-        loadsInfo,
-        datesInfo,
-        raceInfo,
-        weekInfo,
-        currentPlannedMacrocycles,
-        currentPlannedMicrocycles,
-        completedWorkouts,
-        i
-    )
-    return totalMicrocycles
 
-def send_to_db(data_cycles, inputs, athlete_id, session_id, connection_parameters, result_queue):
+def send_to_db(
+    data_cycles, inputs, athlete_id, session_id, connection_parameters, result_queue, computation=None, since=None
+):
     """
     Function to send data (training plan, inputs, races, and week organization) to the database in a separate thread.
+    A superseded computation is only abandoned before the first write, never between a delete and its inserts.
+    With a since date, the microcycles ending before it are left as they are in the tables.
     """
     try:
         log_debug("Starting database sync in thread...")
+        checkPlanCancelled(computation)
 
         # Create the Snowflake session
         session = create_snowflake_session(connection_parameters)
+        checkPlanCancelled(computation)
         # Handle microcycles and microcycle days
-        start_dates = [cycle["startDate"] for cycle in data_cycles]
+        written_cycles = [cycle for cycle in data_cycles if since is None or final_date(cycle["endDate"]) >= since]
+        start_dates = [cycle["startDate"] for cycle in written_cycles]
 
         if start_dates:
             placeholders = ", ".join(["?"] * len(start_dates))
@@ -2993,7 +378,7 @@ def send_to_db(data_cycles, inputs, athlete_id, session_id, connection_parameter
         # Bulk insert microcycles
         microcycle_values = []
         microcycle_params = []
-        for cycle in data_cycles:
+        for cycle in written_cycles:
             microcycle_values.append("(?, ?, ?, ?, ?, ?)")
             microcycle_params.extend([
                 athlete_id, session_id, cycle["startDate"], cycle["endDate"],
@@ -3010,7 +395,7 @@ def send_to_db(data_cycles, inputs, athlete_id, session_id, connection_parameter
         # Bulk insert microcycle days
         day_values = []
         day_params = []
-        for cycle in data_cycles:
+        for cycle in written_cycles:
             if "dayByDay" in cycle:
                 for day, day_activities in cycle["dayByDay"].items():
                     for idx, activity in enumerate(day_activities):
@@ -3027,6 +412,21 @@ def send_to_db(data_cycles, inputs, athlete_id, session_id, connection_parameter
             VALUES {day_val_str}
             """, day_params).collect()
 
+        # Persist the whole plan so that the next visit replans from it instead of from scratch
+        if str(athlete_id) != "0":
+            session.sql("""
+            MERGE INTO plans AS target
+            USING (SELECT ? AS strava_id, ? AS session_id, ? AS plan, ? AS inputs) AS source
+            ON target.strava_id = source.strava_id
+            WHEN MATCHED THEN UPDATE SET
+                session_id = source.session_id,
+                plan = source.plan,
+                inputs = source.inputs,
+                updated_at = CURRENT_TIMESTAMP()
+            WHEN NOT MATCHED THEN INSERT (strava_id, session_id, plan, inputs, updated_at)
+            VALUES (source.strava_id, source.session_id, source.plan, source.inputs, CURRENT_TIMESTAMP())
+            """, [athlete_id, session_id, serialize_plan(data_cycles), json.dumps(inputs, default=encode_plan_value)]).collect()
+
         # Flatten inputs for storage
         flattened_inputs = {
             "athlete_id": athlete_id,
@@ -3117,10 +517,92 @@ def send_to_db(data_cycles, inputs, athlete_id, session_id, connection_parameter
         # Notify success
         result_queue.put("completed")
         log_debug("Database sync completed successfully.")
+    except PlanComputationCancelled as e:
+        log_info(f"Database sync abandoned: {e}")
     except Exception as e:
         result_queue.put(f"error: {str(e)}")
         log_error(f"Error during database sync: {e}")
 
+@st.cache_resource
+def get_plan_cache():
+    """Completed plans of the sessions without history, by plan key, shared by all the sessions"""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+
+def shared_plan_key(inputs, persisted_plan, completed_workouts):
+    """Key of the plan in the shared cache, None when the plan depends on the athlete's history"""
+    if persisted_plan or completed_workouts:
+        return None
+    # The plan starts from today, it changes with the day
+    return hashPlanInputs(inputs, date.today())
+
+
+def get_shared_plan(plan_key):
+    """The shared plan and its index, or None"""
+    cache = get_plan_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(plan_key)
+        if entry is not None:
+            cache["entries"].move_to_end(plan_key)
+        return entry
+
+
+def store_shared_plan(plan_key, plan):
+    """Share a completed plan, the sessions computing the same plan then reference this one"""
+    cache = get_plan_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(plan_key)
+        if entry is None:
+            entry = cache["entries"][plan_key] = {"plan": plan, "index": buildCycleIndex(plan)}
+        while len(cache["entries"]) > PLAN_CACHE_SIZE:
+            cache["entries"].popitem(last=False)
+        return entry
+
+
+def complete_plan_in_background(
+    plan, inputs, computation, athlete_id, session_id, connection_parameters, plan_queue, result_queue, plan_key=None
+):
+    """
+    Plan the pending workouts then sync the plan to the database, in a separate thread.
+    The plan is handed back with its revision each time a week is planned, nothing is done once superseded.
+    A completed plan with a key is shared with the other sessions.
+    """
+    try:
+        weeks = []
+        degraded = False
+        try:
+            with planTrace(computation):
+                for week in iter_completed_plan(plan, inputs, computation):
+                    weeks.append(week)
+                    if plan[len(weeks) - 1].get("dayByDayPending"):
+                        plan_queue.put((computation["revision"], tuple(weeks) + plan[len(weeks) :]))
+        except PlanTimeBudgetExceeded as e:
+            log_warning(f"{e}, the weeks left keep their loads without workouts (inputs {hashPlanInputs(inputs)})")
+            degraded = True
+            weeks += [
+                freeze_plan({key: value for key, value in week.items() if key != "dayByDayPending"})
+                for week in plan[len(weeks) :]
+            ]
+            plan_queue.put((computation["revision"], tuple(weeks)))
+        if computation["trace"] is not None:
+            log_info(f"Plan trace of revision {computation['revision']}:\n{format_plan_trace(computation['trace'])}")
+        # A plan cut short by the time budget is not shared, the next visitor gets another chance
+        if plan_key is not None and has_pending_weeks(plan) and not degraded:
+            # Hand back the shared plan so that the session references it
+            weeks = store_shared_plan(plan_key, tuple(weeks))["plan"]
+            plan_queue.put((computation["revision"], weeks))
+        completedPlan = tuple(weeks)
+        # The time budget only bounds the planning, the sync is still cancelled when superseded
+        computation["deadline"] = None
+        checkPlanCancelled(computation)
+        send_to_db(completedPlan, inputs, athlete_id, session_id, connection_parameters, result_queue, computation)
+    except PlanComputationCancelled as e:
+        log_info(f"Plan completion abandoned: {e}")
+    except Exception as e:
+        log_error(f"Error completing the training plan: {e}")
+        result_queue.put(f"error: {str(e)}")
+
+
 # Function to add a new race
 def add_race():
     if len(st.session_state["inputs"]["races"]) >= 3:
@@ -3247,24 +729,120 @@ def update_training_preferences():
     st.session_state["inputs_changed"] = True  # Mark inputs as changed
 
 
-if st.session_state["inputs_changed"]:
-    st.session_state["plan"] = compute_training_plan(st.session_state["inputs"])
+if "persisted_plan" not in st.session_state:
+    st.session_state["persisted_plan"] = []  # Plan of the logged in athlete, replanned from today
+
+if "completed_workouts" not in st.session_state:
+    st.session_state["completed_workouts"] = []
+
+if "plan_revision" not in st.session_state:
+    st.session_state["plan_revision"] = 0  # Incremented on every input change, latest wins
+    st.session_state["plan_computation"] = None  # Token of the background completion in flight
+    st.session_state["plan_queue"] = Queue()  # Completed plans, with their revision
+    st.session_state["plan_key"] = None  # Key of the plan in the shared cache, if shared
+
+
+def supersede_plan_computation():
+    st.session_state["plan_revision"] += 1
+    if st.session_state["plan_computation"] is not None:
+        st.session_state["plan_computation"]["cancelled"].set()
+
+
+def keep_fallback_plan():
+    """Plan shown when the first computation ran out of time: the persisted plan, else the loads without workouts"""
+    if st.session_state["persisted_plan"]:
+        plan = freeze_plan(st.session_state["persisted_plan"])
+    else:
+        # The planner loops are bounded, without the history and the workouts this pass ends
+        plan = compute_training_plan(st.session_state["inputs"], withDayByDay=False)
+    st.session_state["plan"] = plan
+    st.session_state["plan_index"] = buildCycleIndex(plan)
+
+
+def refresh_training_plan():
+    # The previous computation is only superseded once the new plan exists
+    computation = new_plan_computation(st.session_state["plan_revision"] + 1)
     st.session_state["inputs_changed"] = False  # Reset the flag
+    # Visitors without history share the plans of the same inputs
+    plan_key = shared_plan_key(
+        st.session_state["inputs"], st.session_state["persisted_plan"], st.session_state["completed_workouts"]
+    )
+    shared_plan = get_shared_plan(plan_key) if plan_key is not None else None
+    if shared_plan is not None:
+        st.session_state["plan"] = shared_plan["plan"]
+        st.session_state["plan_index"] = shared_plan["index"]
+    else:
+        # Only the weekly loads so that the main chart is refreshed right away,
+        # the workouts are planned in the background
+        try:
+            with planTrace(computation):
+                st.session_state["plan"] = compute_training_plan(
+                    st.session_state["inputs"],
+                    st.session_state["persisted_plan"],
+                    st.session_state["completed_workouts"],
+                    withDayByDay=False,
+                    computation=computation,
+                )
+        except PlanTimeBudgetExceeded as e:
+            log_warning(f"{e}, the previous plan is kept (inputs {hashPlanInputs(st.session_state['inputs'])})")
+            st.error("The training plan could not be computed for these inputs, the previous plan is kept.")
+            if st.session_state["plan"] is None:
+                keep_fallback_plan()
+            return
+        st.session_state["plan_index"] = buildCycleIndex(st.session_state["plan"])
+    supersede_plan_computation()
+    st.session_state["plan_computation"] = computation
+    st.session_state["plan_key"] = plan_key
     # # Trigger recompute
     # st.session_state["mock_data"] = compute_training_plan(st.session_state["inputs"])
-    # Launch the background sync thread
-    data_cycles = st.session_state["plan"]
+
+    # Launch the background completion and sync thread
     athlete_id = st.session_state.get("athlete_id", "0")
     # session_id = st.session_state.get("cookies", {}).get("session_id", "")
-
     threading.Thread(
-        target=send_to_db,
-        args=(data_cycles, st.session_state["inputs"], athlete_id, session_id, connection_parameters, st.session_state["result_queue"]),
+        target=complete_plan_in_background,
+        args=(
+            st.session_state["plan"],
+            dict(st.session_state["inputs"]),
+            computation,
+            athlete_id,
+            session_id,
+            connection_parameters,
+            st.session_state["plan_queue"],
+            st.session_state["result_queue"],
+            plan_key,
+        ),
         daemon=True,
     ).start()
     st.session_state["db_sync_status"] = "in_progress"
 
 
+@st.fragment(run_every=PLAN_POLL_INTERVAL)
+def poll_plan_completion():
+    """Swap in the latest plan streamed for the current revision, older revisions are dropped"""
+    plan = None
+    while not st.session_state["plan_queue"].empty():
+        revision, streamedPlan = st.session_state["plan_queue"].get()
+        if revision == st.session_state["plan_revision"]:
+            plan = streamedPlan
+    if plan is None:
+        return
+    st.session_state["plan"] = plan
+    shared_plan = get_shared_plan(st.session_state["plan_key"]) if st.session_state["plan_key"] is not None else None
+    if shared_plan is not None and shared_plan["plan"] is plan:
+        st.session_state["plan_index"] = shared_plan["index"]
+    else:
+        st.session_state["plan_index"] = buildCycleIndex(plan)
+    if str(st.session_state.get("athlete_id", "0")) != "0" and not has_pending_weeks(plan):
+        # Next computations replan from this plan, past weeks stay analyzed
+        st.session_state["persisted_plan"] = plan
+    st.rerun()
+
+
+if st.session_state["inputs_changed"]:
+    refresh_training_plan()
+
+
 def update_race_data():
     # Dynamically collect all race data
     races = []
@@ -3303,185 +881,1190 @@ def update_week_organization():
     }
 
 
-# Helper function to ensure total share does not exceed 50%
-def validate_total_share(shares):
-    total_share = sum(shares.values())
-    if total_share > 50:
-        st.error(
-            f"Total share for other sports cannot exceed 50%. Currently: {total_share}%"
-        )
+# Helper function to ensure total share does not exceed 50%
+def validate_total_share(shares):
+    total_share = sum(shares.values())
+    if total_share > 50:
+        st.error(
+            f"Total share for other sports cannot exceed 50%. Currently: {total_share}%"
+        )
+
+@st.cache_resource
+def get_strava_http_session():
+    """Keep-alive connections to Strava, shared by all the sessions (the token is given per request)"""
+    http_session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(STRAVA_FETCH_CONCURRENCY, 1) * 4)
+    http_session.mount("https://", adapter)
+    return http_session
+
+
+@st.cache_resource
+def get_strava_scheduler():
+    """
+    Budget of the Strava requests of the whole app, shared by the sessions and the background jobs:
+    the usage of the 15 minutes and daily windows, the requests waiting for their turn by priority, and metrics.
+    """
+    return {
+        "condition": threading.Condition(),
+        "limits": list(STRAVA_DEFAULT_RATE_LIMITS),
+        "usage": [0, 0],
+        "resets": strava_window_resets(time.time()),
+        "blocked_until": 0.0,
+        "waiting": [],
+        "sequence": 0,
+        "metrics": {
+            "requests": {priority: 0 for priority in STRAVA_MAX_WAIT_BY_PRIORITY},
+            "rate_limited": 0,
+            "given_up": 0,
+            "wait_seconds": 0.0,
+        },
+    }
+
+
+def strava_window_resets(now):
+    """End of the current 15 minutes window and of the current day (UTC), as Strava counts them"""
+    return [(now // 900 + 1) * 900, (now // 86400 + 1) * 86400]
+
+
+def strava_budget_available_at(scheduler, priority, now):
+    """When a request of the priority fits in both windows, the backfill leaving a reserve to the interactive requests"""
+    if scheduler["usage"][0] and now >= scheduler["resets"][0]:
+        scheduler["usage"][0] = 0
+    if scheduler["usage"][1] and now >= scheduler["resets"][1]:
+        scheduler["usage"][1] = 0
+    scheduler["resets"] = strava_window_resets(now)
+    available_at = max(now, scheduler["blocked_until"])
+    for limit, usage, reset in zip(scheduler["limits"], scheduler["usage"], scheduler["resets"]):
+        reserve = STRAVA_INTERACTIVE_RESERVE * limit if priority != STRAVA_PRIORITY_INTERACTIVE else 0
+        if limit - usage <= reserve:
+            available_at = max(available_at, reset)
+    return available_at
+
+
+def acquire_strava_budget(priority):
+    """
+    Wait for the turn of the request, the higher priorities and then the oldest first, and for the budget.
+    False if it does not come within the maximum wait of the priority.
+    """
+    scheduler = get_strava_scheduler()
+    started = time.time()
+    deadline = started + STRAVA_MAX_WAIT_BY_PRIORITY[priority]
+    with scheduler["condition"]:
+        scheduler["sequence"] += 1
+        ticket = (priority, scheduler["sequence"])
+        heapq.heappush(scheduler["waiting"], ticket)
+        while True:
+            now = time.time()
+            if scheduler["waiting"][0] == ticket:
+                available_at = strava_budget_available_at(scheduler, priority, now)
+                if available_at <= now:
+                    break
+                if available_at > deadline:
+                    # Waiting would not be enough, the request is answered as rate limited right away
+                    scheduler["waiting"].remove(ticket)
+                    heapq.heapify(scheduler["waiting"])
+                    scheduler["metrics"]["given_up"] += 1
+                    scheduler["condition"].notify_all()
+                    return False
+                scheduler["condition"].wait(available_at - now)
+            elif now >= deadline:
+                scheduler["waiting"].remove(ticket)
+                heapq.heapify(scheduler["waiting"])
+                scheduler["metrics"]["given_up"] += 1
+                return False
+            else:
+                scheduler["condition"].wait(deadline - now)
+        heapq.heappop(scheduler["waiting"])
+        scheduler["usage"] = [usage + 1 for usage in scheduler["usage"]]
+        scheduler["metrics"]["requests"][priority] += 1
+        scheduler["metrics"]["wait_seconds"] += time.time() - started
+        scheduler["condition"].notify_all()
+        return True
+
+
+def record_strava_rate_limits(method, response):
+    """Take the usage and limits Strava counts from the response, a 429 blocks the requests until the window ends"""
+    scheduler = get_strava_scheduler()
+    # The read requests have their own, lower, limits
+    prefix = "X-ReadRateLimit" if method == "GET" and "X-ReadRateLimit-Limit" in response.headers else "X-RateLimit"
+    with scheduler["condition"]:
+        try:
+            scheduler["limits"] = [int(value) for value in response.headers[f"{prefix}-Limit"].split(",")][:2]
+            scheduler["usage"] = [int(value) for value in response.headers[f"{prefix}-Usage"].split(",")][:2]
+        except (KeyError, ValueError):
+            pass
+        if response.status_code == 429:
+            scheduler["metrics"]["rate_limited"] += 1
+            scheduler["blocked_until"] = strava_window_resets(time.time())[0]
+            log_warning(f"Strava rate limit reached, requests paused until the next window: {strava_usage_metrics()}")
+        scheduler["condition"].notify_all()
+
+
+def strava_usage_metrics():
+    """Snapshot of the Strava budget and of the scheduler counters"""
+    scheduler = get_strava_scheduler()
+    with scheduler["condition"]:
+        return {
+            "limits": list(scheduler["limits"]),
+            "usage": list(scheduler["usage"]),
+            "resets": list(scheduler["resets"]),
+            "blocked_until": scheduler["blocked_until"],
+            "waiting": {
+                priority: sum(1 for ticket in scheduler["waiting"] if ticket[0] == priority)
+                for priority in STRAVA_MAX_WAIT_BY_PRIORITY
+            },
+            "requests": dict(scheduler["metrics"]["requests"]),
+            "rate_limited": scheduler["metrics"]["rate_limited"],
+            "given_up": scheduler["metrics"]["given_up"],
+            "wait_seconds": round(scheduler["metrics"]["wait_seconds"], 3),
+        }
+
+
+def strava_request(method, path, access_token, priority=STRAVA_PRIORITY_INTERACTIVE, **kwargs):
+    """
+    Every call to the Strava API goes through here, so that the app stays within its rate limits.
+    A request refused for lack of budget, by the scheduler or by Strava, gets a 429 response.
+    """
+    url = f"{STRAVA_API_URL}{path}"
+    for _ in range(2):
+        if not acquire_strava_budget(priority):
+            response = requests.Response()
+            response.status_code = 429
+            response.url = url
+            response._content = b'{"message": "Rate Limit Exceeded"}'
+            return response
+        response = get_strava_http_session().request(
+            method, url, headers={"Authorization": f"Bearer {access_token}"}, **kwargs
+        )
+        record_strava_rate_limits(method, response)
+        # Retried once, after the window when the wait fits in the priority
+        if response.status_code != 429:
+            return response
+    return response
+
+
+def fetch_activities_page(after_ts, access_token, page):
+    """One page of the activities after the timestamp, None if Strava refused it"""
+    log_info(f"Fetching activities from page {page}...")
+    response = strava_request(
+        "GET", "/athlete/activities", access_token, params={"after": after_ts, "page": page, "per_page": STRAVA_PAGE_SIZE}
+    )
+    if response.status_code != 200:
+        log_error(f"Error fetching activities page {page}: {response.status_code}, {response.text}")
+        return None
+    batch = response.json()
+    log_info(f"Fetched {len(batch)} activities from page {page}")
+    return batch
+
+
+# @st.cache_data
+def fetch_activities(after_ts, access_token, max_concurrency=STRAVA_FETCH_CONCURRENCY):
+    """
+    All the activities after the timestamp, read in order, the list ends at the first page that is
+    not full. The first page is requested alone, most syncs fit in it; each full page doubles the
+    pages requested ahead, up to max_concurrency. None if Strava refused a page, a partial list
+    would look like deleted activities to the reconciliation.
+    """
+    activities = []
+    with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+        inFlight = {}
+        nextPage = 1
+        page = 1
+        pagesAhead = 1
+        while True:
+            while len(inFlight) < pagesAhead:
+                inFlight[nextPage] = executor.submit(fetch_activities_page, after_ts, access_token, nextPage)
+                nextPage += 1
+            batch = inFlight.pop(page).result()
+            if batch is None:
+                st.error("Failed to fetch activities.")
+                activities = None
+                break
+            activities.extend(batch)
+            if len(batch) < STRAVA_PAGE_SIZE:
+                break
+            page += 1
+            pagesAhead = min(pagesAhead * 2, max(max_concurrency, 1))
+        # The pages after the end of the list are empty, drop the ones not sent yet
+        for future in inFlight.values():
+            future.cancel()
+    return activities
+
+def load_sync_state(session, athlete_id):
+    """High-water mark of the activities of the athlete already stored, None before the first sync"""
+    rows = session.sql(
+        "SELECT last_start_date, last_activity_id, last_reconciled_at FROM strava_sync_state WHERE athlete_id = ?",
+        [athlete_id],
+    ).collect()
+    if not rows:
+        return None
+    return {
+        "last_start_date": rows[0]["LAST_START_DATE"],
+        "last_activity_id": rows[0]["LAST_ACTIVITY_ID"],
+        "last_reconciled_at": rows[0]["LAST_RECONCILED_AT"],
+    }
+
+
+def save_sync_state(session, athlete_id, sync_state):
+    session.sql(
+        """
+        MERGE INTO strava_sync_state s
+        USING (SELECT ? AS athlete_id, ? AS last_start_date, ? AS last_activity_id, ? AS last_reconciled_at) vals
+        ON s.athlete_id = vals.athlete_id
+        WHEN MATCHED THEN
+            UPDATE SET last_start_date = vals.last_start_date, last_activity_id = vals.last_activity_id, last_reconciled_at = vals.last_reconciled_at
+        WHEN NOT MATCHED THEN
+            INSERT (athlete_id, last_start_date, last_activity_id, last_reconciled_at)
+            VALUES (vals.athlete_id, vals.last_start_date, vals.last_activity_id, vals.last_reconciled_at)
+        """,
+        [athlete_id, sync_state["last_start_date"], sync_state["last_activity_id"], sync_state["last_reconciled_at"]],
+    ).collect()
+
+
+def merge_activities(session, activities, athlete_id, session_id, update_existing=False):
+    """
+    Store the activities in a single MERGE statement, the stored ones are only rewritten
+    when update_existing is set (reconciliation of edited activities).
+    """
+    if not activities:
+        return
+    values_clause = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(activities))
+    params = []
+    for activity in activities:
+        params.extend([
+            activity["id"],
+            athlete_id,
+            session_id,
+            activity["name"],
+            activity["start_date"],
+            activity["distance"],
+            activity["moving_time"],
+            activity["elapsed_time"],
+            activity["total_elevation_gain"],
+            activity["type"],
+            activity.get("workout_type"),
+        ])
+    update_clause = """
+    WHEN MATCHED THEN
+        UPDATE SET name = vals.name, start_date = vals.start_date, distance = vals.distance, moving_time = vals.moving_time,
+            elapsed_time = vals.elapsed_time, total_elevation_gain = vals.total_elevation_gain, type = vals.type, workout_type = vals.workout_type
+    """ if update_existing else ""
+    query = f"""
+    MERGE INTO activities a
+    USING (
+        SELECT * FROM VALUES {values_clause}
+        AS vals(id, athlete_id, session_id, name, start_date, distance, moving_time, elapsed_time, total_elevation_gain, type, workout_type)
+    ) vals
+    ON a.id = vals.id{update_clause}
+    WHEN NOT MATCHED THEN
+        INSERT (id, athlete_id, session_id, name, start_date, distance, moving_time, elapsed_time, total_elevation_gain, type, workout_type)
+        VALUES (vals.id, vals.athlete_id, vals.session_id, vals.name, vals.start_date, vals.distance, vals.moving_time, vals.elapsed_time, vals.total_elevation_gain, vals.type, vals.workout_type)
+    """
+    session.sql(query, params).collect()
+    log_debug(f"Merged {len(activities)} activities into Snowflake.")
+
+
+def stored_activity_ids(session, athlete_id, activity_ids):
+    """The ids among the given ones of the activities of the athlete already stored"""
+    if not activity_ids:
+        return set()
+    rows = session.sql(
+        f"SELECT id FROM activities WHERE athlete_id = ? AND id IN ({', '.join(['?'] * len(activity_ids))})",
+        [athlete_id, *activity_ids],
+    ).collect()
+    return {row["ID"] for row in rows}
+
+
+def delete_missing_activities(session, athlete_id, since, kept_ids):
+    """Delete the stored activities started since the date that Strava no longer lists"""
+    query = "DELETE FROM activities WHERE athlete_id = ? AND start_date >= ?"
+    params = [athlete_id, since]
+    if kept_ids:
+        query += f" AND id NOT IN ({', '.join(['?'] * len(kept_ids))})"
+        params.extend(kept_ids)
+    session.sql(query, params).collect()
+
+
+def fetch_athlete_zones(access_token):
+    """
+    Zone bounds the athlete set on Strava, by stream: the lower bound of every zone but the first,
+    the n-th zone of Strava being the n-th zone of the planner. Empty when Strava does not share them.
+    """
+    response = strava_request("GET", "/athlete/zones", access_token, priority=STRAVA_PRIORITY_BACKFILL)
+    if response.status_code != 200:
+        log_warning(f"Athlete zones not available: {response.status_code}, {response.text}")
+        return {}
+    zones = {}
+    for kind, stream in (("heart_rate", "heartrate"), ("power", "watts")):
+        bounds = (response.json().get(kind) or {}).get("zones") or []
+        if len(bounds) > 1:
+            zones[stream] = np.array([bound["min"] for bound in bounds[1:]], dtype=float)
+    return zones
+
+
+def fetch_activity_streams(activity, athlete_id, access_token):
+    """
+    The streams of the activity as arrays by type, None if Strava refused them.
+    They are kept compressed in the local cache, an activity is only downloaded once.
+    """
+    cache = get_activity_cache()
+    with cache["lock"]:
+        row = cache["connection"].execute(
+            "SELECT streams FROM activity_streams WHERE activity_id = ?", (activity["id"],)
+        ).fetchone()
+    if row is not None:
+        streams = json.loads(zlib.decompress(row[0]))
+    else:
+        response = strava_request(
+            "GET",
+            f"/activities/{activity['id']}/streams",
+            access_token,
+            priority=STRAVA_PRIORITY_BACKFILL,
+            params={"keys": STRAVA_STREAM_KEYS, "key_by_type": "true"},
+        )
+        if response.status_code != 200:
+            log_error(f"Error fetching streams of activity {activity['id']}: {response.status_code}, {response.text}")
+            return None
+        streams = {kind: stream["data"] for kind, stream in response.json().items()}
+        with cache["lock"]:
+            with cache["connection"] as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO activity_streams (activity_id, athlete_id, start_date, streams) VALUES (?, ?, ?, ?)",
+                    (activity["id"], athlete_id, activity["start_date"], zlib.compress(json.dumps(streams).encode())),
+                )
+    # Missing samples become NaN
+    return {kind: pd.Series(data, dtype=float).to_numpy() for kind, data in streams.items()}
+
+
+def select_zone_stream(streams, zones):
+    """
+    The stream measuring the intensity of the activity, power when the athlete has power zones else heart rate,
+    with the seconds each sample counts for: the time since the previous one, pauses excluded.
+    None when no stream can be used.
+    """
+    kind = next((kind for kind in ("watts", "heartrate") if kind in streams and kind in zones), None)
+    if kind is None or "time" not in streams:
+        return None
+    durations = np.diff(streams["time"], prepend=streams["time"][:1])
+    durations[durations > STREAM_MAX_SAMPLE_GAP] = 0
+    if "moving" in streams:
+        durations *= streams["moving"]
+    return kind, streams[kind], durations
+
+
+def bin_streams_into_zones(streams, zones):
+    """
+    Seconds spent in each zone, all the samples being binned at once. None when no stream can be binned.
+    """
+    selected = select_zone_stream(streams, zones)
+    if selected is None:
+        return None
+    kind, values, durations = selected
+    sampled = ~np.isnan(values)
+    zoneIndexes = np.minimum(np.digitize(values[sampled], zones[kind]), len(ZONES["Run"]) - 1)
+    seconds = np.bincount(zoneIndexes, weights=durations[sampled], minlength=len(ZONES["Run"]))
+    return {int(zone) + 1: float(seconds[zone]) for zone in np.flatnonzero(seconds)}
+
+
+def stream_tss_inputs(streams, zones):
+    """The smoothed stream, sample durations, threshold and exponent of the TSS of the activity, None without a threshold"""
+    selected = select_zone_stream(streams, zones)
+    if selected is None:
+        return None
+    kind, values, durations = selected
+    boundIndex, thresholdFraction = STREAM_THRESHOLD_BY_KIND[kind]
+    if len(zones[kind]) <= boundIndex:
+        return None
+    # A missing sample keeps the previous value
+    values = pd.Series(values).ffill().fillna(0).to_numpy()
+    return values, durations, zones[kind][boundIndex] / thresholdFraction, STREAM_TSS_EXPONENT_BY_KIND[kind]
+
+
+def compute_activities_tss(batch):
+    """
+    TSS of a batch of activities in the planner units, an hour at threshold being worth 100 (TSS_BY_ZONE_BY_SPORT zone 4).
+    Each activity is given as (values, durations, threshold, exponent): the values are averaged over a rolling window of
+    TSS_ROLLING_WINDOW samples, then over the activity at the exponent, and the intensity factor is this average over
+    the threshold. With power and an exponent of 4 the average is the normalized power.
+    The activities sharing an exponent are concatenated so that every step runs once for all of them.
+    """
+    tss = np.zeros(len(batch))
+    for exponent in {exponent for _, _, _, exponent in batch}:
+        members = [i for i, (values, _, _, activityExponent) in enumerate(batch) if activityExponent == exponent and len(values)]
+        if members:
+            tss[members] = computeTssAtExponent([batch[i] for i in members], exponent)
+    return tss
+
+
+def computeTssAtExponent(batch, exponent):
+    """TSS of non empty activities averaged at the same exponent, see compute_activities_tss"""
+    lengths = np.array([len(values) for values, _, _, _ in batch])
+    starts = np.cumsum(lengths) - lengths
+    values = np.concatenate([values for values, _, _, _ in batch]).astype(float, copy=False)
+    durations = np.concatenate([durations for _, durations, _, _ in batch]).astype(float, copy=False)
+    thresholds = np.array([threshold for _, _, threshold, _ in batch], dtype=float)
+
+    # Rolling mean from the cumulated sums, the first samples of each activity only average the samples since its start
+    cumulated = np.concatenate(([0.0], np.cumsum(values)))
+    rolling = np.empty_like(values)
+    rolling[TSS_ROLLING_WINDOW - 1:] = (cumulated[TSS_ROLLING_WINDOW:] - cumulated[:-TSS_ROLLING_WINDOW]) / TSS_ROLLING_WINDOW
+    for start, length in zip(starts, lengths):
+        head = min(TSS_ROLLING_WINDOW - 1, length)
+        rolling[start:start + head] = (cumulated[start + 1:start + head + 1] - cumulated[start]) / np.arange(1, head + 1)
+
+    movingSeconds = np.add.reduceat(durations, starts)
+    weightedSums = np.add.reduceat(durations * rolling ** exponent, starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intensityFactors = np.where(movingSeconds > 0, (weightedSums / movingSeconds) ** (1 / exponent) / thresholds, 0)
+    return movingSeconds * intensityFactors ** 2 / 3600 * 100
+
+
+def ingest_activity_streams(session, athlete_id, activities, access_token):
+    """
+    Time in zone and TSS of the recent activities from their streams, stored with the activities for the replanning.
+    The streams are downloaded concurrently and the TSS computed in one batch. The activities that cannot be binned
+    keep the endurance estimate.
+    """
+    since = (datetime.utcnow() - timedelta(days=STRAVA_STREAM_DAYS)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    activities = [activity for activity in activities if activity["start_date"] >= since and activity["type"] in STRAVA_SPORT_TYPES]
+    if not activities:
+        return
+    zones = fetch_athlete_zones(access_token)
+    if not zones:
+        return
+    with ThreadPoolExecutor(max_workers=max(STRAVA_FETCH_CONCURRENCY, 1)) as executor:
+        all_streams = list(executor.map(lambda activity: fetch_activity_streams(activity, athlete_id, access_token), activities))
+    binned = []
+    for activity, streams in zip(activities, all_streams):
+        secondsInZone = bin_streams_into_zones(streams, zones) if streams else None
+        if secondsInZone:
+            binned.append((activity, secondsInZone, stream_tss_inputs(streams, zones)))
+    # The TSS of all the activities with a threshold in a single batch, the zone rates of the planner otherwise
+    withThreshold = [tssInputs for _, _, tssInputs in binned if tssInputs is not None]
+    streamTss = iter(compute_activities_tss(withThreshold))
+    params = []
+    for activity, secondsInZone, tssInputs in binned:
+        if tssInputs is not None:
+            tss = float(next(streamTss))
+        else:
+            tssByZone = TSS_BY_ZONE_BY_SPORT[STRAVA_SPORT_TYPES[activity["type"]]]
+            tss = sum(seconds * tssByZone[zone] / 3600 for zone, seconds in secondsInZone.items())
+        params.extend([activity["id"], json.dumps(secondsInZone), tss])
+    if not params:
+        return
+    session.sql(
+        f"""
+        MERGE INTO activities a
+        USING (
+            SELECT * FROM VALUES {", ".join(["(?, ?, ?)"] * (len(params) // 3))}
+            AS vals(id, seconds_in_zone, tss)
+        ) vals
+        ON a.id = vals.id
+        WHEN MATCHED THEN
+            UPDATE SET seconds_in_zone = vals.seconds_in_zone, tss = vals.tss
+        """,
+        params,
+    ).collect()
+    log_info(f"Binned the streams of {len(params) // 3} out of {len(activities)} recent activities into zones")
+
+
+def ingest_activity_streams_in_background(athlete_id, activities, access_token, connection_parameters):
+    """Stream ingestion of a sync, in a separate thread"""
+    try:
+        ingest_activity_streams(create_snowflake_session(connection_parameters), athlete_id, activities, access_token)
+    except Exception as e:
+        log_error(f"Error ingesting activity streams: {e}")
+
+
+def sync_activities(athlete_id, session_id, access_token, connection_parameters):
+    """
+    Bring the stored activities of the athlete up to date with Strava and return how many are new,
+    None when Strava could not be reached.
+    The first sync downloads STRAVA_HISTORY_DAYS, the next ones only ask for the activities started
+    after the high-water mark (one page in general). Every STRAVA_RECONCILE_INTERVAL_DAYS the last
+    STRAVA_RECONCILE_WINDOW_DAYS are downloaded again to pick up the edited and deleted activities.
+    """
+    session = create_snowflake_session(connection_parameters)
+    sync_state = load_sync_state(session, athlete_id)
+    # Strava dates are UTC, aware datetimes give the right epoch whatever the timezone of the server
+    now = datetime.now(timezone.utc)
+    if sync_state is None:
+        reconcile_since = now - timedelta(days=STRAVA_HISTORY_DAYS)
+    elif not sync_state["last_reconciled_at"] or now - parse_strava_date(sync_state["last_reconciled_at"]) >= timedelta(days=STRAVA_RECONCILE_INTERVAL_DAYS):
+        # A mark older than the window is caught up in the same download
+        reconcile_since = min(now - timedelta(days=STRAVA_RECONCILE_WINDOW_DAYS), parse_strava_date(sync_state["last_start_date"]))
+    else:
+        reconcile_since = None
+
+    if reconcile_since is not None:
+        log_info(f"Reconciling the activities of athlete {athlete_id} since {reconcile_since:%Y-%m-%d}")
+        activities = fetch_activities(int(reconcile_since.timestamp()), access_token)
+    else:
+        # One second earlier so that an activity started at the same second as the mark is not missed
+        after_ts = int(parse_strava_date(sync_state["last_start_date"]).timestamp()) - 1
+        activities = fetch_activities(after_ts, access_token, max_concurrency=1)
+    if activities is None:
+        # The stored activities stay as they are, the next login retries from the same mark
+        return None
+
+    mark = (sync_state["last_start_date"], sync_state["last_activity_id"]) if sync_state is not None else None
+    new_activities = [activity for activity in activities if mark is None or (activity["start_date"], activity["id"]) > mark]
+    if reconcile_since is not None:
+        merge_activities(session, activities, athlete_id, session_id, update_existing=True)
+        delete_missing_activities(session, athlete_id, reconcile_since.strftime("%Y-%m-%dT%H:%M:%SZ"), [activity["id"] for activity in activities])
+    else:
+        # The webhook may have stored some of them already, they are in the rollups
+        stored_ids = stored_activity_ids(session, athlete_id, [activity["id"] for activity in new_activities])
+        merge_activities(session, new_activities, athlete_id, session_id)
+    if sync_state is not None and not has_weekly_rollups(session, athlete_id):
+        # Athletes synced before the rollups existed get the whole history rolled up once
+        rebuild_weekly_rollups(session, athlete_id, week_start_of(now - timedelta(days=STRAVA_HISTORY_DAYS)))
+    elif reconcile_since is not None:
+        # Edits and deletions can change any week of the window, its weeks are rebuilt from the stored activities
+        rebuild_weekly_rollups(session, athlete_id, week_start_of(reconcile_since))
+    else:
+        add_to_weekly_rollups(session, athlete_id, rollup_activities([activity for activity in new_activities if activity["id"] not in stored_ids]))
+
+    if new_activities:
+        last_start_date, last_activity_id = max((activity["start_date"], activity["id"]) for activity in new_activities)
+    else:
+        last_start_date, last_activity_id = mark if mark is not None else (reconcile_since.strftime("%Y-%m-%dT%H:%M:%SZ"), 0)
+    save_sync_state(session, athlete_id, {
+        "last_start_date": last_start_date,
+        "last_activity_id": last_activity_id,
+        "last_reconciled_at": now.strftime("%Y-%m-%dT%H:%M:%SZ") if reconcile_since is not None else sync_state["last_reconciled_at"],
+    })
+    log_info(f"Synced {len(new_activities)} new activities out of {len(activities)} fetched for athlete {athlete_id}")
+    if new_activities:
+        # The streams wait for the backfill budget, the login goes on with the activities already stored
+        threading.Thread(
+            target=ingest_activity_streams_in_background,
+            args=(athlete_id, new_activities, access_token, connection_parameters),
+            daemon=True,
+        ).start()
+    return len(new_activities)
+
+
+def parse_strava_date(value):
+    """UTC datetime of a Strava date, as stored in the sync state"""
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+def week_start_of(moment):
+    """Monday of the ISO week of a datetime or a Strava start_date, as stored in the rollups"""
+    if isinstance(moment, str):
+        moment = datetime.strptime(moment, "%Y-%m-%dT%H:%M:%SZ")
+    return (moment - timedelta(days=moment.weekday())).strftime("%Y-%m-%d")
+
+
+def rollup_activities(activities):
+    """Weekly rollups of a batch of activities: moving time, intensity workouts, longest workout, activities"""
+    rollups = {}
+    for activity in activities:
+        week_start = week_start_of(activity["start_date"])
+        rollup = rollups.setdefault(
+            week_start,
+            {"week_start": week_start, "moving_time": 0, "intensity_workouts": 0, "longest_moving_time": 0, "activity_count": 0},
+        )
+        moving_time = activity.get("moving_time") or 0
+        rollup["moving_time"] += moving_time
+        rollup["intensity_workouts"] += activity.get("workout_type") == 3
+        rollup["longest_moving_time"] = max(rollup["longest_moving_time"], moving_time)
+        rollup["activity_count"] += 1
+    return list(rollups.values())
+
+
+def add_to_weekly_rollups(session, athlete_id, rollups):
+    """Add the rollups of newly ingested activities to the stored weekly rollups of the athlete"""
+    if not rollups:
+        return
+    values_clause = ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(rollups))
+    params = []
+    for rollup in rollups:
+        params.extend([
+            athlete_id,
+            rollup["week_start"],
+            rollup["moving_time"],
+            rollup["intensity_workouts"],
+            rollup["longest_moving_time"],
+            rollup["activity_count"],
+        ])
+    session.sql(
+        f"""
+        MERGE INTO weekly_rollups r
+        USING (
+            SELECT * FROM VALUES {values_clause}
+            AS vals(athlete_id, week_start, moving_time, intensity_workouts, longest_moving_time, activity_count)
+        ) vals
+        ON r.athlete_id = vals.athlete_id AND r.week_start = vals.week_start
+        WHEN MATCHED THEN
+            UPDATE SET moving_time = r.moving_time + vals.moving_time, intensity_workouts = r.intensity_workouts + vals.intensity_workouts,
+                longest_moving_time = GREATEST(r.longest_moving_time, vals.longest_moving_time), activity_count = r.activity_count + vals.activity_count
+        WHEN NOT MATCHED THEN
+            INSERT (athlete_id, week_start, moving_time, intensity_workouts, longest_moving_time, activity_count)
+            VALUES (vals.athlete_id, vals.week_start, vals.moving_time, vals.intensity_workouts, vals.longest_moving_time, vals.activity_count)
+        """,
+        params,
+    ).collect()
+
+
+def rebuild_weekly_rollups(session, athlete_id, since_week_start):
+    """Recompute the weekly rollups of the athlete from the stored activities, from the week starting on the date"""
+    session.sql("DELETE FROM weekly_rollups WHERE athlete_id = ? AND week_start >= ?", [athlete_id, since_week_start]).collect()
+    session.sql(
+        """
+        INSERT INTO weekly_rollups (athlete_id, week_start, moving_time, intensity_workouts, longest_moving_time, activity_count)
+        SELECT athlete_id, TO_VARCHAR(DATE_TRUNC('WEEK', TO_TIMESTAMP(start_date, 'YYYY-MM-DD"T"HH24:MI:SS"Z"')), 'YYYY-MM-DD'),
+            SUM(COALESCE(moving_time, 0)), COUNT_IF(workout_type = 3), MAX(COALESCE(moving_time, 0)), COUNT(*)
+        FROM activities
+        WHERE athlete_id = ? AND start_date >= ?
+        GROUP BY 1, 2
+        """,
+        [athlete_id, since_week_start],
+    ).collect()
+
+
+def has_weekly_rollups(session, athlete_id):
+    """Whether the athlete has any stored weekly rollup"""
+    return bool(session.sql("SELECT 1 FROM weekly_rollups WHERE athlete_id = ? LIMIT 1", [athlete_id]).collect())
+
+
+def load_weekly_rollups(athlete_id, connection_parameters, days=STRAVA_HISTORY_DAYS):
+    """The stored weekly rollups of the athlete over the last days, oldest week first"""
+    session = create_snowflake_session(connection_parameters)
+    rows = session.sql(
+        "SELECT week_start, moving_time, intensity_workouts, longest_moving_time, activity_count FROM weekly_rollups WHERE athlete_id = ? AND week_start >= ? ORDER BY week_start",
+        [athlete_id, week_start_of(datetime.utcnow() - timedelta(days=days))],
+    ).collect()
+    return [
+        {
+            "week_start": row["WEEK_START"],
+            "moving_time": row["MOVING_TIME"],
+            "intensity_workouts": row["INTENSITY_WORKOUTS"],
+            "longest_moving_time": row["LONGEST_MOVING_TIME"],
+            "activity_count": row["ACTIVITY_COUNT"],
+        }
+        for row in rows
+    ]
+
+
+@st.cache_resource
+def get_activity_cache():
+    """Local SQLite copy of the weekly rollups the recommendations need and of the compressed activity streams, shared by all the sessions"""
+    connection = sqlite3.connect(ACTIVITY_CACHE_PATH, check_same_thread=False)
+    connection.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS weekly_rollups (
+            athlete_id INTEGER NOT NULL,
+            week_start TEXT NOT NULL,
+            moving_time INTEGER NOT NULL,
+            intensity_workouts INTEGER NOT NULL,
+            longest_moving_time INTEGER NOT NULL,
+            activity_count INTEGER NOT NULL,
+            PRIMARY KEY (athlete_id, week_start)
+        );
+        CREATE TABLE IF NOT EXISTS athletes (
+            athlete_id INTEGER PRIMARY KEY,
+            synced_at REAL NOT NULL,
+            last_used_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS activity_streams (
+            activity_id INTEGER PRIMARY KEY,
+            athlete_id INTEGER NOT NULL,
+            start_date TEXT NOT NULL,
+            streams BLOB NOT NULL
+        );
+        """
+    )
+    return {"lock": threading.Lock(), "connection": connection}
+
+
+def load_cached_weekly_rollups(athlete_id, days=STRAVA_HISTORY_DAYS):
+    """The locally cached weekly rollups of the athlete over the last days, None if missing or older than the freshness window"""
+    cache = get_activity_cache()
+    now = time.time()
+    with cache["lock"]:
+        connection = cache["connection"]
+        row = connection.execute("SELECT synced_at FROM athletes WHERE athlete_id = ?", (athlete_id,)).fetchone()
+        if row is None or now - row[0] > ACTIVITY_CACHE_FRESHNESS_MINUTES * 60:
+            return None
+        rows = connection.execute(
+            "SELECT week_start, moving_time, intensity_workouts, longest_moving_time, activity_count FROM weekly_rollups WHERE athlete_id = ? AND week_start >= ? ORDER BY week_start",
+            (athlete_id, week_start_of(datetime.utcnow() - timedelta(days=days))),
+        ).fetchall()
+        connection.execute("UPDATE athletes SET last_used_at = ? WHERE athlete_id = ?", (now, athlete_id))
+        connection.commit()
+    return [
+        {
+            "week_start": week_start,
+            "moving_time": moving_time,
+            "intensity_workouts": intensity_workouts,
+            "longest_moving_time": longest_moving_time,
+            "activity_count": activity_count,
+        }
+        for week_start, moving_time, intensity_workouts, longest_moving_time, activity_count in rows
+    ]
+
+
+def cache_weekly_rollups(athlete_id, rollups):
+    """Replace the locally cached weekly rollups of the athlete with the synced ones"""
+    cache = get_activity_cache()
+    now = time.time()
+    with cache["lock"]:
+        connection = cache["connection"]
+        with connection:
+            connection.execute("DELETE FROM weekly_rollups WHERE athlete_id = ?", (athlete_id,))
+            connection.executemany(
+                "INSERT INTO weekly_rollups (athlete_id, week_start, moving_time, intensity_workouts, longest_moving_time, activity_count) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (athlete_id, rollup["week_start"], rollup["moving_time"], rollup["intensity_workouts"], rollup["longest_moving_time"], rollup["activity_count"])
+                    for rollup in rollups
+                ],
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO athletes (athlete_id, synced_at, last_used_at) VALUES (?, ?, ?)", (athlete_id, now, now)
+            )
+            evict_activity_cache(connection, now)
+
+
+def evict_activity_cache(connection, now):
+    """Drop the weeks and streams past their window, the idle athletes, then the least recently used ones over the size limit"""
+    connection.execute(
+        "DELETE FROM weekly_rollups WHERE week_start < ?",
+        (week_start_of(datetime.utcnow() - timedelta(days=STRAVA_HISTORY_DAYS)),),
+    )
+    connection.execute("DELETE FROM athletes WHERE last_used_at < ?", (now - ACTIVITY_CACHE_MAX_IDLE_DAYS * 86400,))
+    connection.execute(
+        "DELETE FROM athletes WHERE athlete_id NOT IN (SELECT athlete_id FROM athletes ORDER BY last_used_at DESC LIMIT ?)",
+        (ACTIVITY_CACHE_MAX_ATHLETES,),
+    )
+    connection.execute("DELETE FROM weekly_rollups WHERE athlete_id NOT IN (SELECT athlete_id FROM athletes)")
+    connection.execute(
+        "DELETE FROM activity_streams WHERE start_date < ? OR athlete_id NOT IN (SELECT athlete_id FROM athletes)",
+        ((datetime.utcnow() - timedelta(days=STRAVA_STREAM_DAYS)).strftime("%Y-%m-%dT%H:%M:%SZ"),),
+    )
+
+
+def recommend_level(training_hours):
+    """
+    Recommend a training level based on total hours in the past year.
+    """
+    if training_hours > 300:
+        return "Confirmed"
+    elif training_hours > 200:
+        return "Intermediate"
+    else:
+        return "Beginner"
+
+
+def recommend_from_weekly_rollups(rollups, now=None):
+    """
+    All the recommendations from the weekly rollups of the past year, the recent weeks are the last 4 complete ones:
+    - training hours and level over the whole year
+    - current weekly hours, the average of the recent weeks
+    - intensity workouts, the number of recent workouts tagged as such by Strava
+    - longest recent workout, as hours and minutes
+    - next resting week, cycleLength weeks after the recent week with the lowest moving time, compared to the current week
+    """
+    now = now or datetime.utcnow()
+    current_week_start = week_start_of(now)
+    recent_start = week_start_of(now - timedelta(weeks=4))
+    recent = [rollup for rollup in rollups if recent_start <= rollup["week_start"] < current_week_start]
+
+    training_hours = sum(rollup["moving_time"] for rollup in rollups) / 3600
+    longest_workout_minutes = max((rollup["longest_moving_time"] for rollup in recent), default=0) / 60
+    if recent:
+        # The first of the weeks with the lowest moving time
+        resting_week = min(sorted(recent, key=lambda rollup: rollup["week_start"]), key=lambda rollup: rollup["moving_time"])
+        weeks_since_resting = (
+            datetime.strptime(current_week_start, "%Y-%m-%d") - datetime.strptime(resting_week["week_start"], "%Y-%m-%d")
+        ).days // 7
+        next_resting_week = 4 - weeks_since_resting
+    else:
+        next_resting_week = 0
+    return {
+        "training_hours": training_hours,
+        "level": recommend_level(training_hours),
+        "weekly_hours": int(sum(rollup["moving_time"] for rollup in recent) / 3600 / 4),
+        "intensity_workouts": sum(rollup["intensity_workouts"] for rollup in recent),
+        "longest_workout": (int(longest_workout_minutes // 60), int(longest_workout_minutes % 60)),
+        "next_resting_week": next_resting_week,
+    }
+
+
+def fetch_and_recommend(connection_parameters):
+    """
+    Sync the activities of the athlete with Strava and calculate a level recommendation from the past year.
+    Only the weekly rollups are read, from the local cache while it is fresh.
+    """
+    try:
+        athlete_id = st.session_state["athlete_id"]
+        rollups = load_cached_weekly_rollups(athlete_id)
+        if rollups is not None:
+            log_info(f"Using {len(rollups)} locally cached weekly rollups for level recommendation.")
+        else:
+            log_info("Syncing activities for level recommendation...")
+            new_activities = sync_activities(athlete_id, session_id, st.session_state["access_token"], connection_parameters)
+            if new_activities:
+                st.success(f"Downloaded and stored {new_activities} new activities.")
+            rollups = load_weekly_rollups(athlete_id, connection_parameters)
+            log_info(f"Loaded {len(rollups)} stored weekly rollups.")
+            if new_activities is not None:
+                # A failed sync is retried at the next login instead of being cached as fresh
+                cache_weekly_rollups(athlete_id, rollups)
+        recommendations = recommend_from_weekly_rollups(rollups)
+        training_hours = recommendations["training_hours"]
+        st.session_state["training_hours"] = training_hours
+        st.session_state["level_recommendation"] = recommendations["level"]
+        st.session_state["current_weekly_hours_recommendation"] = recommendations["weekly_hours"]
+        st.session_state["current_intensity_workouts_recommendation"] = recommendations["intensity_workouts"]
+        st.session_state["current_longest_workout_hours_recommendation"], st.session_state["current_longest_workout_minutes_recommendation"] = recommendations["longest_workout"]
+        st.session_state["current_next_resting_week_recommendation"] = recommendations["next_resting_week"]
+        
+        st.session_state["fetching_complete"] = True  # Mark as complete
+        log_info(f"Level recommendation calculated successfully, training hours: {training_hours}, recommendation: {st.session_state['level_recommendation']}, current weekly hours: {st.session_state['current_weekly_hours_recommendation']}, current intensity workouts: {st.session_state['current_intensity_workouts_recommendation']}, current longest workout: {st.session_state['current_longest_workout_hours_recommendation']}:{st.session_state['current_longest_workout_minutes_recommendation']}, current next resting week: {st.session_state['current_next_resting_week_recommendation']}")
+        st.rerun()
+    except Exception as e:
+        st.session_state["fetching_complete"] = True  # Avoid indefinite waiting
+        log_error(f"Error during level recommendation: {e}")
+
+
+
+@st.cache_resource
+def get_token_cache():
+    """Strava tokens of the athletes by id, shared by the sessions and the background jobs, with a refresh lock per athlete"""
+    return {"lock": threading.Lock(), "tokens": {}, "refresh_locks": defaultdict(threading.Lock)}
+
+
+def store_athlete_tokens(athlete_id, token_data, connection_parameters):
+    """Keep the tokens Strava returned, in the process cache and in the token store"""
+    tokens = {
+        "access_token": token_data["access_token"],
+        "refresh_token": token_data["refresh_token"],
+        "expires_at": int(token_data["expires_at"]),
+    }
+    cache = get_token_cache()
+    with cache["lock"]:
+        cache["tokens"][athlete_id] = tokens
+    session = create_snowflake_session(connection_parameters)
+    session.sql(
+        """
+        MERGE INTO strava_tokens AS target
+        USING (SELECT ? AS athlete_id, ? AS access_token, ? AS refresh_token, ? AS expires_at) AS source
+        ON target.athlete_id = source.athlete_id
+        WHEN MATCHED THEN UPDATE SET
+            access_token = source.access_token,
+            refresh_token = source.refresh_token,
+            expires_at = source.expires_at,
+            updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN INSERT (athlete_id, access_token, refresh_token, expires_at, updated_at)
+        VALUES (source.athlete_id, source.access_token, source.refresh_token, source.expires_at, CURRENT_TIMESTAMP())
+        """,
+        [athlete_id, tokens["access_token"], tokens["refresh_token"], tokens["expires_at"]],
+    ).collect()
+    return tokens
+
+
+def hash_login_secret(login_secret):
+    return hashlib.sha256(login_secret.encode()).hexdigest()
+
+
+def new_athlete_login(athlete_id, connection_parameters):
+    """
+    Random secret of a login, for the cookie of the athlete. Only its hash is kept next to the tokens,
+    a new login replaces it.
+    """
+    login_secret = secrets.token_urlsafe(32)
+    create_snowflake_session(connection_parameters).sql(
+        "UPDATE strava_tokens SET login_secret = ? WHERE athlete_id = ?", [hash_login_secret(login_secret), athlete_id]
+    ).collect()
+    return login_secret
+
 
-# @st.cache_data
-def fetch_activities(after_ts):
-    activities = []
-    page = 1
-    while True:
-        log_info(f"Fetching activities from page {page}...")
-        url = f"https://www.strava.com/api/v3/athlete/activities?after={after_ts}&page={page}&per_page=100"
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            st.error("Failed to fetch activities.")
-            break
-        batch = response.json()
-        log_info(f"Fetched {len(batch)} activities from page {page}")
-        if not batch:
-            break
-        activities.extend(batch)
-        page += 1
-    return activities
+def check_athlete_login(athlete_id, login_secret, connection_parameters):
+    """Whether the secret of the cookie is the one of the last login of the athlete"""
+    rows = create_snowflake_session(connection_parameters).sql(
+        "SELECT login_secret FROM strava_tokens WHERE athlete_id = ?", [athlete_id]
+    ).collect()
+    return bool(rows and rows[0]["LOGIN_SECRET"]) and hmac.compare_digest(rows[0]["LOGIN_SECRET"], hash_login_secret(login_secret))
+
+
+def forget_athlete_tokens(athlete_id, connection_parameters):
+    """Drop the tokens of an athlete who revoked the access"""
+    cache = get_token_cache()
+    with cache["lock"]:
+        cache["tokens"].pop(athlete_id, None)
+    create_snowflake_session(connection_parameters).sql("DELETE FROM strava_tokens WHERE athlete_id = ?", [athlete_id]).collect()
+    log_info(f"Forgot the Strava tokens of athlete {athlete_id}")
 
-def calculate_training_hours(activities):
+
+def confirm_athlete_deauthorization(athlete_id):
+    """Forget the tokens of an athlete reported as deauthorized once Strava rejects their refresh"""
+    if get_athlete_access_token(athlete_id, connection_parameters, force_refresh=True) is not None:
+        log_warning(f"Strava still refreshes the tokens of athlete {athlete_id}, the deauthorization event is ignored")
+
+
+def get_athlete_access_token(athlete_id, connection_parameters, force_refresh=False):
     """
-    Calculate total training hours from the activities fetched.
+    A valid access token of the athlete, without a browser: from the process cache, else from the token store,
+    refreshed when it expires within STRAVA_TOKEN_REFRESH_MARGIN or when forced. None if the athlete never logged
+    in or revoked the access.
     """
-    total_seconds = sum(activity.get("moving_time", 0) for activity in activities)
-    return total_seconds / 3600  # Convert seconds to hours
+    cache = get_token_cache()
+    with cache["lock"]:
+        refresh_lock = cache["refresh_locks"][athlete_id]
+    # One athlete is loaded and refreshed by a single thread at a time, Strava invalidates the refresh token it replaces
+    with refresh_lock:
+        with cache["lock"]:
+            tokens = cache["tokens"].get(athlete_id)
+        if tokens is None:
+            rows = create_snowflake_session(connection_parameters).sql(
+                "SELECT access_token, refresh_token, expires_at FROM strava_tokens WHERE athlete_id = ?", [athlete_id]
+            ).collect()
+            if not rows:
+                return None
+            tokens = {"access_token": rows[0]["ACCESS_TOKEN"], "refresh_token": rows[0]["REFRESH_TOKEN"], "expires_at": int(rows[0]["EXPIRES_AT"])}
+            with cache["lock"]:
+                cache["tokens"][athlete_id] = tokens
+        if not force_refresh and tokens["expires_at"] - time.time() > STRAVA_TOKEN_REFRESH_MARGIN:
+            return tokens["access_token"]
+        response = requests.post(
+            STRAVA_TOKEN_URL,
+            data={
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "grant_type": "refresh_token",
+                "refresh_token": tokens["refresh_token"],
+            },
+        )
+        if response.status_code != 200:
+            log_error(f"Error refreshing the token of athlete {athlete_id}: {response.status_code}, {response.text}")
+            if response.status_code in (400, 401):
+                forget_athlete_tokens(athlete_id, connection_parameters)
+            return None
+        log_info(f"Refreshed the Strava token of athlete {athlete_id}")
+        return store_athlete_tokens(athlete_id, response.json(), connection_parameters)["access_token"]
 
-def recommend_level(training_hours):
+
+@st.cache_resource
+def get_webhook_queue():
+    """Pending webhook events by activity, in arrival order, shared by the receiver and the ingestion worker"""
+    return {"condition": threading.Condition(), "events": OrderedDict()}
+
+
+def enqueue_webhook_event(event):
     """
-    Recommend a training level based on total hours in the past year.
+    Queue an activity event, merged with the one already pending for the same activity:
+    a delete wins, a create stays a create when the activity is updated before being ingested.
     """
-    if training_hours > 300:
-        return "Confirmed"
-    elif training_hours > 200:
-        return "Intermediate"
-    else:
-        return "Beginner"
-
-def recommend_weekly_hours(activities):
+    queue = get_webhook_queue()
+    with queue["condition"]:
+        pending = queue["events"].get(event["object_id"])
+        if pending is not None and pending["aspect_type"] == "create" and event["aspect_type"] == "update":
+            event = dict(event, aspect_type="create")
+        if pending is not None and pending["aspect_type"] == "delete" and event["aspect_type"] != "create":
+            return
+        queue["events"][event["object_id"]] = event
+        queue["condition"].notify()
+
+
+def ingest_webhook_event(event):
     """
-    Recommend the current weekly training hours based on the past 4 weeks
+    Apply one activity event to the stored activities and rollups, True if the athlete's data changed.
+    The events are not signed, so the activity is read again from Strava with the athlete's token:
+    it is only deleted once Strava answers 404, and only stored when it belongs to the athlete.
     """
-    last_4_weeks_activities = []
-    for activity in activities:
-        activity_date = datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ")
-        if activity_date >= datetime.utcnow() - timedelta(weeks=4):
-            last_4_weeks_activities.append(activity)
-    total_seconds = sum(activity.get("moving_time", 0) for activity in last_4_weeks_activities)
-    total_hours = total_seconds / 3600
-    return int(total_hours / 4)
+    athlete_id = event["owner_id"]
+    activity_id = event["object_id"]
+    access_token = get_athlete_access_token(athlete_id, connection_parameters)
+    if access_token is None:
+        log_warning(f"No access token for athlete {athlete_id}, activity {activity_id} is left to the next sync")
+        return False
+    response = strava_request("GET", f"/activities/{activity_id}", access_token, priority=STRAVA_PRIORITY_BACKFILL)
+    if response.status_code not in (200, 404):
+        log_error(f"Error fetching activity {activity_id}: {response.status_code}, {response.text}")
+        return False
+    session = create_snowflake_session(connection_parameters)
+    rows = session.sql("SELECT start_date FROM activities WHERE id = ? AND athlete_id = ?", [activity_id, athlete_id]).collect()
+    stored_start_date = rows[0]["START_DATE"] if rows else None
+    if response.status_code == 404:
+        if stored_start_date is None:
+            return False
+        session.sql("DELETE FROM activities WHERE id = ? AND athlete_id = ?", [activity_id, athlete_id]).collect()
+        rebuild_weekly_rollups(session, athlete_id, week_start_of(stored_start_date))
+        return True
+
+    activity = response.json()
+    if (activity.get("athlete") or {}).get("id") != athlete_id:
+        log_warning(f"Activity {activity_id} does not belong to athlete {athlete_id}, the event is ignored")
+        return False
+    merge_activities(session, [activity], athlete_id, WEBHOOK_SESSION_ID, update_existing=True)
+    # An edit can move the activity to another week
+    rebuild_weekly_rollups(session, athlete_id, week_start_of(min(filter(None, [stored_start_date, activity["start_date"]]))))
+    ingest_activity_streams(session, athlete_id, [activity], access_token)
+    # The high-water mark is only moved by sync_activities, an earlier activity whose event failed
+    # is still fetched by the next sync
+    return True
+
+
+def load_persisted_athlete(athlete_id, connection_parameters):
+    """The persisted plan of the athlete with the inputs and session it was computed for, None without a plan"""
+    session = create_snowflake_session(connection_parameters)
+    rows = session.sql("SELECT session_id, plan, inputs FROM plans WHERE strava_id = ?", [athlete_id]).collect()
+    if not rows or not rows[0]["INPUTS"]:
+        return None
+    return {
+        "session_id": rows[0]["SESSION_ID"],
+        "plan": freeze_plan(deserialize_plan(rows[0]["PLAN"])),
+        "inputs": json.loads(rows[0]["INPUTS"], object_hook=decode_plan_value),
+    }
 
 
-def recommend_intensity_workouts(activities):
+def replan_athlete(athlete_id):
     """
-    Recommend the number of intensity workouts based on the past 4 weeks
+    Replan the persisted plan of the athlete from the current week with the completed workouts and persist it.
+    The races already run are dropped and the past weeks are kept and left in the tables as they are, the
+    current week is compared with what was done and the future weeks come from the day by day cache when
+    they did not change.
     """
-    last_4_weeks_activities = []
-    for activity in activities:
-        activity_date = datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ")
-        if activity_date >= datetime.utcnow() - timedelta(weeks=4):
-            last_4_weeks_activities.append(activity)
-    intensity_workouts = 0
-    for activity in last_4_weeks_activities:
-        if activity.get("workout_type") == 3:
-            intensity_workouts += 1
-    return intensity_workouts
-
-def recommend_longest_workout(activities):
-    """
-    Recommend the longest workout duration based on the last 4 weeks
-    """
-    longest_workout_minutes = 0
-    for activity in activities:
-        activity_date = datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ")
-        if activity_date >= datetime.utcnow() - timedelta(days=28):
-            duration = activity.get("moving_time", 0) / 60  # Convert seconds to minutes
-            log_info(f"Duration: {duration} of activity: {activity['name']} from date {activity['start_date']}")
-            if duration > longest_workout_minutes:
-                log_info(f"New longest workout: {duration} minutes for activity: {activity['name']}")
-                longest_workout_minutes = duration
-    return int(longest_workout_minutes // 60), int(longest_workout_minutes % 60)
-
-def recommend_next_resting_week(activities):
+    persisted = load_persisted_athlete(athlete_id, connection_parameters)
+    if persisted is None:
+        return
+    today = date.today()
+    races = [race for race in persisted["inputs"]["races"] if final_date(race["date"]) >= today]
+    if not races:
+        return
+    completed_workouts = load_completed_workouts(athlete_id, connection_parameters)
+    plan = compute_training_plan(dict(persisted["inputs"], races=races), persisted["plan"], completed_workouts)
+    current_week_start = today - timedelta(days=today.weekday())
+    send_to_db(
+        plan, persisted["inputs"], athlete_id, persisted["session_id"], connection_parameters, Queue(),
+        since=current_week_start,
+    )
+    log_info(f"Replanned athlete {athlete_id} after Strava events")
+
+
+def process_webhook_events():
     """
-    Recommend the next resting week based on the last 4 weeks, the last resting week was the one with the lowest moving time
-    the next should be cycleLength weeks after the last resting week
+    Ingestion worker: drain the pending events, then replan each athlete whose activities changed once.
     """
-    activities_by_week = defaultdict(int)
-    for activity in activities:
-        if datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ") >= datetime.utcnow() - timedelta(weeks=4):
-            activity_week = datetime.strptime(activity["start_date"], "%Y-%m-%dT%H:%M:%SZ").isocalendar()[1]
-            activities_by_week[activity_week] += activity.get("moving_time", 0)
-    if not activities_by_week:
-        return 0
-    min_moving_time = min(activities_by_week.values())
-    resting_week = [week for week, moving_time in activities_by_week.items() if moving_time == min_moving_time][0]
-    next_resting_week = resting_week + 4
-    #compared to current week
-    current_week = datetime.utcnow().isocalendar()[1]
-    return next_resting_week - current_week
+    queue = get_webhook_queue()
+    while True:
+        with queue["condition"]:
+            while not queue["events"]:
+                queue["condition"].wait()
+            events = list(queue["events"].values())
+            queue["events"].clear()
+        changed_athletes = []
+        for event in events:
+            try:
+                if ingest_webhook_event(event) and event["owner_id"] not in changed_athletes:
+                    changed_athletes.append(event["owner_id"])
+            except Exception as e:
+                log_error(f"Error ingesting webhook event {event}: {e}")
+        for athlete_id in changed_athletes:
+            try:
+                # The recommendations of the next visit are read from the fresh rollups
+                cache_weekly_rollups(athlete_id, load_weekly_rollups(athlete_id, connection_parameters))
+                replan_athlete(athlete_id)
+            except Exception as e:
+                log_error(f"Error replanning athlete {athlete_id}: {e}")
+
+
+class JsonRequestHandler(BaseHTTPRequestHandler):
+    """JSON answers and debug logging of the HTTP endpoints served next to the app"""
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        log_debug(f"{self.__class__.__name__}: {format % args}")
+
+
+class StravaWebhookHandler(JsonRequestHandler):
+    """Strava push subscription on the secret path: the validation challenge on GET, the events on POST"""
+
+    def do_GET(self):
+        if urlparse(self.path).path != STRAVA_WEBHOOK_PATH:
+            self.send_json(404, {})
+            return
+        query = parse_qs(urlparse(self.path).query)
+        if (
+            STRAVA_WEBHOOK_VERIFY_TOKEN
+            and query.get("hub.mode") == ["subscribe"]
+            and query.get("hub.verify_token") == [STRAVA_WEBHOOK_VERIFY_TOKEN]
+        ):
+            self.send_json(200, {"hub.challenge": query.get("hub.challenge", [""])[0]})
+        else:
+            self.send_json(403, {})
+
+    def do_POST(self):
+        if urlparse(self.path).path != STRAVA_WEBHOOK_PATH:
+            self.send_json(404, {})
+            return
+        try:
+            event = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self.send_json(400, {})
+            return
+        if not isinstance(event, dict) or not isinstance(event.get("owner_id"), int):
+            self.send_json(400, {})
+            return
+        # Strava expects an answer within 2 seconds, the event is only queued here and checked against the API later
+        if (
+            event.get("object_type") == "activity"
+            and isinstance(event.get("object_id"), int)
+            and event.get("aspect_type") in ("create", "update", "delete")
+        ):
+            enqueue_webhook_event(event)
+        elif event.get("object_type") == "athlete" and (event.get("updates") or {}).get("authorized") == "false":
+            threading.Thread(target=confirm_athlete_deauthorization, args=(event["owner_id"],), daemon=True).start()
+        self.send_json(200, {})
 
 
-# Initialize state variables
-if "fetching_complete" not in st.session_state:
-    st.session_state["fetching_complete"] = False
+class StravaMetricsHandler(JsonRequestHandler):
+    """The Strava usage metrics on /metrics, for the monitoring of the host"""
 
-if "training_hours" not in st.session_state:
-    st.session_state["training_hours"] = None
+    def do_GET(self):
+        if urlparse(self.path).path == "/metrics":
+            self.send_json(200, strava_usage_metrics())
+        else:
+            self.send_json(404, {})
 
-if "level_recommendation" not in st.session_state:
-    st.session_state["level_recommendation"] = None
 
-def fetch_and_recommend(connection_parameters):
-    """
-    Fetch activities from Strava for the past year and calculate a level recommendation.
-    """
-    try:
-        log_info("Fetching activities for level recommendation...")
-        last_year = int((datetime.utcnow() - timedelta(days=365)).timestamp())
-        activities = fetch_activities(last_year)
-        log_info(f"Fetched {len(activities)} activities.")
-        if activities:
-            # Build a single MERGE statement with multiple values
-            values_clause = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(activities))
-            
-            params = []
-            for activity in activities:
-                params.extend([
-                    activity["id"],
-                    st.session_state["athlete_id"],
-                    session_id,
-                    activity["name"],
-                    activity["start_date"],
-                    activity["distance"],
-                    activity["moving_time"],
-                    activity["elapsed_time"],
-                    activity["total_elevation_gain"],
-                    activity["type"]
-                ])
-
-            query = f"""
-            MERGE INTO activities a
-            USING (
-                SELECT * FROM VALUES {values_clause}
-                AS vals(id, athlete_id, session_id, name, start_date, distance, moving_time, elapsed_time, total_elevation_gain, type)
-            ) vals
-            ON a.id = vals.id
-            WHEN NOT MATCHED THEN
-                INSERT (id, athlete_id, session_id, name, start_date, distance, moving_time, elapsed_time, total_elevation_gain, type)
-                VALUES (vals.id, vals.athlete_id, vals.session_id, vals.name, vals.start_date, vals.distance, vals.moving_time, vals.elapsed_time, vals.total_elevation_gain, vals.type)
-            """
-            session = create_snowflake_session(connection_parameters)
-            session.sql(query, params).collect()
-            log_debug(f"Inserted {len(activities)} activities into Snowflake.")
-
-            st.success(f"Downloaded and stored {len(activities)} activities from the last two months.")
-        training_hours = calculate_training_hours(activities)
-        st.session_state["training_hours"] = training_hours
-        st.session_state["level_recommendation"] = recommend_level(training_hours)
-        st.session_state["current_weekly_hours_recommendation"] = recommend_weekly_hours(activities)
-        st.session_state["current_intensity_workouts_recommendation"] = recommend_intensity_workouts(activities)
-        st.session_state["current_longest_workout_hours_recommendation"], st.session_state["current_longest_workout_minutes_recommendation"] = recommend_longest_workout(activities)
-        st.session_state["current_next_resting_week_recommendation"] = recommend_next_resting_week(activities)
-        
-        st.session_state["fetching_complete"] = True  # Mark as complete
-        log_info(f"Level recommendation calculated successfully, training hours: {training_hours}, recommendation: {st.session_state['level_recommendation']}, current weekly hours: {st.session_state['current_weekly_hours_recommendation']}, current intensity workouts: {st.session_state['current_intensity_workouts_recommendation']}, current longest workout: {st.session_state['current_longest_workout_hours_recommendation']}:{st.session_state['current_longest_workout_minutes_recommendation']}, current next resting week: {st.session_state['current_next_resting_week_recommendation']}")
-        st.rerun()
-    except Exception as e:
-        st.session_state["fetching_complete"] = True  # Avoid indefinite waiting
-        log_error(f"Error during level recommendation: {e}")
+@st.cache_resource
+def start_strava_webhook_server(port=STRAVA_WEBHOOK_PORT):
+    """Receive the Strava events and ingest them in the background, once per process"""
+    server = ThreadingHTTPServer(("", port), StravaWebhookHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=process_webhook_events, daemon=True).start()
+    log_info(f"Strava webhook listening on port {server.server_address[1]}")
+    return server
+
+
+@st.cache_resource
+def start_strava_metrics_server(port=STRAVA_METRICS_PORT):
+    """Serve the Strava usage metrics on the loopback interface, once per process"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StravaMetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log_info(f"Strava metrics listening on 127.0.0.1:{server.server_address[1]}")
+    return server
 
 
+if STRAVA_WEBHOOK_PORT:
+    if STRAVA_WEBHOOK_PATH:
+        start_strava_webhook_server()
+    else:
+        log_error("STRAVA_WEBHOOK_PATH is not set, the Strava webhook is not started")
+
+if STRAVA_METRICS_PORT:
+    start_strava_metrics_server()
+
 
 def add_columns_if_not_exists(table_name, columns, session):
     """
@@ -3509,10 +2092,8 @@ def add_columns_if_not_exists(table_name, columns, session):
 # 4. Fetch the Last Activity
 # @st.cache_data
 def get_last_activity(access_token):
-    url = f"{STRAVA_API_URL}/athlete/activities"
-    headers = {"Authorization": f"Bearer {access_token}"}
     params = {"per_page": 100, "page": 1}
-    response = requests.get(url, headers=headers, params=params)
+    response = strava_request("GET", "/athlete/activities", access_token, params=params)
     if response.status_code == 200:
         activities = response.json()
         if activities:
@@ -3539,10 +2120,8 @@ def upload_image_to_imgur(image_path):
     
 # 3. Update Strava Activity Description
 def update_activity_description(activity_id, description, access_token):
-    url = f"{STRAVA_API_URL}/activities/{activity_id}"
-    headers = {"Authorization": f"Bearer {access_token}"}
     data = {"description": description}
-    response = requests.put(url, headers=headers, json=data)
+    response = strava_request("PUT", f"/activities/{activity_id}", access_token, json=data)
     if response.status_code == 200:
         log_debug(f"Description updated successfully, with response: {response.json()}")
     else:
@@ -3632,6 +2211,9 @@ session = create_snowflake_session(connection_parameters)
 #     elapsed_time INTEGER,
 #     total_elevation_gain FLOAT,
 #     type VARCHAR,
+#     workout_type INTEGER,
+#     seconds_in_zone VARCHAR, -- JSON, from the binned streams
+#     tss FLOAT,
 #     PRIMARY KEY (id)
 # )
 # """).collect()
@@ -3649,10 +2231,50 @@ session = create_snowflake_session(connection_parameters)
 #         "elapsed_time": "INTEGER",
 #         "total_elevation_gain": "FLOAT",
 #         "type": "VARCHAR",
+#         "workout_type": "INTEGER",
+#         "seconds_in_zone": "VARCHAR",
+#         "tss": "FLOAT",
 #     },
 #     session
 # )
 
+# # Strava tokens per athlete, refreshed before they expire
+# session.sql("""
+# CREATE TABLE IF NOT EXISTS strava_tokens (
+#     athlete_id INTEGER,
+#     access_token VARCHAR,
+#     refresh_token VARCHAR,
+#     expires_at INTEGER, -- epoch seconds
+#     login_secret VARCHAR, -- SHA-256 of the secret in the cookie of the last login
+#     updated_at TIMESTAMP,
+#     PRIMARY KEY (athlete_id)
+# )
+# """).collect()
+
+# # Activities aggregated per athlete and ISO week (Monday), kept up to date by the Strava sync
+# session.sql("""
+# CREATE TABLE IF NOT EXISTS weekly_rollups (
+#     athlete_id INTEGER,
+#     week_start VARCHAR,
+#     moving_time INTEGER,
+#     intensity_workouts INTEGER,
+#     longest_moving_time INTEGER,
+#     activity_count INTEGER,
+#     PRIMARY KEY (athlete_id, week_start)
+# )
+# """).collect()
+
+# # Latest activity stored per athlete, the incremental Strava sync starts after it
+# session.sql("""
+# CREATE TABLE IF NOT EXISTS strava_sync_state (
+#     athlete_id INTEGER,
+#     last_start_date VARCHAR,
+#     last_activity_id INTEGER,
+#     last_reconciled_at VARCHAR,
+#     PRIMARY KEY (athlete_id)
+# )
+# """).collect()
+
 # # Create or alter `microcycles` table
 # session.sql("""
 # CREATE TABLE IF NOT EXISTS microcycles (
@@ -3677,6 +2299,18 @@ session = create_snowflake_session(connection_parameters)
 #     session
 # )
 
+# # Persisted plans, one per athlete
+# session.sql("""
+# CREATE TABLE IF NOT EXISTS plans (
+#     strava_id INTEGER,
+#     session_id VARCHAR,
+#     plan VARCHAR, -- JSON serialized microcycles
+#     inputs VARCHAR, -- JSON serialized inputs the plan was computed for, to replan without a visit
+#     updated_at TIMESTAMP,
+#     PRIMARY KEY (strava_id)
+# )
+# """).collect()
+
 # # Create or alter `microcycle_days` table
 # session.sql("""
 # CREATE TABLE IF NOT EXISTS microcycle_days (
@@ -3704,31 +2338,69 @@ session = create_snowflake_session(connection_parameters)
 #     session
 # )
 
+def start_athlete_session(athlete_id, access_token):
+    st.session_state["access_token"] = access_token
+    st.session_state["athlete_id"] = athlete_id
+    # Replan from the stored plan of the athlete instead of rebuilding the history
+    st.session_state["persisted_plan"] = load_persisted_plan(athlete_id, connection_parameters)
+    st.session_state["completed_workouts"] = load_completed_workouts(athlete_id, connection_parameters)
+    if st.session_state["persisted_plan"]:
+        refresh_training_plan()
+
+
 # If we have a code from Strava, attempt to exchange it for a token
 if "code" in params and st.session_state["access_token"] is None:
     code = params["code"]  # Direct access to the correct key-value pair
 
     # Exchange authorization code for access token
-    token_url = "https://www.strava.com/oauth/token"
     data = {
         "client_id": client_id,
         "client_secret": client_secret,
         "code": code,
         "grant_type": "authorization_code",
     }
-    response = requests.post(token_url, data=data)
-    log_info(f"Exchanging code for token: {response.json()}")
+    response = requests.post(STRAVA_TOKEN_URL, data=data)
+    log_info(f"Exchanging code for token: {response.status_code}")
 
     if response.status_code == 200:
         token_data = response.json()
-        st.session_state["access_token"] = token_data["access_token"]
-        # Assume you have athlete_id from the token_data after login
         athlete_id = token_data["athlete"]["id"]
-        st.session_state["athlete_id"] = athlete_id
+        # Keep the refresh token so that the next visits and the background jobs do not need the browser
+        store_athlete_tokens(athlete_id, token_data, connection_parameters)
+        if cookies.ready():
+            try:
+                cookies["login_secret"] = new_athlete_login(athlete_id, connection_parameters)
+                cookies["athlete_id"] = str(athlete_id)
+                cookies.save()
+            except Exception as e:
+                # The athlete logs in with Strava on the next visit
+                log_error(f"Error saving the login of athlete {athlete_id}: {e}")
+        start_athlete_session(athlete_id, token_data["access_token"])
     else:
         st.error("Failed to exchange code for token. Check your credentials and redirect URI.")
         st.stop()
 
+# Returning athletes are recognized from the secret of their last login and skip the OAuth round trips,
+# the OAuth flow stays available whenever the secret cannot be checked
+elif (
+    st.session_state["access_token"] is None
+    and cookies.ready()
+    and (cookies.get("athlete_id") or "").isdigit()
+    and cookies.get("login_secret")
+):
+    athlete_id = int(cookies["athlete_id"])
+    access_token = None
+    try:
+        if check_athlete_login(athlete_id, cookies["login_secret"], connection_parameters):
+            access_token = get_athlete_access_token(athlete_id, connection_parameters)
+        else:
+            log_warning(f"Login secret of athlete {athlete_id} rejected, the athlete logs in with Strava")
+    except Exception as e:
+        log_error(f"Error checking the login of athlete {athlete_id}: {e}")
+    if access_token is not None:
+        log_info(f"Athlete {athlete_id} logged in from the token store")
+        start_athlete_session(athlete_id, access_token)
+
 
 if st.session_state["access_token"] is not None:
     log_info("No code found in query parameters.")
@@ -3740,7 +2412,6 @@ if st.session_state["access_token"] is not None:
 
         # Fetch activities from Strava
         access_token = st.session_state["access_token"]
-        headers = {"Authorization": f"Bearer {access_token}"}
         now = datetime.utcnow()
         two_months_ago = now - timedelta(days=60)
         after_timestamp = int(two_months_ago.timestamp())
@@ -4067,7 +2738,9 @@ if "plan" in st.session_state and st.session_state["plan"] is not None:
     data_cycles = st.session_state["plan"]
 else:
     data_cycles = compute_training_plan(st.session_state["inputs"])
-df_cycles = pd.DataFrame(data_cycles)
+    st.session_state["plan_index"] = buildCycleIndex(data_cycles)
+st.session_state["total_number_of_hours"] = int(sum(week["theoreticalWeeklyTSS"] for week in data_cycles) / 60)
+df_cycles = pd.DataFrame(list(data_cycles))
 if "timeInZoneRepartition" in df_cycles.columns:
     df_cycles["timeInZoneRepartition"] = df_cycles["timeInZoneRepartition"].apply(
         lambda d: {str(k): v for k, v in d.items()} if isinstance(d, dict) else d
@@ -4093,80 +2766,6 @@ st.header("Training Load and Week Organization")
 
 
 
-# Define all days of the week
-WEEK_DAYS = [
-    "Monday",
-    "Tuesday",
-    "Wednesday",
-    "Thursday",
-    "Friday",
-    "Saturday",
-    "Sunday",
-]
-
-# Normalize dayByDay data for visualization, allowing multiple workouts per day
-normalized_data = []
-log_debug(f"Data cycles {df_cycles.to_string()}")
-
-
-for cycle in data_cycles:
-    start_date = cycle["startDate"]
-    end_date = cycle["endDate"]
-    if "dayByDay" in cycle:
-        for day, activities in cycle["dayByDay"].items():
-            for idx, activity in enumerate(activities):
-                for zone, seconds in activity["secondsInZone"].items():
-                    normalized_data.append(
-                        {
-                            "startDate": start_date,
-                            "endDate": end_date,
-                            "Day": day,
-                            # Include workout index in Activity to differentiate multiple workouts on the same day
-                            "WorkoutIdx": idx + 1,
-                            "Zone": str(zone),
-                            "Seconds": max(0,int(seconds)),
-                            "TimeFormatted": seconds_to_hhmmss(max(0,int(seconds))),
-                        }
-                    )
-
-activity_df = pd.DataFrame(normalized_data)
-log_debug("Activity df")
-log_debug(activity_df)
-
-# Convert startDate to date format if present
-if "startDate" in activity_df.columns:
-    activity_df["startDate"] = pd.to_datetime(activity_df["startDate"]).dt.date
-if "endDate" in activity_df.columns:
-    activity_df["endDate"] = pd.to_datetime(activity_df["endDate"]).dt.date
-
-# Drop dayByDay if present in df_cycles
-if "dayByDay" in df_cycles.columns:
-    df_cycles = df_cycles.drop(columns=["dayByDay"])
-
-# Ensure all days and zones are included
-WEEK_DAYS = [
-    "Monday",
-    "Tuesday",
-    "Wednesday",
-    "Thursday",
-    "Friday",
-    "Saturday",
-    "Sunday",
-]
-
-full_week_data = pd.DataFrame({"Day": WEEK_DAYS})
-activity_df = full_week_data.merge(activity_df, on="Day", how="left").fillna(
-    {"Activity": "None", "Zone": "0", "Seconds": 0}
-)
-
-# Add a categorical type for proper day ordering
-activity_df["Day"] = pd.Categorical(
-    activity_df["Day"], categories=WEEK_DAYS, ordered=True
-)
-
-# Log final DataFrame
-log_debug(f"Final activity_df: {activity_df.to_string()}")
-
 # Periodically check the result of the background task
 if st.session_state["db_sync_status"] == "in_progress":
     if not st.session_state["result_queue"].empty():
@@ -4375,6 +2974,88 @@ with graph_row:
         st.session_state.pop("selected_week", None)
         log_debug("No week selected pop3.")
 
+# The workouts of the weeks are planned in the background, refresh once they are
+if st.session_state["plan"] is not None and has_pending_weeks(st.session_state["plan"]):
+    st.info("Planning the workouts of each week...")
+    poll_plan_completion()
+
+# Define all days of the week
+WEEK_DAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+# Normalize dayByDay data for visualization, allowing multiple workouts per day
+normalized_data = []
+log_debug(f"Data cycles {df_cycles.to_string()}")
+
+
+for cycle in data_cycles:
+    start_date = cycle["startDate"]
+    end_date = cycle["endDate"]
+    if "dayByDay" in cycle:
+        for day, activities in cycle["dayByDay"].items():
+            for idx, activity in enumerate(activities):
+                for zone, seconds in activity["secondsInZone"].items():
+                    normalized_data.append(
+                        {
+                            "startDate": start_date,
+                            "endDate": end_date,
+                            "Day": day,
+                            # Include workout index in Activity to differentiate multiple workouts on the same day
+                            "WorkoutIdx": idx + 1,
+                            "Zone": str(zone),
+                            "Seconds": max(0,int(seconds)),
+                            "TimeFormatted": seconds_to_hhmmss(max(0,int(seconds))),
+                        }
+                    )
+
+activity_df = pd.DataFrame(
+    normalized_data,
+    columns=["startDate", "endDate", "Day", "WorkoutIdx", "Zone", "Seconds", "TimeFormatted"],
+)
+log_debug("Activity df")
+log_debug(activity_df)
+
+# Convert startDate to date format if present
+if "startDate" in activity_df.columns:
+    activity_df["startDate"] = pd.to_datetime(activity_df["startDate"]).dt.date
+if "endDate" in activity_df.columns:
+    activity_df["endDate"] = pd.to_datetime(activity_df["endDate"]).dt.date
+
+# Drop dayByDay if present in df_cycles
+if "dayByDay" in df_cycles.columns:
+    df_cycles = df_cycles.drop(columns=["dayByDay"])
+
+# Ensure all days and zones are included
+WEEK_DAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+full_week_data = pd.DataFrame({"Day": WEEK_DAYS})
+activity_df = full_week_data.merge(activity_df, on="Day", how="left").fillna(
+    {"Activity": "None", "Zone": "0", "Seconds": 0}
+)
+
+# Add a categorical type for proper day ordering
+activity_df["Day"] = pd.Categorical(
+    activity_df["Day"], categories=WEEK_DAYS, ordered=True
+)
+
+# Log final DataFrame
+log_debug(f"Final activity_df: {activity_df.to_string()}")
+
 # Week Organization and Activity Visualization
 row_organization = st.columns([1, 2])
 
@@ -4561,16 +3242,7 @@ with row_organization[1]:
         selected_week = st.session_state["selected_week"].to_pydatetime()+ timedelta(days=1)  # Convert to date
         log_debug(f"Selected week: {selected_week} and type {type(selected_week)}")
         
-        week = None
-        log_debug(f"Data cycles: {data_cycles}")
-        for microcycle in data_cycles:
-            # Normalize endDate for comparison
-            log_debug(f"Microcycle endDate: {microcycle['endDate']} and type {type(microcycle['endDate'])}")
-            if isinstance(microcycle["endDate"], datetime):
-                microcycle["endDate"] = microcycle["endDate"].date()
-            if microcycle["endDate"] == selected_week.date():
-                week = microcycle
-                break
+        week = cycleByEndDate(st.session_state["plan_index"], selected_week)
 
         if week:
             log_debug(f"Selected week: {week}")  # Remove .to_string()
@@ -4583,32 +3255,24 @@ with row_organization[1]:
             activity = week["dayByDay"][selected_day][selected_workout - 1]
             log_debug(f"Activity: {activity}")
             # Extract and build timeline data
-            if "intervalSuggestions" in activity:
-                # Extract and build timeline data
-                intervals = activity["intervalSuggestions"]
-
-                # Initialize variables for accumulated time
-                timeline_data = []
-                current_time = 0
-
-                # Loop through intervals to accumulate time
-                for interval in intervals:
-                    for zone, seconds in interval["secondsInZone"].items():
-                        timeline_data.append({
-                            "start_time_timeline": current_time,
-                            "end_time_timeline": current_time + seconds,
-                            "duration_timeline": seconds_to_hhmmss(max(0, int(seconds))),
-                            "zone_timeline": int(zone),  # Ensure zone is numeric
-                            "description_timeline": interval["description"],
-                            "tss_timeline": interval["tss"]
-                        })
-                        current_time += seconds
-                
+            if "timeline" in activity or "intervalSuggestions" in activity:
+                # Plans saved before the timelines carry the list of suggested intervals
+                timeline = activity.get("timeline") or timelineFromIntervalSuggestions(activity["intervalSuggestions"])
+                segments = expandTimeline(timeline)
+                timeline_data = pd.DataFrame({
+                    "start_time_timeline": segments["start"],
+                    "end_time_timeline": segments["end"],
+                    "duration_timeline": [seconds_to_hhmmss(max(0, int(seconds))) for seconds in segments["seconds"]],
+                    "zone_timeline": segments["zone"],
+                    "description_timeline": segments["description"],
+                    "tss_timeline": segments["tss"],
+                })
+                current_time = float(segments["end"][-1]) if len(segments["end"]) else 0
+
                 x_ticks = format_x_ticks(current_time)
                 label_expr = "{ " + ", ".join([f"{k}: '{v}'" for k, v in x_ticks.items()]) + " }[datum.value] || ''"
                 log_debug(f"label_expr: {label_expr}")
-                # Convert to DataFrame
-                timeline_df = pd.DataFrame(timeline_data)
+                timeline_df = timeline_data
                 log_debug(f"Timeline DataFrame:\n{timeline_df}")
                 log_debug(f"Timeline DataFrame todict records: {timeline_df.to_dict(orient='records')}")
         
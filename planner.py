@@ -0,0 +1,3457 @@
+# Planner of the training plans, kept out of the Streamlit script so that the worker
+# processes of the day by day planning can import it
+import logging
+import os
+import json
+import time
+import hashlib
+import threading
+import multiprocessing
+import numpy as np
+from datetime import datetime, timedelta, date
+from collections import defaultdict, OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from bisect import bisect_left, bisect_right
+
+
+def log_debug(message):
+    logging.debug(message)
+
+
+def debug_logging_enabled():
+    # Guards the debug messages formatting whole plans, which cost more than the planning itself
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
+def log_info(message):
+    # add timestamp to message
+    message = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {message}"
+    logging.info(message)
+
+
+def log_error(message):
+    logging.error(message)
+
+def log_warning(message):
+    logging.warning(message)
+    
+
+def final_date(d):
+    return d if isinstance(d, date) and not isinstance(d, datetime) else d.date()
+
+ATHLETE_LEVELS = ["Beginner", "Intermediate", "Confirmed"]
+
+TRAINING_SPORTS = ["Run", "Bike"]
+
+CYCLE_TYPES = ["Transition", "Fondamental", "Specific", "Pre-Compet", "Compet"]
+
+OBJECTIVE_SIZE = ["S", "M", "L", "XL"]
+
+OBJECTIVE_RACE = ["Finish", "Perf"]
+
+WEEK_DAYS = [
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+    "Sunday",
+]
+
+ZONES = {
+    "Run": {
+        1: "Active Recovery",
+        2: "Endurance",
+        3: "Tempo",
+        4: "Lactate Threshold",
+        5: "VO2 Max",
+        6: "Anaerobic Capacity",
+        7: "Neuromuscular Power",
+    },
+    "Bike": {
+        1: "Active Recovery",
+        2: "Endurance",
+        3: "Tempo",
+        4: "Lactate Threshold",
+        5: "VO2 Max",
+        6: "Anaerobic Capacity",
+        7: "Neuromuscular Power",
+    },
+}
+
+TSS_BY_ZONE_BY_SPORT = {
+    "Run": {1: 50, 2: 60, 3: 80, 4: 100, 5: 150, 6: 250, 7: 500},
+    "Bike": {1: 50, 2: 60, 3: 80, 4: 100, 5: 150, 6: 250, 7: 500},
+}
+
+# Same rates as arrays, ordered as the zones, for the vectorized computations
+TSS_BY_ZONE_ARRAY_BY_SPORT = {
+    sport: np.array([TSS_BY_ZONE_BY_SPORT[sport][zone] for zone in ZONES[sport]], dtype=float)
+    for sport in TSS_BY_ZONE_BY_SPORT
+}
+
+def allocateZoneBudgetBySport(timeInZone, sportShares):
+    """
+    Split a zone budget between the sports in a single step: a (sports x zones) array of
+    seconds, the row of each sport being its share of the time in every zone.
+    """
+    return np.outer(sportShares, np.array(list(timeInZone.values()), dtype=float))
+
+
+ZONE_RECOVERY_FACTOR_BY_SPORT = {
+    "Run": {1: 0, 2: 0.2, 3: 0.5, 4: 0.75, 5: 1, 6: 2, 7: 20},
+    "Bike": {1: 0, 2: 0.2, 3: 0.5, 4: 0.75, 5: 1, 6: 2, 7: 20},
+}
+
+TYPICAL_DURATION_FOR_INTERVALS_BY_ZONE_BY_SPORT = {
+    "Run": {1: 3600, 2: 3600, 3: 1200, 4: 600, 5: 180, 6: 60, 7: 12},
+    "Bike": {1: 3600, 2: 3600, 3: 1200, 4: 600, 5: 180, 6: 60, 7: 12},
+}
+
+SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH = {
+    "Run": {
+        "Beginner": {1: 8, 2: 9, 3: 11, 4: 12, 5: 13, 6: 14, 7: 20},
+        "Intermediate": {1: 9, 2: 10, 3: 12, 4: 14, 5: 16, 6: 18, 7: 24},
+        "Confirmed": {1: 10, 2: 11, 3: 13, 4: 15, 5: 17, 6: 19, 7: 26},
+    },
+    "Bike": {
+        "Beginner": {1: 18, 2: 22, 3: 26, 4: 29, 5: 33, 6: 38, 7: 45},
+        "Intermediate": {1: 22, 2: 26, 3: 30, 4: 34, 5: 38, 6: 42, 7: 50},
+        "Confirmed": {1: 26, 2: 30, 3: 34, 4: 38, 5: 42, 6: 46, 7: 55},
+    },
+}
+
+LONG_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE = {
+    "Run": {
+        "Finish": {
+            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
+        },
+        "Perf": {
+            "S": {"Beginner": 1.3, "Intermediate": 1.7, "Confirmed": 2},
+            "M": {"Beginner": 0.9, "Intermediate": 1.1, "Confirmed": 1.5},
+            "L": {"Beginner": 0.65, "Intermediate": 0.75, "Confirmed": 0.85},
+            "XL": {"Beginner": 0.65, "Intermediate": 0.70, "Confirmed": 0.75},
+        },
+    },
+    "Bike": {
+        "Finish": {
+            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
+        },
+        "Perf": {
+            "S": {"Beginner": 1.3, "Intermediate": 1.7, "Confirmed": 2},
+            "M": {"Beginner": 0.9, "Intermediate": 1.1, "Confirmed": 1.5},
+            "L": {"Beginner": 0.65, "Intermediate": 0.75, "Confirmed": 0.85},
+            "XL": {"Beginner": 0.65, "Intermediate": 0.70, "Confirmed": 0.75},
+        },
+    },
+}
+
+
+RACE_INTENSITY_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE = {
+    "Run": {
+        "Finish": {
+            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
+        },
+        "Perf": {
+            "S": {"Beginner": 0.8, "Intermediate": 0.8, "Confirmed": 0.8},
+            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "L": {"Beginner": 0.55, "Intermediate": 0.55, "Confirmed": 0.55},
+            "XL": {"Beginner": 0.40, "Intermediate": 0.40, "Confirmed": 0.40},
+        },
+    },
+    "Bike": {
+        "Finish": {
+            "S": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "L": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "XL": {"Beginner": 0.65, "Intermediate": 0.65, "Confirmed": 0.65},
+        },
+        "Perf": {
+            "S": {"Beginner": 0.8, "Intermediate": 0.8, "Confirmed": 0.8},
+            "M": {"Beginner": 0.75, "Intermediate": 0.75, "Confirmed": 0.75},
+            "L": {"Beginner": 0.55, "Intermediate": 0.55, "Confirmed": 0.55},
+            "XL": {"Beginner": 0.40, "Intermediate": 0.40, "Confirmed": 0.40},
+        },
+    },
+}
+
+
+REGULAR_MAX_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL = {
+    "Run": {
+        "Finish": {
+            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
+            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
+            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
+            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
+        },
+        "Perf": {
+            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
+            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
+            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
+            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
+        },
+    },
+    "Bike": {
+        "Finish": {
+            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
+            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
+            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
+            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
+        },
+        "Perf": {
+            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
+            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
+            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
+            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
+        },
+    },
+}
+
+REGULAR_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL = {
+    "Run": {
+        "Finish": {
+            "S": {"Beginner": 45, "Intermediate": 60, "Confirmed": 75},
+            "M": {"Beginner": 55, "Intermediate": 70, "Confirmed": 85},
+            "L": {"Beginner": 65, "Intermediate": 80, "Confirmed": 95},
+            "XL": {"Beginner": 75, "Intermediate": 82, "Confirmed": 90},
+        },
+        "Perf": {
+            "S": {"Beginner": 60, "Intermediate": 70, "Confirmed": 80},
+            "M": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
+            "L": {"Beginner": 80, "Intermediate": 90, "Confirmed": 100},
+            "XL": {"Beginner": 90, "Intermediate": 100, "Confirmed": 110},
+        },
+    },
+    "Bike": {
+        "Finish": {
+            "S": {"Beginner": 45, "Intermediate": 60, "Confirmed": 75},
+            "M": {"Beginner": 55, "Intermediate": 70, "Confirmed": 85},
+            "L": {"Beginner": 65, "Intermediate": 80, "Confirmed": 95},
+            "XL": {"Beginner": 75, "Intermediate": 82, "Confirmed": 90},
+        },
+        "Perf": {
+            "S": {"Beginner": 60, "Intermediate": 70, "Confirmed": 80},
+            "M": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
+            "L": {"Beginner": 80, "Intermediate": 90, "Confirmed": 100},
+            "XL": {"Beginner": 90, "Intermediate": 100, "Confirmed": 110},
+        },
+    },
+}
+
+MAX_TSS_PER_DAY_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL = {
+    "Run": {
+        "Finish": {
+            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
+            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
+            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
+            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
+        },
+        "Perf": {
+            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
+            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
+            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
+            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
+        },
+    },
+    "Bike": {
+        "Finish": {
+            "S": {"Beginner": 70, "Intermediate": 80, "Confirmed": 90},
+            "M": {"Beginner": 120, "Intermediate": 140, "Confirmed": 160},
+            "L": {"Beginner": 170, "Intermediate": 200, "Confirmed": 230},
+            "XL": {"Beginner": 230, "Intermediate": 270, "Confirmed": 320},
+        },
+        "Perf": {
+            "S": {"Beginner": 100, "Intermediate": 120, "Confirmed": 150},
+            "M": {"Beginner": 150, "Intermediate": 180, "Confirmed": 200},
+            "L": {"Beginner": 250, "Intermediate": 250, "Confirmed": 280},
+            "XL": {"Beginner": 350, "Intermediate": 320, "Confirmed": 350},
+        },
+    },
+}
+
+
+MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE = {
+    "Perf": {
+        "S": {
+            "Fondamental": 365,
+            "Specific": 90,
+            "Pre-Compet": 0,
+            "Compet": 7,
+            "Transition": 0,
+        },
+        "M": {
+            "Fondamental": 365,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+        "L": {
+            "Fondamental": 365,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+        "XL": {
+            "Fondamental": 720,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+    },
+    "Finish": {
+        "S": {
+            "Fondamental": 365,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+        "M": {
+            "Fondamental": 365,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+        "L": {
+            "Fondamental": 365,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+        "XL": {
+            "Fondamental": 720,
+            "Specific": 90,
+            "Pre-Compet": 7,
+            "Compet": 7,
+            "Transition": 0,
+        },
+    },
+}
+
+COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE = {
+    "Run": {
+        "Perf": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
+        "Finish": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
+    },
+    "Bike": {
+        "Perf": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
+        "Finish": {"S": 1.5, "M": 1.5, "L": 1.5, "XL": 1.5},
+    },
+}
+
+ZONE_REPARTITION_BY_TIME_BY_WEEK_BY_CYCLE = {
+    "Confirmed": {
+        "Fondamental": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Specific": {
+            "S": {1: 0.4, 2: 0.2, 3: 0.2, 4: 0.12, 5: 0.06, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Pre-Compet": {
+            "S": {1: 0.4, 2: 0.2, 3: 0.2, 4: 0.12, 5: 0.06, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Compet": {
+            "S": {1: 0.4, 2: 0.2, 3: 0.2, 4: 0.12, 5: 0.06, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Transition": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+    },
+    "Beginner": {
+        "Fondamental": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Specific": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Pre-Compet": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Compet": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Transition": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+    },
+    "Intermediate": {
+        "Fondamental": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Specific": {
+            "S": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.35, 3: 0.13, 4: 0.07, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Pre-Compet": {
+            "S": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.35, 3: 0.13, 4: 0.07, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Compet": {
+            "S": {1: 0.4, 2: 0.25, 3: 0.2, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.30, 3: 0.15, 4: 0.1, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.35, 3: 0.13, 4: 0.07, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+        "Transition": {
+            "S": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "M": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "L": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+            "XL": {1: 0.4, 2: 0.4, 3: 0.1, 4: 0.05, 5: 0.03, 6: 0.02, 7: 0.00},
+        },
+    },
+}
+
+KEY_WORKOUTS_BY_CYCLE = {
+    "Fondamental": ["LongIntensity"],
+    "Specific": ["Long", "RaceIntensity"],
+    "Pre-Compet": ["ShortIntensity", "RaceIntensity"],
+    "Compet": [],
+    "Transition": ["Long", "Tempo"],
+}
+
+# Day by day planning of the weeks is spread over the cores
+PLANNING_WORKERS = int(os.getenv("PLANNING_WORKERS", os.cpu_count() or 1))
+# Seconds the worker pool may take over the weeks of a plan before they are planned here
+PLANNING_POOL_TIMEOUT = float(os.getenv("PLANNING_POOL_TIMEOUT", 10))
+# Seconds the remaining weeks would take here, estimated from the first one, above which they go to the workers.
+# A week takes about a millisecond while starting the workers takes most of a second, so seasons are planned here
+MIN_SECONDS_FOR_PARALLEL_PLANNING = float(os.getenv("MIN_SECONDS_FOR_PARALLEL_PLANNING", 2))
+# Number of distinct weeks kept in the day by day planning cache
+DAY_BY_DAY_CACHE_SIZE = 1024
+# Pending weeks planned in the first streamed batch (current and next weeks), the next batches double
+STREAMED_FIRST_WEEKS = 2
+# Iteration budgets of the planner loops, far above what a real plan needs
+MAX_PLANNED_WEEKS = 520
+MAX_REMAINING_WORKOUTS_PER_WEEK = 50
+# Seconds a plan computation may run before the weeks left are kept without workouts
+PLAN_TIME_BUDGET = float(os.getenv("PLAN_TIME_BUDGET", 30))
+
+
+def hashPlanInputs(*values):
+    """Short stable hash of planner inputs, to report a pathological input without logging it whole"""
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+# Number of planner decisions kept per plan, 0 disables the trace
+PLAN_TRACE_SIZE = int(os.getenv("PLAN_TRACE_SIZE", 0))
+# Planner decisions recorded in the trace
+TRACE_REST_WEEK = "rest week inserted"
+TRACE_FONDAMENTAL_TRUNCATED = "fondamental truncated"
+TRACE_KEY_WORKOUT_TSS = "key workout tss"
+TRACE_WEEK_DAY_BY_DAY = "week planned day by day"
+TRACE_WEEK_FROM_CACHE = "week reused from cache"
+TRACE_WORKOUT_PLACED = "workout placed on day"
+TRACE_WORKOUT_NOT_PLACED = "no day fits the workout"
+TRACE_BUDGET_EXCEEDED = "budget exceeded"
+# Trace of the plan computed by the current thread, if any
+PLAN_TRACE_STATE = threading.local()
+
+
+@contextmanager
+def planTrace(computation):
+    """Record the planner decisions of this thread in the trace of the computation"""
+    previousTrace = getattr(PLAN_TRACE_STATE, "trace", None)
+    PLAN_TRACE_STATE.trace = computation["trace"] if computation is not None else None
+    try:
+        yield
+    finally:
+        PLAN_TRACE_STATE.trace = previousTrace
+
+
+def planTraceActive():
+    return getattr(PLAN_TRACE_STATE, "trace", None) is not None
+
+
+def tracePlanEvent(event, **details):
+    """Record a planner decision, a single attribute lookup when no trace is active"""
+    trace = getattr(PLAN_TRACE_STATE, "trace", None)
+    if trace is not None:
+        trace.append((time.monotonic(), event, details))
+
+
+def format_plan_trace(trace):
+    """One line per recorded decision, with its time since the first one"""
+    if not trace:
+        return ""
+    start = trace[0][0]
+    return "\n".join(
+        f"+{timestamp - start:.4f}s {event} "
+        + " ".join(f"{key}={value}" for key, value in details.items())
+        for timestamp, event, details in trace
+    )
+
+
+def determineEventSize(distance, sport, duration=None):
+    if sport == "Run":
+        if distance <= 12:
+            return "S"
+        elif distance <= 23:
+            return "M"
+        elif distance <= 45:
+            return "L"
+        else:
+            return "XL"
+    elif sport == "Bike":
+        if distance <= 40:
+            return "S"
+        elif distance <= 80:
+            return "M"
+        elif distance <= 130:
+            return "L"
+        else:
+            return "XL"
+
+
+def determineRaceZone(eventSize, objective):
+    if objective == "Finish":
+        return 2
+    elif objective == "Perf":
+        if eventSize == "S":
+            return 5
+        elif eventSize == "M":
+            return 4
+        elif eventSize == "L":
+            return 3
+        else:
+            return 2
+
+
+def calculateEventTss(raceZone, sport, targetTimeInMinutes):
+    return TSS_BY_ZONE_BY_SPORT[sport][raceZone] * targetTimeInMinutes / 60
+
+
+def computeFondamentalWeeksRequired(
+    currentLoad,
+    currentCycleNumber,
+    currentIndexInCycle,
+    endLoad,
+    weeklyTssIncreaseRate,
+    cycleLength,
+    nextRestingWeek,
+    lastWeeksTakeways,
+):
+    workingLoads = []
+    indexInCycle = currentIndexInCycle
+    cycleNumber = currentCycleNumber
+
+    if currentLoad < endLoad * 0.95:
+        while True:
+            if len(workingLoads) >= MAX_PLANNED_WEEKS:
+                # Never reached with a growing load, keep the weeks computed so far
+                log_warning(
+                    f"Fondamental weeks budget exceeded (inputs {hashPlanInputs(currentLoad, endLoad, weeklyTssIncreaseRate, cycleLength, nextRestingWeek)})"
+                )
+                tracePlanEvent(TRACE_BUDGET_EXCEEDED, loop="fondamental weeks", weeks=len(workingLoads))
+                break
+            if nextRestingWeek == 0:
+                indexInCycle += 1
+                restingLoad = currentLoad * 0.6
+                tracePlanEvent(
+                    TRACE_REST_WEEK, cycleType="Fondamental", cycleNumber=cycleNumber, load=int(restingLoad)
+                )
+                workingLoads.append(
+                    {
+                        "theoreticalWeeklyTSS": int(restingLoad),
+                        "theoreticalResting": True,
+                        "cycleNumber": cycleNumber,
+                        "indexInCycle": indexInCycle,
+                    }
+                )
+                # After inserting a resting week, now set nextRestingWeek to cycleLength - 1
+                nextRestingWeek = cycleLength - 1
+                cycleNumber += 1
+                indexInCycle = 0
+            else:
+                # Working week logic
+                currentLoad *= 1 + weeklyTssIncreaseRate
+                indexInCycle += 1
+                workingLoads.append(
+                    {
+                        "theoreticalWeeklyTSS": min(endLoad, int(currentLoad)),
+                        "theoreticalResting": False,
+                        "cycleNumber": cycleNumber,
+                        "indexInCycle": indexInCycle,
+                        "keyWorkouts": KEY_WORKOUTS_BY_CYCLE["Fondamental"],
+                    }
+                )
+                nextRestingWeek -= 1
+                if currentLoad > endLoad * 0.95:
+                    break
+
+    for week in workingLoads:
+        week["cycleType"] = "Fondamental"
+    return workingLoads, nextRestingWeek, cycleNumber
+
+
+def analyzeMacrocycle(macrocycle, completedWorkouts, raceZone, mainSport):
+    pass
+
+
+def checkWorkoutValidity(actualWorkout, theoreticalWorkout):
+    if actualWorkout["activity"] != theoreticalWorkout["activity"]:
+        return 0
+    if theoreticalWorkout["workoutType"] == "Long":
+        if actualWorkout["tss"] > theoreticalWorkout["tss"] * 0.8:
+            actualWorkout["workoutType"] = "Long"
+            return 1
+        else:
+            return 0
+    if theoreticalWorkout["workoutType"] == "LongIntensity":
+        if (
+            actualWorkout["secondsInZone"].get(4, 0)
+            * 3600
+            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][4]
+            + actualWorkout["secondsInZone"].get(3, 0)
+            * 3600
+            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][3]
+            > theoreticalWorkout["tss"] * 0.8
+        ):
+            actualWorkout["workoutType"] = "LongIntensity"
+            return 1
+        else:
+            return 0
+    if theoreticalWorkout["workoutType"] == "ShortIntensity":
+        if (
+            actualWorkout["secondsInZone"].get(5, 0)
+            * 3600
+            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][5]
+            + actualWorkout["secondsInZone"].get(6, 0)
+            * 3600
+            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][6]
+            + actualWorkout["secondsInZone"].get(7, 0)
+            * 3600
+            * TSS_BY_ZONE_BY_SPORT[actualWorkout["activity"]][7]
+            > theoreticalWorkout["tss"] * 0.8
+        ):
+            actualWorkout["workoutType"] = "ShortIntensity"
+            return 1
+        else:
+            return 0
+    if "tss" in actualWorkout:
+        if actualWorkout["tss"] > theoreticalWorkout["tss"] * 0.8:
+            return 1
+        else:
+            return 0
+
+
+def buildCompletedWorkoutsTable(completedWorkouts, mainSport):
+    """
+    Columnar view of the completed workouts, sorted by date: the tss and a matrix of the
+    seconds spent in each zone (one row per workout), so that a week is a slice.
+    """
+    zones = list(ZONES[mainSport].keys())
+    workouts = sorted(completedWorkouts, key=lambda workout: final_date(workout["date"]))
+    secondsInZone = np.zeros((len(workouts), len(zones)))
+    for i, workout in enumerate(workouts):
+        for zone, seconds in workout.get("secondsInZone", {}).items():
+            if zone in ZONES[mainSport]:
+                secondsInZone[i, zones.index(zone)] = seconds
+    return {
+        "zones": zones,
+        "workouts": workouts,
+        "dates": [final_date(workout["date"]) for workout in workouts],
+        "tss": np.array([workout.get("tss", 0) for workout in workouts], dtype=float),
+        "secondsInZone": secondsInZone,
+    }
+
+
+def analyzeMicrocycle(microcycle, completedWorkouts, raceZone, mainSport, workoutsTable=None):
+    """
+    Compare a past week with what was done, every metric is computed in one pass over the
+    columnar slice of the week workouts.
+    """
+    if workoutsTable is None:
+        workoutsTable = buildCompletedWorkoutsTable(completedWorkouts, mainSport)
+    zones = workoutsTable["zones"]
+    first = bisect_left(workoutsTable["dates"], final_date(microcycle["startDate"]))
+    last = bisect_right(workoutsTable["dates"], final_date(microcycle["endDate"]))
+    actualWeekWorkouts = workoutsTable["workouts"][first:last]
+    weekTss = workoutsTable["tss"][first:last]
+    weekSecondsInZone = workoutsTable["secondsInZone"][first:last]
+    # TSS of each workout in each zone
+    weekTssInZone = weekSecondsInZone * TSS_BY_ZONE_ARRAY_BY_SPORT[mainSport] / 3600
+
+    totalTSS = float(weekTss.sum())
+    microcycle["actualTSS"] = totalTSS
+
+    # to a time repartition tss aggregation
+    actualSecondsInZone = dict(zip(zones, weekSecondsInZone.sum(axis=0).tolist()))
+    microcycle["actualSecondsInZone"] = actualSecondsInZone
+
+    theroeticalTimeSpentWeekInSeconds = (
+        microcycle["theoreticalWeeklyTSS"]
+        * 3600
+        / sum(
+            [
+                TSS_BY_ZONE_BY_SPORT[mainSport][zone]
+                * microcycle["timeInZoneRepartition"][zone]
+                for zone in zones
+            ]
+        )
+    )
+    microcycle["theoreticalTimeSpentWeek"] = timedelta(
+        seconds=theroeticalTimeSpentWeekInSeconds
+    )
+
+    theoreticalTimeInZone = {
+        zone: microcycle["timeInZoneRepartition"][zone]
+        * theroeticalTimeSpentWeekInSeconds
+        for zone in zones
+    }
+    microcycle["theoreticalTimeInZone"] = theoreticalTimeInZone
+
+    microcycle["deltaTimeInZone"] = {
+        zone: actualSecondsInZone[zone] - theoreticalTimeInZone[zone]
+        for zone in zones
+    }
+
+    # Biggest workout of the week for each key workout, the intensity ones keep their
+    # historical scale (tss per hour times seconds / 60)
+    raceIntensityTss = weekTssInZone[:, zones.index(raceZone)]
+    longIntensityTss = weekTssInZone[:, [zones.index(3), zones.index(4)]].sum(axis=1) * 60
+    shortIntensityTss = weekTssInZone[:, [zones.index(5), zones.index(6), zones.index(7)]].sum(axis=1) * 60
+
+    # Weeks without a target for a key workout (e.g. Compet) can never mark it as done
+    microcycle["actualLongWorkoutTSS"] = float(weekTss.max(initial=0))
+    microcycle["longWorkoutDone"] = bool(
+        microcycle["actualLongWorkoutTSS"] > microcycle.get("theoreticalLongWorkoutTSS", float("inf")) * 0.85
+    )
+    microcycle["actualRaceIntensityTSS"] = float(raceIntensityTss.max(initial=0))
+    microcycle["RaceIntensityDone"] = bool(
+        microcycle["actualRaceIntensityTSS"] > microcycle.get("theoreticalRaceIntensityTSS", float("inf")) * 0.85
+    )
+    microcycle["actualLongIntensityTSS"] = float(longIntensityTss.max(initial=0))
+    microcycle["LongIntensityDone"] = bool(
+        microcycle["actualLongIntensityTSS"] > microcycle.get("theoreticalLongIntensityTSS", float("inf")) * 0.85
+    )
+    microcycle["actualShortIntensityTSS"] = float(shortIntensityTss.max(initial=0))
+    microcycle["ShortIntensityDone"] = bool(
+        microcycle["actualShortIntensityTSS"] > microcycle.get("theoreticalShortIntensityTSS", float("inf")) * 0.85
+    )
+
+    # Check if it is a rest week
+
+    if microcycle.get("theoreticalResting", False):
+        if totalTSS <= microcycle["theoreticalWeeklyTSS"] * 1.2:
+            microcycle["actualResting"] = True
+        else:
+            microcycle["actualResting"] = False
+            microcycle["nextWeekGuidelines"] = "Rest"
+    else:
+        if totalTSS <= microcycle["theoreticalWeeklyTSS"] * 0.6:
+            microcycle["actualResting"] = True
+            microcycle["nextWeekGuidelines"] = "Normal"
+        else:
+            microcycle["actualResting"] = False
+
+    # First planned workout of each type, found in a single walk of the days
+    plannedWorkoutsByType = {}
+    for day in microcycle.get("dayByDay", {}):
+        for plannedWorkout in microcycle["dayByDay"][day]:
+            plannedWorkoutsByType.setdefault(plannedWorkout["workoutType"], plannedWorkout)
+
+    missingKeyWorkouts = []
+    for workout in microcycle.get("keyWorkouts", []):
+        theoreticalWorkout = plannedWorkoutsByType.get(workout)
+        done = theoreticalWorkout is not None and any(
+            checkWorkoutValidity(actualWorkout, theoreticalWorkout) > 0.8
+            for actualWorkout in actualWeekWorkouts
+        )
+        if not done:
+            missingKeyWorkouts.append(workout)
+    microcycle["missingKeyWorkouts"] = missingKeyWorkouts
+
+    microcycle["analyzed"] = True
+
+
+def buildCycleIndex(cycles):
+    """
+    Sorted interval index over non overlapping cycles (macro or micro), answers the date
+    queries with a bisection on the start and end dates. Bounds are compared as dates since
+    persisted plans mix date and datetime.
+    """
+    orderedCycles = sorted(cycles, key=lambda cycle: final_date(cycle["startDate"]))
+    return {
+        "cycles": orderedCycles,
+        "startDates": [final_date(cycle["startDate"]) for cycle in orderedCycles],
+        "endDates": [final_date(cycle["endDate"]) for cycle in orderedCycles],
+    }
+
+
+def cycleContainingDate(cycleIndex, day):
+    """The cycle containing the day, {} if there is none"""
+    day = final_date(day)
+    i = bisect_right(cycleIndex["startDates"], day) - 1
+    if i >= 0 and cycleIndex["endDates"][i] >= day:
+        return cycleIndex["cycles"][i]
+    return {}
+
+
+def cyclesBeforeDate(cycleIndex, day):
+    """The cycles ending strictly before the day"""
+    return cycleIndex["cycles"][:bisect_left(cycleIndex["endDates"], final_date(day))]
+
+
+def cyclesAfterDate(cycleIndex, day):
+    """The cycles starting strictly after the day"""
+    return cycleIndex["cycles"][bisect_right(cycleIndex["startDates"], final_date(day)):]
+
+
+def cyclesBetweenDates(cycleIndex, after, until):
+    """The cycles starting strictly after `after` (None for no bound) and ending on or before `until`"""
+    first = bisect_right(cycleIndex["startDates"], final_date(after)) if after is not None else 0
+    last = bisect_right(cycleIndex["endDates"], final_date(until))
+    return cycleIndex["cycles"][first:last]
+
+
+def cycleByEndDate(cycleIndex, day):
+    """The cycle ending on the day, None if there is none"""
+    day = final_date(day)
+    i = bisect_left(cycleIndex["endDates"], day)
+    if i < len(cycleIndex["endDates"]) and cycleIndex["endDates"][i] == day:
+        return cycleIndex["cycles"][i]
+    return None
+
+
+def planWeekLoads(
+    loadsInfo,
+    datesInfo,
+    raceInfo,
+    weekInfo,
+    currentPlannedMacrocycles,
+    currentPlannedMicrocycles,
+    completedWorkouts,
+    race_number,
+    withDayByDay=True,
+    computation=None,
+):
+    if debug_logging_enabled():
+        log_debug(f"Planning week with loadsInfo: {loadsInfo}, datesInfo: {datesInfo}, raceInfo: {raceInfo}, weekInfo: {weekInfo}, currentPlannedMacrocycles: {currentPlannedMacrocycles}, currentPlannedMicrocycles: {currentPlannedMicrocycles}, completedWorkouts: {completedWorkouts}")
+
+    macrocycleIndex = buildCycleIndex(currentPlannedMacrocycles)
+    microcycleIndex = buildCycleIndex(currentPlannedMicrocycles)
+    currentDay = datesInfo["currentDate"]
+
+    pastMacrocycles = cyclesBeforeDate(macrocycleIndex, currentDay)
+    pastMicrocycles = cyclesBeforeDate(microcycleIndex, currentDay)
+    currentMacrocycle = cycleContainingDate(macrocycleIndex, currentDay)
+    currentMicrocycle = cycleContainingDate(microcycleIndex, currentDay)
+    futureMacrocycles = cyclesAfterDate(macrocycleIndex, currentDay)
+    futureMicrocycles = cyclesAfterDate(microcycleIndex, currentDay)
+    # The persisted cycles are shared, the current ones are replanned on their own copy
+    if currentMacrocycle != {}:
+        currentMacrocycle = dict(currentMacrocycle)
+    if currentMicrocycle != {}:
+        currentMicrocycle = dict(currentMicrocycle)
+    # Only the current and future cycles can still be edited, the past is frozen
+    editableMacrocycles = ([currentMacrocycle] if currentMacrocycle != {} else []) + futureMacrocycles
+    editableMicrocycles = ([currentMicrocycle] if currentMicrocycle != {} else []) + futureMicrocycles
+
+    # Check if the past was analyzed, if not analyze it
+    # Analyzed cycles are kept as they are, the others are analyzed on a copy
+    if pastMacrocycles:
+        for i, macrocycle in enumerate(pastMacrocycles):
+            if "analyzed" not in macrocycle or not macrocycle["analyzed"]:
+                macrocycle = pastMacrocycles[i] = dict(macrocycle)
+                analyzeMacrocycle(
+                    macrocycle,
+                    completedWorkouts,
+                    raceInfo["raceZone"],
+                    raceInfo["mainSport"],
+                )
+                macrocycle["analyzed"] = True
+    if pastMicrocycles:
+        workoutsTable = buildCompletedWorkoutsTable(completedWorkouts, raceInfo["mainSport"])
+        for i, microcycle in enumerate(pastMicrocycles):
+            if "analyzed" not in microcycle or not microcycle["analyzed"]:
+                microcycle = pastMicrocycles[i] = dict(microcycle)
+                analyzeMicrocycle(
+                    microcycle,
+                    completedWorkouts,
+                    raceInfo["raceZone"],
+                    raceInfo["mainSport"],
+                    workoutsTable,
+                )
+
+    # First compare what was completed to what was planned
+    lastWeeksTakeaways = currentLoadStatus(pastMicrocycles)
+    if "declaredHandableLoad" in loadsInfo:
+        # startLoad = loadsInfo["declaredHandableLoad"]
+        startLoad = loadsInfo["startLoad"]
+    else:
+        startLoad = lastWeeksTakeaways["currentHandableLoad"]
+    # Compare this with the current microcycle, are we corresponding to the plan?
+
+    if "nextRestingWeek" in loadsInfo and loadsInfo["nextRestingWeek"] is not None:
+        nextRestingWeek = loadsInfo["nextRestingWeek"]
+    else:
+        nextRestingWeek = (
+            lastWeeksTakeaways["nextRestingWeek"] - 1
+            if lastWeeksTakeaways["nextRestingWeek"] > 0
+            else 0
+        )
+
+    if currentMicrocycle != {}:
+        compareCurrentWeekWithPlannedWeekAndReplanIfNeeded(
+            completedWorkouts=completedWorkouts,
+            currentMicrocycle=currentMicrocycle,
+            startLoad=startLoad,
+            currentDay=datesInfo["currentDate"].weekday(),
+            lastWeeksTakeaways=lastWeeksTakeaways,
+            maxTssPerDay=loadsInfo["maxTssPerDay"],
+            mainSport=raceInfo["mainSport"],
+        )
+
+    nextRestingWeek = nextRestingWeek - 1 if nextRestingWeek > 0 else 0
+    if currentMicrocycle.get("actualResting", None) or currentMicrocycle.get(
+        "theoreticalResting", None
+    ):
+        nextRestingWeek = loadsInfo["cycleLength"]
+
+    # Compute what would be the ideal fondamental weeks
+    fondamentalWeeks, nextRestingWeek, lastCycleNumber = (
+        computeFondamentalWeeksRequired(
+            startLoad * (1 + loadsInfo["weeklyTssIncreaseRate"]),
+            currentMicrocycle.get("cycleNumber", 1),
+            currentMicrocycle.get("indexInCycle", 0),
+            loadsInfo["endLoad"],
+            loadsInfo["weeklyTssIncreaseRate"],
+            loadsInfo["cycleLength"],
+            nextRestingWeek,
+            lastWeeksTakeaways,
+        )
+    )
+    numberOfFondamentalWeeks = len(fondamentalWeeks)
+
+    log_debug("Fondamental weeks computed")
+    log_debug(fondamentalWeeks)
+
+    # Let's compute what should be the next week macrocycle
+    currentStep = CYCLE_TYPES[-1]
+    currentPlanningDate = datesInfo["endDate"]
+
+    dateOfStartPreComp = (
+        datesInfo["endDate"]
+        - timedelta(
+            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                raceInfo["objective"]
+            ][raceInfo["eventSize"]]["Pre-Compet"]
+        )
+        - timedelta(
+            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                raceInfo["objective"]
+            ][raceInfo["eventSize"]]["Compet"]
+        )
+        + timedelta(days=1)
+    )
+    
+    
+    daysAhead = 7 - datesInfo["currentDate"].weekday() % 7
+    if daysAhead == 0:
+        daysAhead = 7
+    nextMondayDate = final_date(datesInfo["currentDate"] + timedelta(days=(daysAhead)))
+
+    mondayBeginningOfPreComp = final_date(dateOfStartPreComp - timedelta(
+        days=dateOfStartPreComp.weekday()
+    ))
+    numberOfWeeksAvailableFondSpe =round((
+        mondayBeginningOfPreComp
+        - nextMondayDate
+    ).days / 7) # begins after the current week
+    if currentMicrocycle == {} and race_number != 0 and datesInfo["currentDate"].weekday() < 6:
+        numberOfWeeksAvailableFondSpe += 1
+    if dateOfStartPreComp.weekday() != 0:
+        numberOfWeeksAvailableFondSpe += 1
+    log_info(
+        f"next monday date: {nextMondayDate} Date of start precomp: {dateOfStartPreComp}, monday before precomp: {mondayBeginningOfPreComp}, number of weeks available fond spe: {numberOfWeeksAvailableFondSpe}, current microcycle: {currentMicrocycle.get('startDate')} - {currentMicrocycle.get('endDate')}, race number: {race_number}, date of start precomp weekday: {dateOfStartPreComp.weekday()}, current date {datesInfo['currentDate']}, number of days: {(dateOfStartPreComp - date(datesInfo['currentDate'].year, datesInfo['currentDate'].month, datesInfo['currentDate'].day)).days}"
+    )
+
+    specificWeeks = []
+
+    if numberOfFondamentalWeeks > numberOfWeeksAvailableFondSpe:
+        tracePlanEvent(
+            TRACE_FONDAMENTAL_TRUNCATED,
+            required=numberOfFondamentalWeeks,
+            available=numberOfWeeksAvailableFondSpe,
+        )
+        fondamentalWeeks = fondamentalWeeks[:numberOfWeeksAvailableFondSpe]
+        # if last week is rest, change it to a normal week
+        lastRestingWeekIndex = 0
+        for i in range(len(fondamentalWeeks)):
+            if fondamentalWeeks[i].get("actualResting", None) or fondamentalWeeks[
+                i
+            ].get("theoreticalResting", None):
+                lastRestingWeekIndex = i
+
+        nextRestingWeek = len(fondamentalWeeks) - lastRestingWeekIndex - 2
+        if len(fondamentalWeeks) > 1:
+            currentCycleNumber = (
+                fondamentalWeeks[-1]["cycleNumber"] + 1
+                if fondamentalWeeks[-1]["indexInCycle"] == loadsInfo["cycleLength"] - 1
+                else fondamentalWeeks[-1]["cycleNumber"]
+            )
+            currentIndexInCycle = (
+                fondamentalWeeks[-1]["indexInCycle"] + 1
+                if fondamentalWeeks[-1]["indexInCycle"] < loadsInfo["cycleLength"] - 1
+                else 1
+            )
+        else:
+            currentCycleNumber = 1
+            currentIndexInCycle = 1
+    else:
+        if len(fondamentalWeeks) > 1:
+            number_of_specific_weeks = (
+                numberOfWeeksAvailableFondSpe - numberOfFondamentalWeeks
+            )
+            currentCycleNumber = (
+                fondamentalWeeks[-1]["cycleNumber"] + 1
+                if fondamentalWeeks[-1]["indexInCycle"] == loadsInfo["cycleLength"] - 1
+                else fondamentalWeeks[-1]["cycleNumber"]
+            )
+            currentIndexInCycle = (
+                fondamentalWeeks[-1]["indexInCycle"] + 1
+                if fondamentalWeeks[-1]["indexInCycle"] < loadsInfo["cycleLength"] - 1
+                else 1
+            )
+            lastRestingWeekIndex = 0
+            for i in range(len(fondamentalWeeks)):
+                if fondamentalWeeks[i].get("actualResting", None) or fondamentalWeeks[
+                    i
+                ].get("theoreticalResting", None):
+                    lastRestingWeekIndex = i
+            nextRestingWeek = len(fondamentalWeeks) - lastRestingWeekIndex - 2
+        else:
+            number_of_specific_weeks = numberOfWeeksAvailableFondSpe
+            currentCycleNumber = 1
+            currentIndexInCycle = 1
+            nextRestingWeek = loadsInfo["cycleLength"] - 1
+        
+        if race_number == 0 and loadsInfo["declaredNextRestingWeek"] is not None:
+            nextRestingWeek = loadsInfo["declaredNextRestingWeek"]
+        
+        specificWeeks = getSpecificWeeks(
+            number_of_specific_weeks,
+            loadsInfo["endLoad"],
+            loadsInfo["cycleLength"],
+            nextRestingWeek,
+            currentCycleNumber + 1,
+            currentIndexInCycle,
+        )
+        
+    log_info(f"number of fondamentalWeeks: {len(fondamentalWeeks)}, number of specific weeks: {len(specificWeeks)}")
+
+    planBeforePreComp = fondamentalWeeks + specificWeeks
+
+    # Add the key workouts formats:
+    currentHandableBiggestWorkout = lastWeeksTakeaways.get(
+        "biggestWorkout", loadsInfo["currentLongRunTSS"]
+    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
+    currentHandableShortIntensity = lastWeeksTakeaways.get(
+        "currentShortIntensity", 10
+    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
+    currentHandableRaceIntensity = lastWeeksTakeaways.get(
+        "currentRaceIntensity", 15
+    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
+    currentHandableLongIntensity = lastWeeksTakeaways.get(
+        "currentLongIntensity", 15
+    ) * (1 + loadsInfo["weeklyTssIncreaseRate"])
+
+    if loadsInfo.get("currentLongRunTSS", None) is not None:
+        currentHandableBiggestWorkout = loadsInfo["currentLongRunTSS"]
+    if loadsInfo.get("currentShortIntensityTSS", None) is not None:
+        currentHandableShortIntensity = loadsInfo["currentShortIntensityTSS"]
+    if loadsInfo.get("currentRaceIntensityTSS", None) is not None:
+        currentHandableRaceIntensity = loadsInfo["currentRaceIntensityTSS"]
+    if loadsInfo.get("currentLongIntensityTSS", None) is not None:
+        currentHandableLongIntensity = loadsInfo["currentLongIntensityTSS"]
+
+    for i, week in enumerate(planBeforePreComp):
+        ratio = 1
+        if week["theoreticalResting"]:
+            ratio = 0.7
+        if "Long" in week.get("keyWorkouts", []):
+            week["theoreticalLongWorkoutTSS"] = currentHandableBiggestWorkout * ratio
+            tracePlanEvent(TRACE_KEY_WORKOUT_TSS, week=i, workout="theoreticalLongWorkoutTSS", tss=int(week["theoreticalLongWorkoutTSS"]))
+            number_of_future_weeks_having_long_in_key_workouts = 0
+            for future_week in planBeforePreComp[i + 1 :]:
+                if "Long" in future_week.get("keyWorkouts", []):
+                    number_of_future_weeks_having_long_in_key_workouts += 1
+
+            currentHandableBiggestWorkout += (
+                loadsInfo.get("finalLongRunTSS", loadsInfo["maxTssPerWorkout"])
+                - currentHandableBiggestWorkout
+            ) / (number_of_future_weeks_having_long_in_key_workouts + 1)
+
+        if "ShortIntensity" in week.get("keyWorkouts", []):
+            week["theoreticalShortIntensityTSS"] = currentHandableShortIntensity * ratio
+            tracePlanEvent(TRACE_KEY_WORKOUT_TSS, week=i, workout="theoreticalShortIntensityTSS", tss=int(week["theoreticalShortIntensityTSS"]))
+            number_of_future_weeks_having_short_in_key_workouts = 0
+            for future_week in planBeforePreComp[i + 1 :]:
+                if "ShortIntensity" in future_week.get("keyWorkouts", []):
+                    number_of_future_weeks_having_short_in_key_workouts += 1
+
+            currentHandableShortIntensity += (
+                loadsInfo.get("finalShortIntensityTSS", loadsInfo["maxTssPerWorkout"])
+                - currentHandableShortIntensity
+            ) / (number_of_future_weeks_having_short_in_key_workouts + 1)
+
+        if "theoreticalRaceIntensityTSS" in week.get("keyWorkouts", []):
+            week["theoreticalRaceIntensityTSS"] = currentHandableRaceIntensity * ratio
+            tracePlanEvent(TRACE_KEY_WORKOUT_TSS, week=i, workout="theoreticalRaceIntensityTSS", tss=int(week["theoreticalRaceIntensityTSS"]))
+            number_of_future_week_having_race_in_key_workouts = 0
+            for future_week in planBeforePreComp[i + 1 :]:
+                if "RaceIntensity" in future_week.get("keyWorkouts", []):
+                    number_of_future_week_having_race_in_key_workouts += 1
+            currentHandableRaceIntensity += (
+                loadsInfo.get("finalRaceIntensityTSS", loadsInfo["maxTssPerWorkout"])
+                - currentHandableRaceIntensity
+            ) / (number_of_future_week_having_race_in_key_workouts + 1)
+
+        if "LongIntensity" in week.get("keyWorkouts", []):
+            week["theoreticalLongIntensityTSS"] = currentHandableLongIntensity * ratio
+            tracePlanEvent(TRACE_KEY_WORKOUT_TSS, week=i, workout="theoreticalLongIntensityTSS", tss=int(week["theoreticalLongIntensityTSS"]))
+            number_of_future_week_having_long_intensity_in_key_workouts = 0
+            for future_week in planBeforePreComp[i + 1 :]:
+                if "LongIntensity" in future_week.get("keyWorkouts", []):
+                    number_of_future_week_having_long_intensity_in_key_workouts += 1
+            currentHandableLongIntensity += (
+                loadsInfo.get("finalLongIntensityTSS", loadsInfo["maxTssPerWorkout"])
+                - currentHandableLongIntensity
+            ) / (number_of_future_week_having_long_intensity_in_key_workouts + 1)
+
+    log_debug("Current Step before checking competition cycle")
+    log_debug(currentStep)
+    if currentStep == "Compet":  # Edit or Create the competition cycle
+        # Try to find the competition cycle
+        found = False
+        for i, macrocycle in enumerate(editableMacrocycles):
+            if macrocycle["cycleType"] == "Compet":
+                found = True
+                competitionMacrocycle = update_macrocycle(
+                    macrocycle,
+                    {
+                        "endDate": datesInfo["endDate"],
+                        "startDate": max(final_date(datesInfo["endDate"]
+                        - timedelta(
+                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                                raceInfo["objective"]
+                            ][raceInfo["eventSize"]]["Compet"]
+                        ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
+                        "totalTSS": raceInfo["eventTSS"]
+                        * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
+                            raceInfo["mainSport"]
+                        ][raceInfo["objective"]][raceInfo["eventSize"]],
+                    },
+                )
+        # if not present, create it
+        if not found:
+            log_debug("Creating competition macrocycle")
+            competitionMacrocycle = {
+                "cycleType": "Compet",
+                "startDate": max(final_date(datesInfo["endDate"]
+                - timedelta(
+                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                        raceInfo["objective"]
+                    ][raceInfo["eventSize"]]["Compet"]
+                ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
+                "endDate": datesInfo["endDate"],
+                "totalTSS": raceInfo["eventTSS"]
+                * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
+                    raceInfo["mainSport"]
+                ][raceInfo["objective"]][raceInfo["eventSize"]],
+            }
+
+        # Do the same with the microcycle
+        found = False
+        for i, microcycle in enumerate(editableMicrocycles):
+            if microcycle.get("cycleType") == "Compet":
+                found = True
+                competitionMicrocycle = update_microcycle(
+                    microcycle,
+                    {
+                        "endDate": datesInfo["endDate"],
+                        "startDate": max(final_date(datesInfo["endDate"]
+                        - timedelta(
+                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                                raceInfo["objective"]
+                            ][raceInfo["eventSize"]]["Compet"]
+                        ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
+                        "theoreticalWeeklyTSS": raceInfo["eventTSS"]
+                        * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
+                            raceInfo["mainSport"]
+                        ][raceInfo["objective"]][raceInfo["eventSize"]],
+                    },
+                )
+                if microcycle is currentMicrocycle:
+                    # Replanning inside the competition week, it stays the current week
+                    currentMicrocycle = competitionMicrocycle
+                currentPlanningDate = competitionMicrocycle["startDate"]
+        if not found:
+            log_debug("Creating competition microcycle")
+            competitionMicrocycle = {
+                "cycleType": "Compet",
+                "startDate": max(final_date(datesInfo["endDate"]
+                - timedelta(
+                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                        raceInfo["objective"]
+                    ][raceInfo["eventSize"]]["Compet"]
+                ) + timedelta(days=1)), final_date(datesInfo["currentDate"])),
+                "endDate": datesInfo["endDate"],
+                "theoreticalWeeklyTSS": raceInfo["eventTSS"]
+                * COMPET_CYCLE_TSS_MULTIPLICATOR_BY_SPORT_BY_OBJECTIVE_OBJECTIVE_SIZE[
+                    raceInfo["mainSport"]
+                ][raceInfo["objective"]][raceInfo["eventSize"]],
+            }
+            currentPlanningDate = competitionMicrocycle["startDate"]
+        log_info("Current planning date")
+        log_info(currentPlanningDate)
+        log_info(datesInfo["currentDate"])
+        if datesInfo["currentDate"] >= datetime(
+            currentPlanningDate.year, currentPlanningDate.month, currentPlanningDate.day
+        ):
+            # We are in the competition cycle
+            log_info("We are in the competition cycle")
+            planAnotherWeek = False
+        else:
+            log_info("We are before the competition cycle")
+            currentStep = "Pre-Compet"
+    precompetMicrocycle = {}
+    precompetMacrocycle = {}
+    if currentStep == "Pre-Compet":
+        found = False
+        for i, macrocycle in enumerate(editableMacrocycles):
+            if macrocycle["cycleType"] == "Pre-Compet":
+                found = True
+                log_debug("Updating precompet macrocycle")
+                precompetMacrocycle = update_macrocycle(
+                    macrocycle,
+                    {
+                        "endDate": competitionMacrocycle["startDate"]
+                        - timedelta(days=1),
+                        "startDate": max(final_date(competitionMacrocycle["startDate"]
+                        - timedelta(
+                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                                raceInfo["objective"]
+                            ][raceInfo["eventSize"]]["Pre-Compet"]
+                        )), final_date(datesInfo["currentDate"])),
+                        "totalTSS": loadsInfo["endLoad"]
+                        / 2
+                        * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
+                            - timedelta(
+                                days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                                    raceInfo["objective"]
+                                ][raceInfo["eventSize"]]["Pre-Compet"]
+                            )), final_date(datesInfo["currentDate"]))).days + 1)
+                        / 7,
+                        "theoreticalResting": True,
+                    },
+                )
+        if not found:
+            log_debug("Creating precompet macrocycle")
+            precompetMacrocycle = {
+                "cycleType": "Pre-Compet",
+                "startDate": max(final_date(competitionMacrocycle["startDate"]
+                - timedelta(
+                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                        raceInfo["objective"]
+                    ][raceInfo["eventSize"]]["Pre-Compet"]
+                )), final_date(datesInfo["currentDate"])),
+                "endDate": competitionMacrocycle["startDate"] - timedelta(days=1),
+                "theoreticalWeeklyTSS": loadsInfo["endLoad"]
+                / 2
+                * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
+                - timedelta(
+                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                        raceInfo["objective"]
+                    ][raceInfo["eventSize"]]["Pre-Compet"]
+                )), final_date(datesInfo["currentDate"]))).days + 1)
+                / 7,
+                "theoreticalResting": True,
+            }
+        found = False
+        for i, microcycle in enumerate(editableMicrocycles):
+            if microcycle.get("cycleType") == "Pre-Compet":
+                log_debug("Updating precompet microcycle")
+                found = True
+                precompetMicrocycle = update_microcycle(
+                    microcycle,
+                    {
+                        "endDate": competitionMicrocycle["startDate"]
+                        - timedelta(days=1),
+                        "startDate": max(final_date(competitionMicrocycle["startDate"]
+                        - timedelta(
+                            days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                                raceInfo["objective"]
+                            ][raceInfo["eventSize"]]["Pre-Compet"]
+                        )), final_date(datesInfo["currentDate"])),
+                        "theoreticalWeeklyTSS": loadsInfo["endLoad"]
+                        / 2
+                        * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
+                            - timedelta(
+                                days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                                    raceInfo["objective"]
+                                ][raceInfo["eventSize"]]["Pre-Compet"]
+                            )), final_date(datesInfo["currentDate"]))).days + 1)
+                        / 7,
+                        "theoreticalResting": True,
+                    },
+                )
+                if microcycle is currentMicrocycle:
+                    # Replanning inside the pre-compet week, it stays the current week
+                    currentMicrocycle = precompetMicrocycle
+                currentPlanningDate = precompetMicrocycle["startDate"]
+        if not found:
+            log_debug("Creating precompet microcycle")
+            precompetMicrocycle = {
+                "cycleType": "Pre-Compet",
+                "startDate": max(final_date(competitionMicrocycle["startDate"]
+                - timedelta(
+                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                        raceInfo["objective"]
+                    ][raceInfo["eventSize"]]["Pre-Compet"]
+                )), final_date(datesInfo["currentDate"])),
+                "endDate": competitionMicrocycle["startDate"] - timedelta(days=1),
+                "theoreticalWeeklyTSS": loadsInfo["endLoad"]
+                / 2
+                * ((competitionMacrocycle["startDate"] - timedelta(days=1)-max(final_date(competitionMacrocycle["startDate"]
+                - timedelta(
+                    days=MAX_CYCLES_TIMING_DAYS_TO_RACE_BY_OBJECTIVE_BY_OBJECTIVE_SIZE[
+                        raceInfo["objective"]
+                    ][raceInfo["eventSize"]]["Pre-Compet"]
+                )), final_date(datesInfo["currentDate"]))).days + 1)
+                / 7,
+                "theoreticalResting": True,
+            }
+            currentPlanningDate = precompetMicrocycle["startDate"]
+        log_debug(f"Current planning date {currentPlanningDate}. Current date {datesInfo['currentDate']}")
+
+        if datesInfo["currentDate"] >= datetime(
+            currentPlanningDate.year, currentPlanningDate.month, currentPlanningDate.day
+        ):
+            # We are in the precompet cycle
+            log_debug("We are in the precompet cycle")
+            planAnotherWeek = False
+        else:
+            log_debug("We are before the precompet cycle")
+            currentStep = "Before Pre Comp"
+    
+    newPlanBeforePreComp = []
+    
+    if currentStep == "Before Pre Comp":
+        # We begin next monday after current date
+
+        if currentMicrocycle == {} and race_number == 0:
+            # Add a currentMicrocycle
+            currentMicrocycleBeforePreComp = {
+                "cycleType": "Fondamental",
+                "startDate": datesInfo["currentDate"],
+                "endDate": datesInfo["currentDate"]+timedelta(days=6-datesInfo["currentDate"].weekday()),
+                "theoreticalWeeklyTSS": startLoad*((6-datesInfo["currentDate"].weekday())/7) if loadsInfo.get("nextRestingWeek", 4) >=1  else startLoad*((6-datesInfo["currentDate"].weekday())/7/2),
+                "theoreticalResting": loadsInfo.get("nextRestingWeek", 4) <1,
+                "keyWorkouts": [],
+                "dayByDay": {},
+            }
+            log_debug(f"Creating current microcycle {currentMicrocycleBeforePreComp}")
+            newPlanBeforePreComp.append(currentMicrocycleBeforePreComp)
+        
+        
+        beginningOfNextWeek = (
+            datesInfo["currentDate"]
+            + timedelta(days=(7 - datesInfo["currentDate"].weekday()))
+        )
+        # Remove comp and precomp from the futureMicrocycles
+        futureMicrocycles = [
+            microcycle
+            for microcycle in futureMicrocycles
+            if microcycle["cycleType"] not in ["Pre-Compet", "Compet"]
+        ]
+        # order them by date
+        futureMicrocycles = sorted(futureMicrocycles, key=lambda x: x["startDate"])
+        # Compare week after week the planBeforePreComp with the futureMicrocycles (except precomp and comp) and update if needed
+        
+        for i, newMicrocycle in enumerate(planBeforePreComp):
+            # Try get matching microcycle
+            currentPlanningDate = beginningOfNextWeek + timedelta(days=7 * i)
+            if i < len(futureMicrocycles):
+                oldMicrocycle = futureMicrocycles[i]
+                endDate = currentPlanningDate + timedelta(days=6)
+                theoreticalWeeklyTSS = newMicrocycle["theoreticalWeeklyTSS"]
+                keyWorkouts = newMicrocycle.get("keyWorkouts", [])
+                # if we are the last week of the planBeforePreComp, we have to adapt the date of the end to a day before the beginning of pre compet
+                if i == len(planBeforePreComp) - 1:
+                    endDate = precompetMicrocycle["startDate"] - timedelta(days=1)
+                    theoreticalWeeklyTSS = (
+                        theoreticalWeeklyTSS * (endDate.weekday() + 1) / 7
+                    )
+                    if endDate.weekday() <= 3:
+                        keyWorkouts = [workout for workout in keyWorkouts if workout != "Long"]
+                newValues = {
+                    "startDate": currentPlanningDate,
+                    "endDate": endDate,
+                    "theoreticalWeeklyTSS": theoreticalWeeklyTSS,
+                    "theoreticalResting": newMicrocycle["theoreticalResting"],
+                    "keyWorkouts": keyWorkouts,
+                    "theoreticalLongWorkoutTSS": newMicrocycle.get(
+                        "theoreticalLongWorkoutTSS", 0
+                    ),
+                }
+                # The week may change of cycle and key workouts, bring their targets along
+                for key in [
+                    "cycleType",
+                    "cycleNumber",
+                    "indexInCycle",
+                    "theoreticalShortIntensityTSS",
+                    "theoreticalLongIntensityTSS",
+                    "theoreticalRaceIntensityTSS",
+                ]:
+                    if key in newMicrocycle:
+                        newValues[key] = newMicrocycle[key]
+                newMicrocycle = update_microcycle(oldMicrocycle, newValues)
+                if debug_logging_enabled():
+                    log_debug(
+                        f"Updating microcycle {newMicrocycle}, currentPlanningDate: {currentPlanningDate}"
+                    )
+            else:
+                newMicrocycle["startDate"] = currentPlanningDate
+                newMicrocycle["endDate"] = currentPlanningDate + timedelta(days=6)
+                if debug_logging_enabled():
+                    log_debug(
+                        f"Creating microcycle {newMicrocycle}, currentPlanningDate: {currentPlanningDate}"
+                    )
+                if i == len(planBeforePreComp) - 1:
+                    newMicrocycle["endDate"] = precompetMicrocycle[
+                        "startDate"
+                    ] - timedelta(days=1)
+                    newMicrocycle["theoreticalWeeklyTSS"] = (
+                        newMicrocycle["theoreticalWeeklyTSS"]
+                        * (newMicrocycle["endDate"].weekday() + 1)
+                        / 7
+                    )
+                    if newMicrocycle["endDate"].weekday() <= 3:
+                        if "Long" in newMicrocycle.get("keyWorkouts", []):
+                            newMicrocycle["keyWorkouts"].remove("Long")
+            newPlanBeforePreComp.append(newMicrocycle)
+
+    totalMacrocycles = (
+        pastMacrocycles
+        + [currentMacrocycle]
+        + futureMacrocycles
+        + [precompetMacrocycle]
+        + [competitionMacrocycle]
+    )
+    log_info(f"past microcycles: {len(pastMicrocycles)}, current microcycle: {currentMicrocycle != {}}, new microcycles before pre-compet: {len(newPlanBeforePreComp)}")
+    weeksToPlanDayByDay = [microcycle for microcycle in newPlanBeforePreComp if microcycle != {}]
+    if precompetMicrocycle != {} and precompetMicrocycle is not currentMicrocycle:
+        weeksToPlanDayByDay.append(precompetMicrocycle)
+    if competitionMicrocycle != {} and competitionMicrocycle is not currentMicrocycle:
+        weeksToPlanDayByDay.append(competitionMicrocycle)
+    if withDayByDay:
+        planFutureWeeksDayByDay(weeksToPlanDayByDay, weekInfo, raceInfo, loadsInfo, datesInfo, computation)
+    else:
+        # Only the loads are planned, complete_training_plan fills the days afterwards
+        for microcycle in weeksToPlanDayByDay:
+            microcycle["dayByDayPending"] = True
+            microcycle["raceNumber"] = race_number
+    if debug_logging_enabled():
+        log_debug(f"competitionMicrocycle: {competitionMicrocycle}")
+        log_debug(f"pastMicrocycles: {pastMicrocycles}, currentMicrocycle: {currentMicrocycle}, newPlanBeforePreComp: {newPlanBeforePreComp}, precompetMicrocycle: {precompetMicrocycle}, competitionMicrocycle: {competitionMicrocycle}")
+    totalMicrocycles = pastMicrocycles
+
+    # Add currentMicrocycle if it's not empty
+    if currentMicrocycle != {}:
+        totalMicrocycles.append(currentMicrocycle)
+
+    # Add all non-empty items in the correct order
+    totalMicrocycles.extend(newPlanBeforePreComp)
+
+    # When replanning inside the pre-compet or compet week, it is already the current microcycle
+    if precompetMicrocycle != {} and precompetMicrocycle is not currentMicrocycle:
+        totalMicrocycles.append(precompetMicrocycle)
+
+    if competitionMicrocycle != {} and competitionMicrocycle is not currentMicrocycle:
+        totalMicrocycles.append(competitionMicrocycle)
+
+    
+    if debug_logging_enabled():
+        log_debug(f"Total microcycles: {totalMicrocycles}")
+
+    return totalMacrocycles, totalMicrocycles
+
+
+class PlanComputationCancelled(Exception):
+    """A newer input revision superseded the plan computation"""
+
+
+class PlanTimeBudgetExceeded(PlanComputationCancelled):
+    """The plan computation ran longer than its time budget"""
+
+
+def new_plan_computation(revision, timeBudget=PLAN_TIME_BUDGET):
+    """Token of a plan computation, cancelled when a newer revision supersedes it or once past its deadline"""
+    return {
+        "revision": revision,
+        "cancelled": threading.Event(),
+        "deadline": time.monotonic() + timeBudget,
+        "trace": deque(maxlen=PLAN_TRACE_SIZE) if PLAN_TRACE_SIZE > 0 else None,
+    }
+
+
+def checkPlanCancelled(computation):
+    """Checkpoint of the planning: stop here if the computation was superseded or ran out of time"""
+    if computation is None:
+        return
+    if computation["cancelled"].is_set():
+        raise PlanComputationCancelled(f"Plan computation of revision {computation['revision']} superseded")
+    if computation["deadline"] is not None and time.monotonic() > computation["deadline"]:
+        raise PlanTimeBudgetExceeded(f"Plan computation of revision {computation['revision']} ran out of time")
+
+
+# Process pool shared by all the sessions, created on first use
+_planning_executor = {"lock": threading.Lock(), "executor": None}
+
+
+def get_planning_executor():
+    """
+    Process pool shared by all the sessions. The workers are not forked from the multithreaded
+    server: they start from a fresh interpreter and import this module for the planner functions.
+    """
+    with _planning_executor["lock"]:
+        if _planning_executor["executor"] is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _planning_executor["executor"] = ProcessPoolExecutor(max_workers=PLANNING_WORKERS, mp_context=context)
+        return _planning_executor["executor"]
+
+
+def reset_planning_executor():
+    """Drop the process pool and stop its workers without waiting for them, the next computation starts a new pool"""
+    with _planning_executor["lock"]:
+        executor, _planning_executor["executor"] = _planning_executor["executor"], None
+    if executor is not None:
+        # Shutting the pool down lets a worker stuck on a week run on, only terminating it frees its core
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def planWeekDayByDayInWorker(futureMicrocycle, weekInfo, raceInfo, loadsInfo, datesInfo):
+    """Runs in a worker, only sends back what the day by day planning adds to the week"""
+    plannedMicrocycle = planFutureWeekDayByDay(dict(futureMicrocycle), weekInfo, raceInfo, loadsInfo, datesInfo)
+    if planTraceActive():
+        for day, workouts in plannedMicrocycle["dayByDay"].items():
+            for workout in workouts:
+                tracePlanEvent(
+                    TRACE_WORKOUT_PLACED,
+                    endDate=final_date(plannedMicrocycle["endDate"]),
+                    day=day,
+                    workoutType=workout["workoutType"],
+                    tss=int(workout["tss"]),
+                )
+    return freeze_plan({
+        "timeInZoneRepartition": plannedMicrocycle["timeInZoneRepartition"],
+        "dayByDay": plannedMicrocycle["dayByDay"],
+    })
+
+
+# Day by day plans of the already planned weeks, shared by all the sessions
+_day_by_day_cache = {"lock": threading.Lock(), "entries": OrderedDict()}
+
+
+def get_day_by_day_cache():
+    """Day by day plans of the already planned weeks, shared by all the sessions"""
+    return _day_by_day_cache
+
+
+def dayByDayCacheKey(futureMicrocycle, weekInfo, raceInfo, loadsInfo):
+    """Everything planFutureWeekDayByDay reads, two weeks with the same key get the same days"""
+    key = (
+        futureMicrocycle["theoreticalWeeklyTSS"],
+        futureMicrocycle["cycleType"],
+        tuple(sorted(set(futureMicrocycle.get("keyWorkouts", [])))),
+        futureMicrocycle.get("theoreticalLongWorkoutTSS"),
+        futureMicrocycle.get("theoreticalShortIntensityTSS"),
+        futureMicrocycle.get("theoreticalLongIntensityTSS"),
+        tuple(weekInfo["availableDays"]),
+        tuple(sorted(weekInfo["dayAvailableDurations"].items())),
+        weekInfo["longWorkoutDay"],
+        raceInfo["fitnessLevel"],
+        raceInfo["eventSize"],
+        raceInfo["mainSport"],
+        tuple(raceInfo["sportShares"].items()),
+        raceInfo["objective"],
+        raceInfo["raceZone"],
+        raceInfo["eventTSS"],
+        raceInfo["targetTimeInMinutes"],
+        raceInfo["raceDistanceKm"],
+        loadsInfo["minTssPerWorkout"],
+        loadsInfo["maxTssPerWorkout"],
+        loadsInfo["finalLongRunTSS"],
+    )
+    if "compet" == futureMicrocycle["cycleType"].lower():
+        # The competition week is organized backward from the race day
+        key += (
+            futureMicrocycle["endDate"].weekday(),
+            (futureMicrocycle["endDate"] - futureMicrocycle["startDate"]) > timedelta(days=5),
+        )
+    return key
+
+
+def planWeeksDayByDayInPool(futureMicrocycles, weekInfo, raceInfo, loadsInfo, datesInfo, computation=None):
+    """
+    Plan the weeks day by day in the worker pool. None when the pool fails or takes longer than
+    PLANNING_POOL_TIMEOUT, the pool is then dropped so that the next computation starts a new one.
+    """
+    try:
+        chunksize = -(-len(futureMicrocycles) // PLANNING_WORKERS)
+        results = []
+        # Leaving the map early cancels the chunks not started yet
+        for result in get_planning_executor().map(
+            planWeekDayByDayInWorker,
+            futureMicrocycles,
+            repeat(weekInfo),
+            repeat(raceInfo),
+            repeat(loadsInfo),
+            repeat(datesInfo),
+            timeout=PLANNING_POOL_TIMEOUT,
+            chunksize=chunksize,
+        ):
+            checkPlanCancelled(computation)
+            results.append(result)
+        return results
+    except PlanComputationCancelled:
+        raise
+    except Exception as e:
+        log_warning(f"Parallel day by day planning failed, planning sequentially: {e!r}")
+        reset_planning_executor()
+        return None
+
+
+def planDistinctWeeksDayByDay(futureMicrocycles, weekInfo, raceInfo, loadsInfo, datesInfo, computation=None):
+    """
+    Plan the weeks day by day and return what is added to each of them, in order. Each week
+    only depends on its own load, cycle type and key workouts, so when the first week shows that
+    the others would take longer than MIN_SECONDS_FOR_PARALLEL_PLANNING, they are spread over
+    the worker pool.
+    """
+    results = []
+    for index, microcycle in enumerate(futureMicrocycles):
+        checkPlanCancelled(computation)
+        start = time.perf_counter()
+        results.append(planWeekDayByDayInWorker(microcycle, weekInfo, raceInfo, loadsInfo, datesInfo))
+        # The decisions of the workers would not reach the trace, a traced plan is planned here
+        if (
+            index == 0
+            and PLANNING_WORKERS > 1
+            and (time.perf_counter() - start) * (len(futureMicrocycles) - 1) > MIN_SECONDS_FOR_PARALLEL_PLANNING
+            and not planTraceActive()
+        ):
+            pooledResults = planWeeksDayByDayInPool(
+                futureMicrocycles[1:], weekInfo, raceInfo, loadsInfo, datesInfo, computation
+            )
+            if pooledResults is not None:
+                return results + pooledResults
+    return results
+
+
+def planFutureWeeksDayByDay(futureMicrocycles, weekInfo, raceInfo, loadsInfo, datesInfo, computation=None):
+    """
+    Plan the weeks day by day, in place. Identical weeks share one dayByDay, planned once
+    and then served from the cache.
+    """
+    cache = get_day_by_day_cache()
+    keys = [dayByDayCacheKey(microcycle, weekInfo, raceInfo, loadsInfo) for microcycle in futureMicrocycles]
+    results = {}
+    with cache["lock"]:
+        for key in keys:
+            if key in cache["entries"] and key not in results:
+                cache["entries"].move_to_end(key)
+                results[key] = cache["entries"][key]
+
+    weeksToPlan = {}
+    for key, microcycle in zip(keys, futureMicrocycles):
+        if key not in results and key not in weeksToPlan:
+            weeksToPlan[key] = microcycle
+        else:
+            tracePlanEvent(TRACE_WEEK_FROM_CACHE, endDate=final_date(microcycle["endDate"]))
+    log_debug(f"Day by day planning: {len(futureMicrocycles)} weeks, {len(weeksToPlan)} to plan")
+
+    plannedWeeks = planDistinctWeeksDayByDay(
+        list(weeksToPlan.values()), weekInfo, raceInfo, loadsInfo, datesInfo, computation
+    )
+    with cache["lock"]:
+        for key, result in zip(weeksToPlan, plannedWeeks):
+            results[key] = result
+            cache["entries"][key] = result
+        while len(cache["entries"]) > DAY_BY_DAY_CACHE_SIZE:
+            cache["entries"].popitem(last=False)
+
+    for key, microcycle in zip(keys, futureMicrocycles):
+        microcycle.update(results[key])
+    return futureMicrocycles
+
+
+def planFutureWeekDayByDay(futureMicrocycle, weekInfo, raceInfo, loadsInfo, datesInfo):
+    log_info(
+        f"Planning future week day by day for {futureMicrocycle.get('startDate')} - {futureMicrocycle.get('endDate')}, {futureMicrocycle['cycleType']} {futureMicrocycle['theoreticalWeeklyTSS']} TSS"
+    )
+    if debug_logging_enabled():
+        log_debug(f"Future week {futureMicrocycle}")
+    tracePlanEvent(
+        TRACE_WEEK_DAY_BY_DAY,
+        cycleType=futureMicrocycle["cycleType"],
+        load=int(futureMicrocycle["theoreticalWeeklyTSS"]),
+    )
+
+    remaining_tss = futureMicrocycle["theoreticalWeeklyTSS"]
+    availableDays = list(weekInfo["availableDays"])
+    dayAvailableDurations = dict(weekInfo["dayAvailableDurations"])
+
+    futureMicrocycle["timeInZoneRepartition"] = (
+        ZONE_REPARTITION_BY_TIME_BY_WEEK_BY_CYCLE[
+            raceInfo["fitnessLevel"]
+        ][futureMicrocycle["cycleType"]][raceInfo["eventSize"]]
+    )
+    theroeticalTimeSpentWeekInSeconds = (
+        futureMicrocycle["theoreticalWeeklyTSS"]
+        * 3600
+        / sum(
+            [
+                TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][zone]
+                * futureMicrocycle["timeInZoneRepartition"][zone]
+                for zone in ZONES[raceInfo["mainSport"]].keys()
+            ]
+        )
+    )
+    theoreticalTimeInZone = {
+        zone: futureMicrocycle["timeInZoneRepartition"][zone]
+        * theroeticalTimeSpentWeekInSeconds
+        for zone in ZONES[raceInfo["mainSport"]].keys()
+    }
+    log_debug(f"Theoretical time in zone {theoreticalTimeInZone}")
+
+    dayByDay = {}
+    if "compet" == futureMicrocycle["cycleType"].lower():
+        # Let's plan the competition
+        log_info("Planning competition")
+        # Let's plan the competition
+        competitionTSS = raceInfo["eventTSS"]
+        targetTimeInSeconds = raceInfo["targetTimeInMinutes"] * 60
+        competitionZone = raceInfo["raceZone"]
+        weekDaysMapping = ("Monday", "Tuesday", 
+                   "Wednesday", "Thursday",
+                   "Friday", "Saturday",
+                   "Sunday")
+        
+        dayByDay[weekDaysMapping[futureMicrocycle["endDate"].weekday()]] = [{
+            "workoutType": "Competition",
+            "activity": raceInfo["mainSport"],
+            "tss": competitionTSS,
+            "secondsInZone": {competitionZone: targetTimeInSeconds},
+            "theoreticalDistance": raceInfo["raceDistanceKm"],
+            "theoreticalTime": timedelta(seconds=targetTimeInSeconds),
+        }]
+        if futureMicrocycle["endDate"].weekday() >= 1:
+            dayByDay[weekDaysMapping[futureMicrocycle["endDate"].weekday()-1]] = [{
+                "workoutType": "Activation",
+                "activity": raceInfo["mainSport"],
+                "tss": competitionTSS,
+                "secondsInZone": {1: 1800, 6: 120},
+                "theoreticalDistance": 5,
+                "theoreticalTime": timedelta(seconds=1920),
+            }]
+
+        
+        
+        # if the duration of the microcycle is more than 5 days, d-2, d-3, d-4 is a rest day, but d-5 is a very long zone 2, about 60% of the long workout
+        if (futureMicrocycle["endDate"] - futureMicrocycle["startDate"])>timedelta(days=5):
+            tz1 = loadsInfo["finalLongRunTSS"]*0.5*0.3 / TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1]*3600
+            tz2 = loadsInfo["finalLongRunTSS"]*0.5*0.7 / TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]*3600
+            theoreticalDistance = tz1 / 3600 * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][raceInfo["fitnessLevel"]][1] + tz2 / 3600 * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][raceInfo["fitnessLevel"]][2]
+            dayByDay[weekDaysMapping[futureMicrocycle["endDate"].weekday()-5]] = [{
+                "workoutType": "Long",
+                "activity": raceInfo["mainSport"],
+                "tss": loadsInfo["finalLongRunTSS"]*0.5,
+                "secondsInZone": {1: tz1, 2: tz2},
+                "theoreticalDistance": theoreticalDistance,
+                "theoreticalTime": timedelta(seconds=tz1 + tz2),
+            }]
+        remaining_tss = 0
+        futureMicrocycle["dayByDay"] = dayByDay
+        return futureMicrocycle
+    
+    if "Long" in futureMicrocycle.get("keyWorkouts", []):
+        log_debug("Planning long workout")
+        # let's split futureMicrocycle["theoreticalLongWorkoutTSS"] TSS in zones 1 2 and 3 with 30% 50% and 20% of the time respectively
+
+        z1Percentage = 0.3
+        z2Percentage = 0.5
+        z3Percentage = 0.2
+        
+        timeline = newTimeline()
+
+        tz1 = (
+            futureMicrocycle["theoreticalLongWorkoutTSS"]
+            * 3600
+            / (
+                TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1]
+                + TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]
+                * (z1Percentage / z2Percentage)
+                + TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3]
+                * (z1Percentage / z3Percentage)
+            )
+        )
+        tz2 = tz1 * z1Percentage / z2Percentage
+        tz3 = tz1 * z1Percentage / z3Percentage
+
+        if theoreticalTimeInZone[3] < tz3:
+            # Rebalance to zone 2
+            tz2 += (
+                (tz3 - theoreticalTimeInZone[3])
+                * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3]
+                / TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]
+            )
+
+        # Compute the theoretical distance run
+        theoreticalDistance = (
+            tz1
+            / 3600
+            * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
+                raceInfo["fitnessLevel"]
+            ][1]
+            + tz2
+            / 3600
+            * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
+                raceInfo["fitnessLevel"]
+            ][2]
+            + tz3
+            / 3600
+            * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
+                raceInfo["fitnessLevel"]
+            ][3]
+        )
+
+        activity_tss = (
+            tz1 / 3600 * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][1]
+            + tz2 / 3600 * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][2]
+            + tz3 / 3600 * TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]][3]
+        )
+        
+        # half of tz1 as a warmup, then tz2 in thirds around the two halves of tz3, and the rest of tz1
+        tssByZone = TSS_BY_ZONE_BY_SPORT[raceInfo["mainSport"]]
+        addTimelineStep(timeline, "Warmup", 1, tz1 / 2, tz1 / 2 / 3600 * tssByZone[1])
+        addTimelineStep(timeline, "Main", 2, tz2 / 3, tz2 / 3 / 3600 * tssByZone[2])
+        addTimelineStep(timeline, "Main", 3, tz3 / 2, tz3 / 2 / 3600 * tssByZone[3])
+        addTimelineStep(timeline, "Main", 2, tz2 / 3, tz2 / 3 / 3600 * tssByZone[2])
+        addTimelineStep(timeline, "Main", 3, tz3 / 2, tz3 / 2 / 3600 * tssByZone[3])
+        addTimelineStep(timeline, "Main", 2, tz2 / 3, tz2 / 3 / 3600 * tssByZone[2])
+        addTimelineStep(timeline, "Cooldown", 1, tz1 / 2, tz1 / 2 / 3600 * tssByZone[1])
+
+        dayByDay[weekInfo["longWorkoutDay"]] = [
+            {
+                "workoutType": "Long",
+                "activity": raceInfo["mainSport"],
+                "tss": activity_tss,
+                "secondsInZone": {1: tz1, 2: tz2, 3: tz3},
+                "theoreticalDistance": theoreticalDistance,
+                "theoreticalTime": timedelta(seconds=tz1 + tz2 + tz3),
+                "timeline": timeline,
+            }
+        ]
+
+        remaining_tss -= activity_tss
+
+        theoreticalTimeInZone[1] -= tz1
+        theoreticalTimeInZone[2] -= tz2
+        theoreticalTimeInZone[3] -= tz3
+        if weekInfo["longWorkoutDay"] in availableDays:
+            availableDays.remove(weekInfo["longWorkoutDay"])
+            dayAvailableDurations[weekInfo["longWorkoutDay"]] -= tz1 + tz2 + tz3
+        log_debug(dayByDay)
+
+    remaining_number_of_workouts = round(
+        remaining_tss
+        / REGULAR_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL[
+            raceInfo["mainSport"]
+        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
+    )
+    if remaining_number_of_workouts == 0:
+        futureMicrocycle["dayByDay"] = dayByDay
+        return futureMicrocycle
+    else:
+        tss_per_activity = round(remaining_tss / remaining_number_of_workouts)
+
+    if "ShortIntensity" in futureMicrocycle.get("keyWorkouts", []):
+        log_debug("Planning short intensity workout")
+        # let's split futureMicrocycle["theoreticalShortIntensityTSS"] TSS in zones 5 6 and 7 with 50% 30% and 20% of the time respectively
+
+        total_tss, secondsInZone, timeline = createWorkout(
+            loadsInfo["minTssPerWorkout"],
+            loadsInfo["maxTssPerWorkout"],
+            tss_per_activity,
+            theoreticalTimeInZone,
+            min_time_in_zones={},
+            max_time_in_zones={5: 1200, 6: 600, 7: 300},
+            cumulative_max_tss_in_zones=[
+                {
+                    "zones": [5, 6, 7],
+                    "max": futureMicrocycle["theoreticalShortIntensityTSS"],
+                }
+            ],
+            zones=[7, 6, 5],
+            warmup_duration=600,
+            cooldown_duration=600,
+            activity=raceInfo["mainSport"],
+        )
+        log_debug(
+            f"Short intensity workout, seconds in zone {secondsInZone}, total tss {total_tss}"
+        )
+        theoreticalDistance = sum(
+            [
+                secondsInZone[zone]
+                / 3600
+                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
+                    raceInfo["fitnessLevel"]
+                ][zone]
+                for zone in ZONES[raceInfo["mainSport"]].keys()
+            ]
+        )
+
+        # let's find the good day
+        total_seconds = sum(
+            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
+        )
+        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
+        if best_fit is not None:
+            if dayByDay.get(best_fit[0], None) is None:
+                dayByDay[best_fit[0]] = []
+            dayByDay[best_fit[0]].append(
+                {
+                    "workoutType": "ShortIntensity",
+                    "activity": raceInfo["mainSport"],
+                    "tss": total_tss,
+                    "secondsInZone": secondsInZone,
+                    "theoreticalDistance": theoreticalDistance,
+                    "theoreticalTime": timedelta(seconds=total_seconds),
+                    "timeline": timeline,
+                }
+            )
+            for zone in ZONES[raceInfo["mainSport"]].keys():
+                theoreticalTimeInZone[zone] -= secondsInZone[zone]
+
+            dayAvailableDurations[best_fit[0]] -= total_seconds
+            # if dayAvailableDurations[best_fit[0]] <= 0:
+            availableDays.remove(best_fit[0])
+
+        log_debug(dayByDay)
+    if "LongIntensity" in futureMicrocycle.get("keyWorkouts", []):
+        log_debug("Planning long intensity workout")
+        total_tss, secondsInZone, timeline = createWorkout(
+            loadsInfo["minTssPerWorkout"],
+            loadsInfo["maxTssPerWorkout"],
+            tss_per_activity,
+            theoreticalTimeInZone,
+            min_time_in_zones={},
+            max_time_in_zones={4: 1800, 3: 7200},
+            cumulative_max_tss_in_zones=[
+                {
+                    "zones": [4, 3],
+                    "max": futureMicrocycle["theoreticalLongIntensityTSS"],
+                }
+            ],
+            zones=[4, 3],
+            warmup_duration=600,
+            cooldown_duration=600,
+            activity=raceInfo["mainSport"],
+        )
+        log_debug(
+            f"Long intensity workout, seconds in zone {secondsInZone}, total tss {total_tss}"
+        )
+        theoreticalDistance = sum(
+            [
+                secondsInZone[zone]
+                / 3600
+                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
+                    raceInfo["fitnessLevel"]
+                ][zone]
+                for zone in ZONES[raceInfo["mainSport"]].keys()
+            ]
+        )
+        # let's find the good day
+        total_seconds = sum(
+            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
+        )
+        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
+        if best_fit is not None:
+            if dayByDay.get(best_fit[0], None) is None:
+                dayByDay[best_fit[0]] = []
+            dayByDay[best_fit[0]].append(
+                {
+                    "workoutType": "LongIntensity",
+                    "activity": raceInfo["mainSport"],
+                    "tss": total_tss,
+                    "secondsInZone": secondsInZone,
+                    "theoreticalDistance": theoreticalDistance,
+                    "theoreticalTime": timedelta(seconds=total_seconds),
+                    "timeline": timeline,
+                }
+            )
+            for zone in ZONES[raceInfo["mainSport"]].keys():
+                theoreticalTimeInZone[zone] -= secondsInZone[zone]
+
+            dayAvailableDurations[best_fit[0]] -= total_seconds
+            # if dayAvailableDurations[best_fit[0]] <= 0:
+            availableDays.remove(best_fit[0])
+        log_debug(dayByDay)
+
+    if "RaceIntensity" in futureMicrocycle.get("keyWorkouts", []):
+        log_debug("Planning race intensity workout")
+        total_tss, secondsInZone, timeline = createWorkout(
+            loadsInfo["minTssPerWorkout"],
+            loadsInfo["maxTssPerWorkout"],
+            tss_per_activity,
+            theoreticalTimeInZone,
+            min_time_in_zones={},
+            max_time_in_zones={raceInfo["raceZone"]: 1800},
+            zones=[raceInfo["raceZone"]],
+            warmup_duration=600,
+            cooldown_duration=600,
+            activity=raceInfo["mainSport"],
+        )
+        theoreticalDistance = sum(
+            [
+                secondsInZone[zone]
+                / 3600
+                * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[raceInfo["mainSport"]][
+                    raceInfo["fitnessLevel"]
+                ][zone]
+                for zone in ZONES[raceInfo["mainSport"]].keys()
+            ]
+        )
+        total_seconds = sum(
+            [secondsInZone[zone] for zone in ZONES[raceInfo["mainSport"]].keys()]
+        )
+        best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
+        if best_fit is not None:
+            if dayByDay.get(best_fit[0], None) is None:
+                dayByDay[best_fit[0]] = []
+            dayByDay[best_fit[0]].append(
+                {
+                    "workoutType": "RaceIntensity",
+                    "activity": raceInfo["mainSport"],
+                    "tss": total_tss,
+                    "secondsInZone": secondsInZone,
+                    "theoreticalDistance": theoreticalDistance,
+                    "theoreticalTime": timedelta(seconds=total_seconds),
+                    "timeline": timeline,
+                }
+            )
+            for zone in ZONES[raceInfo["mainSport"]].keys():
+                theoreticalTimeInZone[zone] -= secondsInZone[zone]
+
+            dayAvailableDurations[best_fit[0]] -= total_seconds
+            # if dayAvailableDurations[best_fit[0]] <= 0:
+            availableDays.remove(best_fit[0])
+        log_debug(dayByDay)
+    remaining_tss = futureMicrocycle["theoreticalWeeklyTSS"] - sum(
+        [workout["tss"] for day in dayByDay.values() for workout in day]
+    )
+    # Split what is left of the week between the sports, the key workouts are in the main sport
+    sports = list(raceInfo["sportShares"])
+    sportShares = np.array(list(raceInfo["sportShares"].values()), dtype=float)
+    zoneBudgetBySport = allocateZoneBudgetBySport(theoreticalTimeInZone, sportShares)
+    remainingTssBySport = remaining_tss * sportShares
+
+    # Let's plan the remaining time in zones, sport by sport
+    regularWorkoutTssBySport = REGULAR_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL
+    for sportIndex, sport in enumerate(sports):
+        remaining_tss = float(remainingTssBySport[sportIndex])
+        theoreticalTimeInZone = dict(zip(ZONES[sport].keys(), zoneBudgetBySport[sportIndex].tolist()))
+        if sportShares[sportIndex] == 1:
+            # A sport alone in the week keeps the workouts sized from the whole week
+            sport_tss_per_activity = None
+        else:
+            # The workouts of the sport are sized from its own share of the week, the last one takes what is left
+            regularWorkoutTss = regularWorkoutTssBySport.get(sport, regularWorkoutTssBySport[raceInfo["mainSport"]])[
+                raceInfo["objective"]
+            ][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
+            sport_tss_per_activity = remaining_tss / max(1, round(remaining_tss / regularWorkoutTss))
+        remainingWorkouts = 0
+        while remaining_tss > 30:
+            if remainingWorkouts >= MAX_REMAINING_WORKOUTS_PER_WEEK:
+                # The workouts stopped lowering the remaining load, the week keeps the ones planned
+                log_warning(
+                    f"Remaining workouts budget exceeded (inputs {hashPlanInputs(futureMicrocycle['theoreticalWeeklyTSS'], theoreticalTimeInZone, raceInfo, loadsInfo)})"
+                )
+                tracePlanEvent(TRACE_BUDGET_EXCEEDED, loop="remaining workouts", remainingTss=int(remaining_tss))
+                break
+            remainingWorkouts += 1
+            log_debug("Planning a new workout")
+            zones = []
+            for zone in ZONES[sport].keys():
+                if theoreticalTimeInZone[zone] > 0:
+                    zones.append(zone)
+            zones = sorted(zones, key=lambda x: x, reverse=True)
+
+            total_tss, secondsInZone, timeline = createWorkout(
+                loadsInfo["minTssPerWorkout"],
+                100,
+                tss_per_activity if sport_tss_per_activity is None else min(sport_tss_per_activity, remaining_tss),
+                theoreticalTimeInZone,
+                min_time_in_zones={},
+                max_time_in_zones={},
+                cumulative_max_tss_in_zones=[{"zones": [3, 4, 5, 6, 7], "max": 40}],
+                zones=zones,
+                warmup_duration=600,
+                cooldown_duration=600,
+                activity=sport,
+            )
+            log_debug(f"New workout, seconds in zone {secondsInZone}, total tss {total_tss}")
+
+            theoreticalDistance = sum(
+                [
+                    secondsInZone[zone]
+                    / 3600
+                    * SPEED_BY_ZONE_BY_SPORT_BY_ATHLETE_LEVEL_KMH[sport][
+                        raceInfo["fitnessLevel"]
+                    ][zone]
+                    for zone in ZONES[sport].keys()
+                ]
+            )
+            total_seconds = sum(
+                [secondsInZone[zone] for zone in ZONES[sport].keys()]
+            )
+            best_fit = findBestFitDay(total_seconds, availableDays, dayAvailableDurations)
+            log_debug("Best fit")
+            log_debug(best_fit)
+            if best_fit is not None:
+                if dayByDay.get(best_fit[0], None) is None:
+                    dayByDay[best_fit[0]] = []
+                dayByDay[best_fit[0]].append(
+                    {
+                        "workoutType": "Remaining",
+                        "activity": sport,
+                        "tss": total_tss,
+                        "secondsInZone": secondsInZone,
+                        "theoreticalDistance": theoreticalDistance,
+                        "theoreticalTime": timedelta(seconds=total_seconds),
+                        "timeline": timeline,
+                    }
+                )
+                for zone in ZONES[sport].keys():
+                    theoreticalTimeInZone[zone] -= secondsInZone[zone]
+
+                dayAvailableDurations[best_fit[0]] -= total_seconds
+                if best_fit[0] in availableDays:
+                    availableDays.remove(best_fit[0])
+            remaining_tss -= total_tss
+
+            log_debug(dayByDay)
+
+    futureMicrocycle["dayByDay"] = dayByDay
+
+    return futureMicrocycle
+
+
+def findBestFitDay(total_seconds, available_days, available_durations):
+    log_debug(
+        f"Finding best fit day, total seconds: {total_seconds}, available days: {available_days}, available durations: {available_durations}"
+    )
+    best_fit = None
+    if len(available_days) == 0:
+        # find the one that has the most available duration
+        for day in available_durations.keys():
+            if best_fit is None:
+                best_fit = (day, available_durations[day])
+            elif available_durations[day] > best_fit[1]:
+                best_fit = (day, available_durations[day])
+    else:
+        for day in available_days:
+            duration = available_durations[day]
+            if duration >= total_seconds:
+                if best_fit is None:
+                    best_fit = (day, duration)
+                elif duration < best_fit[1]:
+                    best_fit = (day, duration)
+    log_debug(f"Best fit day: {best_fit}")
+    if best_fit is None:
+        tracePlanEvent(TRACE_WORKOUT_NOT_PLACED, seconds=int(total_seconds), availableDays=list(available_days))
+    return best_fit
+
+
+def newTimeline():
+    """
+    Timeline of a workout as parallel columns, one entry per step. An Interval step repeated n
+    times stands for n intervals, each followed by its recovery.
+    """
+    return {
+        "kind": [],
+        "zone": [],
+        "seconds": [],
+        "tss": [],
+        "repeat": [],
+        "recoverySeconds": [],
+        "recoveryTss": [],
+    }
+
+
+def addTimelineStep(timeline, kind, zone, seconds, tss, repeat=1, recoverySeconds=0, recoveryTss=0, position=None):
+    """Add a step at the end of the timeline, or before the given position"""
+    if position is None:
+        position = len(timeline["kind"])
+    for column, value in (
+        ("kind", kind),
+        ("zone", zone),
+        ("seconds", seconds),
+        ("tss", tss),
+        ("repeat", repeat),
+        ("recoverySeconds", recoverySeconds),
+        ("recoveryTss", recoveryTss),
+    ):
+        timeline[column].insert(position, value)
+
+
+def timelineFromIntervalSuggestions(intervalSuggestions):
+    """Timeline of a workout planned before the timelines, one step per suggested interval"""
+    timeline = newTimeline()
+    for interval in intervalSuggestions:
+        for zone, seconds in interval["secondsInZone"].items():
+            addTimelineStep(timeline, interval["description"], int(zone), seconds, interval["tss"])
+    return timeline
+
+
+def expandTimeline(timeline):
+    """
+    Segments of a timeline in order, the repeated intervals and their recoveries unrolled, as
+    columns (start, end, zone, seconds, tss, description).
+    """
+    # Each step gives one or two units (the interval and its recovery), repeated as a block
+    unitStep, unitIsRecovery, unitIndices, descriptions = [], [], [], []
+    for step, kind in enumerate(timeline["kind"]):
+        hasRecovery = kind == "Interval"
+        first = len(unitStep)
+        unitStep.append(step)
+        unitIsRecovery.append(False)
+        if hasRecovery:
+            unitStep.append(step)
+            unitIsRecovery.append(True)
+        for repetition in range(timeline["repeat"][step]):
+            unitIndices.extend(range(first, len(unitStep)))
+            if kind == "Interval":
+                descriptions.append(f"Interval {repetition + 1}")
+            else:
+                descriptions.append(kind)
+            if hasRecovery:
+                descriptions.append(f"Recovery {repetition + 1}")
+
+    unitStep = np.asarray(unitStep, dtype=int)
+    unitIsRecovery = np.asarray(unitIsRecovery, dtype=bool)
+    unitZone = np.where(unitIsRecovery, 1, np.asarray(timeline["zone"], dtype=int)[unitStep])
+    unitSeconds = np.where(
+        unitIsRecovery,
+        np.asarray(timeline["recoverySeconds"], dtype=float)[unitStep],
+        np.asarray(timeline["seconds"], dtype=float)[unitStep],
+    )
+    unitTss = np.where(
+        unitIsRecovery,
+        np.asarray(timeline["recoveryTss"], dtype=float)[unitStep],
+        np.asarray(timeline["tss"], dtype=float)[unitStep],
+    )
+
+    unitIndices = np.asarray(unitIndices, dtype=int)
+    seconds = unitSeconds[unitIndices]
+    end = np.cumsum(seconds)
+    return {
+        "start": end - seconds,
+        "end": end,
+        "zone": unitZone[unitIndices],
+        "seconds": seconds,
+        "tss": unitTss[unitIndices],
+        "description": descriptions,
+    }
+
+
+def createWorkout(
+    min_tss,
+    max_tss,
+    target_tss,
+    remaining_time_in_zone,
+    min_time_in_zones,
+    max_time_in_zones,
+    cumulative_max_tss_in_zones=[],
+    zones=[3, 2, 1],
+    warmup_duration=1200,
+    cooldown_duration=600,
+    activity="Run",
+):
+    log_debug("Creating workout with params: ")
+    log_debug(
+        f"min_tss: {min_tss}, max_tss: {max_tss}, target_tss: {target_tss}, remaining_time_in_zone: {remaining_time_in_zone}, min_time_in_zones: {min_time_in_zones}, max_time_in_zones: {max_time_in_zones}, cumulative_max_tss_in_zones: {cumulative_max_tss_in_zones}, zones: {zones}, warmup_duration: {warmup_duration}, cooldown_duration: {cooldown_duration}, activity: {activity}"
+    )
+    total_tss = 0
+    secondsInZone = {zone: 0 for zone in ZONES[activity].keys()}
+    timeline = newTimeline()
+    remaining_tss = target_tss
+    log_debug("TSS to reach")
+    log_debug(remaining_tss)
+
+    # Warmup
+    secondsInZone[1] = warmup_duration
+    warmup_tss = round(TSS_BY_ZONE_BY_SPORT[activity][1] * warmup_duration / 3600)
+    total_tss += warmup_tss
+    remaining_tss -= warmup_tss
+    addTimelineStep(timeline, "Warmup", 1, warmup_duration, warmup_tss)
+
+    # Cooldown
+    secondsInZone[1] = secondsInZone[1] + cooldown_duration
+    cooldown_tss = round(TSS_BY_ZONE_BY_SPORT[activity][1] * cooldown_duration / 3600)
+    total_tss += cooldown_tss
+    remaining_tss -= cooldown_tss
+
+    log_debug("Remaining TSS after warmup and cooldown")
+    log_debug(remaining_tss)
+
+    for zone in zones:
+        log_debug(f"Zone {zone}, remaining time in zone {remaining_time_in_zone[zone]}")
+        if remaining_time_in_zone[zone] > 0:
+            # Depending on zone, we also add some associated Z1 rest time to recover between intervals
+            recovery_factor = ZONE_RECOVERY_FACTOR_BY_SPORT[activity][zone]
+            max_seconds_in_remaining_tss = (
+                3600
+                * remaining_tss
+                / (
+                    TSS_BY_ZONE_BY_SPORT[activity][zone]
+                    + recovery_factor * TSS_BY_ZONE_BY_SPORT[activity][1]
+                )
+            )
+
+            # take into account cumulative max tss in zones
+            biggest_constraint_from_cumulative_max_tss = 99999999
+            for constraint in cumulative_max_tss_in_zones:
+                if zone in constraint["zones"]:
+                    log_debug("Constraint")
+                    log_debug(constraint)
+                    other_zones = [z for z in constraint["zones"] if z != zone]
+                    log_debug("Other zones")
+                    log_debug(other_zones)
+                    other_zones_tss = sum(
+                        [
+                            TSS_BY_ZONE_BY_SPORT[activity][z] * secondsInZone[z] / 3600
+                            for z in other_zones
+                        ]
+                    )
+                    log_debug("Other zones tss")
+                    log_debug(other_zones_tss)
+                    constraint_associated_tss = constraint["max"] - other_zones_tss
+                    log_debug("Constraint associated tss")
+                    log_debug(constraint_associated_tss)
+                    associated_time_in_seconds = (
+                        constraint_associated_tss
+                        * 3600
+                        / TSS_BY_ZONE_BY_SPORT[activity][zone]
+                    )
+                    log_debug("Associated time")
+                    log_debug(associated_time_in_seconds)
+                    if (
+                        associated_time_in_seconds
+                        < biggest_constraint_from_cumulative_max_tss
+                    ):
+                        biggest_constraint_from_cumulative_max_tss = (
+                            associated_time_in_seconds
+                        )
+
+            log_debug(
+                f"min time in zone {min_time_in_zones.get(zone, 0)}, max time in zone {max_time_in_zones.get(zone, 9999999)}, remaining time in zone {remaining_time_in_zone[zone]}, max seconds in remaining tss {max_seconds_in_remaining_tss}, biggest constraint from cumulative max tss {biggest_constraint_from_cumulative_max_tss}"
+            )
+
+            seconds_in_zone = round(
+                min(
+                    biggest_constraint_from_cumulative_max_tss,
+                    remaining_time_in_zone[zone],
+                    max_seconds_in_remaining_tss,
+                )
+            )
+
+            tss = round(TSS_BY_ZONE_BY_SPORT[activity][zone] * seconds_in_zone / 3600)
+            total_tss += tss
+            remaining_tss -= tss
+            secondsInZone[zone] = round(secondsInZone[zone] + seconds_in_zone)
+
+            # Add recovery time
+            secondsInZone[1] = secondsInZone[1] + seconds_in_zone * recovery_factor
+            recovery_tss = round(
+                TSS_BY_ZONE_BY_SPORT[activity][1]
+                * seconds_in_zone
+                * recovery_factor
+                / 3600
+            )
+            total_tss += recovery_tss
+            remaining_tss -= recovery_tss
+            
+            numberOfIntervals = int(seconds_in_zone/TYPICAL_DURATION_FOR_INTERVALS_BY_ZONE_BY_SPORT[activity][zone])+1
+            if numberOfIntervals > 0:
+                secondsInIntervals = round(seconds_in_zone / numberOfIntervals)
+            else:
+                secondsInIntervals = 0
+            log_debug(f"Zone: {zone}, Number of intervals: {numberOfIntervals}, seconds in intervals: {secondsInIntervals}")
+            # The intervals of the zone are a single step, repeated with their recovery
+            addTimelineStep(
+                timeline,
+                "Interval",
+                zone,
+                secondsInIntervals,
+                round(tss / numberOfIntervals),
+                repeat=numberOfIntervals,
+                recoverySeconds=secondsInIntervals,
+                recoveryTss=round(recovery_tss / numberOfIntervals),
+            )
+            
+            
+            
+            
+            log_debug(
+                f"seconds_in_zone {seconds_in_zone}, tss {tss}, recovery_tss {recovery_tss}"
+            )
+
+    # if we are under the min tss, we add half Z1 half Z2 time
+    if remaining_tss > 0:
+        log_debug("Adding z1 and Z2 time")
+        log_debug("Remaining TSS for this activity: ")
+        log_debug(remaining_tss)
+        log_debug("Remaining time in zone")
+        log_debug(remaining_time_in_zone)
+        tssz1toadd = remaining_tss / 2
+        tssz2toadd = remaining_tss / 2
+        secondsInZone[1] = secondsInZone[1] + round(
+            tssz1toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][1]
+        )
+        secondsInZone[2] = secondsInZone[2] + round(
+            tssz2toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][2]
+        )
+        total_tss += remaining_tss
+        remaining_tss = 0
+        
+        # add the z2 between the warmup and the first interval, and the z1 after the last interval
+        addTimelineStep(
+            timeline,
+            "Z2",
+            2,
+            round(tssz2toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][2]),
+            round(tssz2toadd),
+            position=1,
+        )
+        addTimelineStep(
+            timeline, "Z1", 1, round(tssz1toadd * 3600 / TSS_BY_ZONE_BY_SPORT[activity][1]), round(tssz1toadd)
+        )
+        
+    addTimelineStep(timeline, "Cooldown", 1, cooldown_duration, cooldown_tss)
+
+    return total_tss, secondsInZone, timeline
+
+
+def currentLoadStatus(pastMicrocycles, cycleLength=4, mainSport="Run"):
+    currentHandableLoad = 0
+    lastRestingWeek = 0
+    missingKeyWorkouts = []
+    TSSBalance = 0
+    nextWeekGuidelines = []
+    TSSPerZoneBalance = {zone: 0 for zone in ZONES[mainSport].keys()}
+    biggestWorkout = 0
+    biggestRaceIntensity = 0
+    biggestLongIntensityWorkout = 0
+    biggestShortIntensityWorkout = 0
+
+    for week in pastMicrocycles[-4:]:
+        if "actualTSS" in week:
+            if week["actualTSS"] > currentHandableLoad:
+                currentHandableLoad = week["actualTSS"]
+    # let's look backward in pastMicrocycles to find the last resting week
+    for i, week in enumerate(pastMicrocycles):
+        if week.get("actualResting"):
+            lastRestingWeek = i
+            break
+    nextRestingWeek = max(
+        min(cycleLength - (len(pastMicrocycles) - lastRestingWeek), cycleLength), 0
+    )
+
+    for week in pastMicrocycles[-2:]:
+        if "keyWorkoutsMissing" in week:
+            for workout in week["keyWorkoutsMissing"]:
+                missingKeyWorkouts.append(workout)
+    for week in pastMicrocycles[-5:]:
+        TSSBalance += week["actualTSS"] - week["theoreticalWeeklyTSS"]
+
+    if len(pastMicrocycles) > 0:
+        nextWeekGuidelines = pastMicrocycles[-1].get("nextWeekGuidelines", "Normal")
+    else:
+        nextWeekGuidelines = "Normal"
+
+    for week in pastMicrocycles[-4:]:
+        TSSPerZoneBalance = {
+            zone: TSSPerZoneBalance[zone]
+            + week["deltaTimeInZone"][zone]
+            * TSS_BY_ZONE_BY_SPORT[mainSport][zone]
+            / 3600
+            for zone in ZONES[mainSport].keys()
+        }
+
+    for week in pastMicrocycles[-3:]:
+        if week["longWorkoutDone"]:
+            biggestWorkout = max(week.get("theoreticalLongWorkoutTSS", 0), biggestWorkout)
+        else:
+            biggestWorkout = max(week["actualLongWorkoutTSS"], biggestWorkout)
+        if week["RaceIntensityDone"]:
+            biggestRaceIntensity = max(
+                week.get("theoreticalRaceIntensityTSS", 0), biggestRaceIntensity
+            )
+        else:
+            biggestRaceIntensity = max(
+                week["actualRaceIntensityTSS"], biggestRaceIntensity
+            )
+        if week["LongIntensityDone"]:
+            biggestLongIntensityWorkout = max(
+                week.get("theoreticalLongIntensityTSS", 0), biggestLongIntensityWorkout
+            )
+        else:
+            biggestLongIntensityWorkout = max(
+                week["actualLongIntensityTSS"], biggestLongIntensityWorkout
+            )
+        if week["ShortIntensityDone"]:
+            biggestShortIntensityWorkout = max(
+                week.get("theoreticalShortIntensityTSS", 0), biggestShortIntensityWorkout
+            )
+        else:
+            biggestShortIntensityWorkout = max(
+                week["actualShortIntensityTSS"], biggestShortIntensityWorkout
+            )
+
+    return {
+        "currentHandableLoad": currentHandableLoad,
+        "nextRestingWeek": nextRestingWeek,
+        "missingKeyWorkouts": missingKeyWorkouts,
+        "TSSBalance": TSSBalance,
+        "nextWeekGuidelines": nextWeekGuidelines,
+        "TSSPerZoneBalance": TSSPerZoneBalance,
+        "biggestWorkout": biggestWorkout,
+        "biggestRaceIntensity": biggestRaceIntensity,
+        "biggestLongIntensityWorkout": biggestLongIntensityWorkout,
+        "biggestShortIntensityWorkout": biggestShortIntensityWorkout,
+    }
+
+
+def compareCurrentWeekWithPlannedWeekAndReplanIfNeeded(
+    completedWorkouts,
+    currentMicrocycle,
+    startLoad,
+    currentDay,
+    lastWeeksTakeaways,
+    maxTssPerDay=200,
+    mainSport="Run",
+):
+    # variable days begins at currentday and goes up to 6, dayByDay is keyed by day names
+    remainingDays = [WEEK_DAYS[currentDay + i] for i in range(6 - currentDay)]
+    # The planned days are shared with the previous plan and identical weeks, the replanning works on its own copy
+    dayByDay = thaw_plan(currentMicrocycle.get("dayByDay", {}))
+    keyWorkouts = currentMicrocycle.get("keyWorkouts", [])
+    theroeticalTimeSpentWeekInSeconds = currentMicrocycle["theoreticalWeeklyTSS"] / sum(
+        [
+            TSS_BY_ZONE_BY_SPORT[mainSport][zone]
+            * currentMicrocycle["timeInZoneRepartition"][zone]
+            / 3600
+            for zone in ZONES[mainSport].keys()
+        ]
+    )
+    theroetical_time_in_zone = {zone: 0 for zone in ZONES[mainSport].keys()}
+    for zone in ZONES[mainSport].keys():
+        theroetical_time_in_zone[zone] = (
+            currentMicrocycle["timeInZoneRepartition"][zone]
+            * theroeticalTimeSpentWeekInSeconds
+        )
+    theoretical_time_in_zone_to_current_day = {
+        zone: 0 for zone in ZONES[mainSport].keys()
+    }
+    for day in dayByDay:
+        if WEEK_DAYS.index(day) < currentDay:
+            for workout in dayByDay[day]:
+                for zone in workout["secondsInZone"].keys():
+                    theoretical_time_in_zone_to_current_day[zone] += workout[
+                        "secondsInZone"
+                    ][zone]
+    onTrack = True
+    missingKeyWorkouts = []
+    missingWorkouts = []
+    nextWeekGuidelines = ""
+    weekWorkouts = [
+        workout
+        for workout in completedWorkouts
+        if final_date(workout["date"]) >= final_date(currentMicrocycle["startDate"])
+        and final_date(workout["date"]) <= final_date(currentMicrocycle["endDate"])
+    ]
+
+    done_time_in_zone = {zone: 0 for zone in ZONES[mainSport].keys()}
+    for workout in weekWorkouts:
+        for zone in workout["secondsInZone"].keys():
+            done_time_in_zone[zone] += workout["secondsInZone"][zone]
+
+    remaining_time_in_zone = {
+        zone: theroetical_time_in_zone[zone] - done_time_in_zone[zone]
+        for zone in ZONES[mainSport].keys()
+    }
+
+    # The key workouts that we should have already done
+    past_theoretical_key_workouts = []
+    for workout in keyWorkouts:
+        # find the theoretical workout in the dayByDay
+        for day in dayByDay:
+            if WEEK_DAYS.index(day) < currentDay:
+                for plannedWorkout in dayByDay[day]:
+                    if plannedWorkout["workoutType"] == workout:
+                        past_theoretical_key_workouts.append(plannedWorkout)
+
+    past_theoretical_workouts = []
+    for day in dayByDay:
+        if WEEK_DAYS.index(day) < currentDay:
+            for workout in dayByDay[day]:
+                past_theoretical_workouts.append(workout)
+
+    weekWorkoutsSuppl = weekWorkouts.copy()
+    # check if the key workouts were done
+    for workout in past_theoretical_key_workouts:
+        done = False
+        for actualWorkout in weekWorkoutsSuppl:
+            if checkWorkoutValidity(actualWorkout, workout) > 0.8:
+                done = True
+                # remove the workout from the weekWorkoutsSuppl
+                weekWorkoutsSuppl.remove(actualWorkout)
+                break
+        if not done:
+            if workout["workoutType"] in keyWorkouts:
+                missingKeyWorkouts.append(workout)
+    for workout in past_theoretical_workouts:
+        done = False
+        for actualWorkout in weekWorkoutsSuppl:
+            if checkWorkoutValidity(actualWorkout, workout) > 0.8:
+                done = True
+                # remove the workout from the weekWorkoutsSuppl
+                weekWorkoutsSuppl.remove(actualWorkout)
+                break
+        if not done:
+            missingWorkouts.append(workout)
+
+    # weekWorkoutsSuppl contains the workouts that were not planned.
+
+    # Check if we have to high difference in the time in zone to this day, and if yes, replan
+    difference_time_in_zone = {
+        zone: theoretical_time_in_zone_to_current_day[zone] - done_time_in_zone[zone]
+        for zone in ZONES[mainSport].keys()
+    }
+
+    planned_activities_lost = []
+    # Treat the key workouts first and try replanning it if failed
+    for keyWorkout in keyWorkouts:
+        if keyWorkout in missingKeyWorkouts:
+            # find the keyWorkout in the dayByDay
+            for day in dayByDay:
+                for workout in dayByDay[day]:
+                    if workout["workoutType"] == keyWorkout:
+                        keyWorkoutActivity = workout
+
+            bestDay = findBestDayToReplace(
+                dayByDay, keyWorkouts, keyWorkout, remainingDays
+            )
+            activitiesLost = dayByDay.get(bestDay, [])
+            for activity in activitiesLost:
+                planned_activities_lost.append(activity)
+            dayByDay[bestDay] = [keyWorkoutActivity]
+
+    # Treat the other workouts
+    for workout in missingWorkouts:
+        bestDay = findBestDayToReplace(
+            dayByDay, keyWorkouts, workout, remainingDays
+        )
+        if bestDay:
+            activitiesLost = dayByDay.get(bestDay, [])
+            for activity in activitiesLost:
+                planned_activities_lost.append(activity)
+            dayByDay[bestDay] = [workout]
+
+    # check the state of the new plan, with the completed activities and the remaining planned activities after these changes
+    newPlannedTSS = sum(
+        [workout["tss"] for day in dayByDay for workout in dayByDay[day]]
+    ) + sum([workout["tss"] for workout in weekWorkouts])
+    tss_difference = newPlannedTSS - currentMicrocycle["theoreticalWeeklyTSS"]
+
+    missingWorkoutsCopy = missingWorkouts.copy()
+    planned_activities_lost_copy = planned_activities_lost.copy()
+
+    while (
+        tss_difference > currentMicrocycle["theoreticalWeeklyTSS"] / 7
+    ):  # If we miss more than 1 day of TSS, we have to add back a missing workout
+        # add back a missingWorkouts or a planned_activity_lost if we can find a day that when we add is not more than loadsInfo["maxTssPerDay"]
+        for missingWorkout in list(missingWorkouts):
+            for day in dayByDay:
+                if WEEK_DAYS.index(day) > currentDay:
+                    dayTss = sum([workout["tss"] for workout in dayByDay[day]])
+                    if (
+                        dayTss + missingWorkout["tss"] < maxTssPerDay
+                    ):  # if this workout can feet in this day
+                        dayByDay[day].append(missingWorkout)
+                        tss_difference -= missingWorkout["tss"]
+                        break
+            # replanned or not, it is no longer missing
+            missingWorkouts.remove(missingWorkout)
+        for (
+            activity
+        ) in list(planned_activities_lost):  # do the same with the planned_activities_lost
+            for day in dayByDay:
+                if WEEK_DAYS.index(day) > currentDay:
+                    dayTss = sum([workout["tss"] for workout in dayByDay[day]])
+                    if dayTss + activity["tss"] < maxTssPerDay:
+                        dayByDay[day].append(activity)
+                        tss_difference -= activity["tss"]
+                        break
+            planned_activities_lost.remove(activity)
+        if not missingWorkouts and not planned_activities_lost:
+            break
+
+    newPlannedTimeInZone = {zone: 0 for zone in ZONES[mainSport].keys()}
+    for day in dayByDay:  # take the future plan
+        if WEEK_DAYS.index(day) > currentDay:
+            for workout in dayByDay[day]:
+                for zone in workout["secondsInZone"].keys():
+                    newPlannedTimeInZone[zone] += workout["secondsInZone"][zone]
+    for workout in weekWorkouts:
+        for zone in workout["secondsInZone"].keys():
+            newPlannedTimeInZone[zone] += workout["secondsInZone"][zone]
+    time_in_zone_difference = {
+        zone: newPlannedTimeInZone[zone] - theroetical_time_in_zone[zone]
+        for zone in ZONES[mainSport].keys()
+    }
+
+    for zone in ZONES[mainSport].keys():
+        # check also if the lastWeeksTakeaways["TSSPerZoneBalance"] does not compensate
+        if (
+            abs(time_in_zone_difference[zone]) > 0.1 * theroetical_time_in_zone[zone]
+            and abs(
+                lastWeeksTakeaways["TSSPerZoneBalance"][zone]
+                + time_in_zone_difference[zone]
+            )
+            < 0.1 * theroetical_time_in_zone[zone]
+        ):
+            # find remaining activities that have this zone and replan accordingly to the difference
+            activities_having_this_zone = []
+            for day in dayByDay:
+                if WEEK_DAYS.index(day) > currentDay:
+                    for workout in dayByDay[day]:
+                        if workout["secondsInZone"].get(zone, 0) > 0:
+                            activities_having_this_zone.append(workout)
+
+            if (
+                len(activities_having_this_zone) == 0
+                and time_in_zone_difference[zone] > 0
+            ):
+                # insert it in any easy workout
+                for day in dayByDay:
+                    if WEEK_DAYS.index(day) > currentDay:
+                        for workout in dayByDay[day]:
+                            if workout["workoutType"] == "Easy":
+                                workout["secondsInZone"][zone] = workout["secondsInZone"].get(zone, 0) + (
+                                    time_in_zone_difference[zone]
+                                )
+                                tss_change = (
+                                    time_in_zone_difference[zone]
+                                    * TSS_BY_ZONE_BY_SPORT[workout["activity"]][zone]
+                                    / 3600
+                                )
+                                workout["tss"] += tss_change
+            elif len(activities_having_this_zone) > 0:
+                shared_load = time_in_zone_difference[zone] / len(
+                    activities_having_this_zone
+                )
+                for activity in activities_having_this_zone:
+                    # but keep minimum 0
+                    to_add_or_remove = max(
+                        shared_load, -activity["secondsInZone"][zone]
+                    )
+                    activity["secondsInZone"][zone] += to_add_or_remove
+                    tss_change = (
+                        TSS_BY_ZONE_BY_SPORT[activity["activity"]][zone]
+                        / 3600
+                        * to_add_or_remove
+                    )
+                    activity["tss"] += tss_change
+
+    if currentMicrocycle.get("theoreticalResting", False):
+        # Check if we are not already higher than the planned TSS
+        if (
+            sum([workout["tss"] for workout in weekWorkouts])
+            > 1.3 * currentMicrocycle["theoreticalWeeklyTSS"]
+        ):
+            onTrack = False
+            if nextWeekGuidelines == "":
+                nextWeekGuidelines = "rest"
+
+    currentMicrocycle["dayByDay"] = dayByDay
+    currentMicrocycle["onTrack"] = onTrack
+    currentMicrocycle["missingKeyWorkouts"] = missingKeyWorkouts
+    currentMicrocycle["nextWeekGuidelines"] = nextWeekGuidelines
+
+
+def findBestDayToReplace(
+    dayByDay, microcycleKeyWorkouts, workoutToReschedule, remainingDays
+):
+    # first look for a rest day
+    for day in remainingDays:
+        if not dayByDay.get(day):
+            return day
+    for day in remainingDays:
+        # if we have only an easy workout, replace it
+        if len(dayByDay[day]) == 1 and dayByDay[day][0]["workoutType"] == "Easy":
+            return day
+    if workoutToReschedule in microcycleKeyWorkouts:
+        # else look for a less important day
+        days_score = {day: 0 for day in remainingDays}
+        for day in remainingDays:
+            types = [workout["workoutType"] for workout in dayByDay.get(day, [])]
+            # if there is one type of types that is before in the list of microcycleKeyWorkouts than keyWorkout add a score of the difference of the indexes
+            for i, workout in enumerate(microcycleKeyWorkouts):
+                if workout in types:
+                    days_score[day] += i - types.index(workout)
+        return min(days_score, key=days_score.get)
+    else:
+        return None
+
+
+class FrozenDict(dict):
+    """
+    Read only dict for the plans. Plans are persistent: an edit returns a new version sharing the
+    unchanged weeks, so one plan can be cached across sessions or handed to threads as it is.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Plans are read only, edit them with update_microcycle or update_plan_week")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze_plan(value):
+    """Read only version of a plan (or any part of it), already frozen parts are shared"""
+    if isinstance(value, FrozenDict):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict({key: freeze_plan(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze_plan(item) for item in value)
+    return value
+
+
+def thaw_plan(value):
+    """Editable deep copy of a plan (or any part of it)"""
+    if isinstance(value, dict):
+        return {key: thaw_plan(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw_plan(item) for item in value]
+    return value
+
+
+def update_plan_week(plan, index, new_values):
+    """New version of the plan with one week updated, the other weeks are shared"""
+    plan = tuple(plan)
+    return plan[:index] + (freeze_plan(update_microcycle(plan[index], new_values)),) + plan[index + 1:]
+
+
+def update_macrocycle(macrocycle, new_values):
+    """Return a new version of the macrocycle, the current state is kept in its history"""
+    # Store the current state before updating
+    previous_version = {
+        "startDate": macrocycle.get("startDate"),
+        "endDate": macrocycle.get("endDate"),
+        "totalTSS": macrocycle.get("totalTSS"),
+        "cycleLength": macrocycle.get("cycleLength"),
+        "cycleType": macrocycle.get("cycleType"),
+        "cycleNumber": macrocycle.get("cycleNumber"),
+        "analyzed": macrocycle.get("analyzed"),
+        "updateDate": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    # Append to previousVersion if there is an update
+    previousVersions = list(macrocycle.get("previousVersion", []))
+    if any(macrocycle.get(key) != new_values.get(key) for key in new_values):
+        previousVersions.append(previous_version)
+
+    # The new version with the new values, the given macrocycle is left untouched
+    updatedMacrocycle = dict(macrocycle)
+    updatedMacrocycle["previousVersion"] = previousVersions
+    updatedMacrocycle.update(new_values)
+
+    return updatedMacrocycle
+
+
+def update_microcycle(microcycle, new_values):
+    """Return a new version of the microcycle, the current state is kept in its history"""
+    # Store the current state before updating
+    previous_version = {
+        "startDate": microcycle.get("startDate"),
+        "endDate": microcycle.get("endDate"),
+        "theoreticalWeeklyTSS": microcycle.get("theoreticalWeeklyTSS"),
+        "theoreticalResting": microcycle.get("theoreticalResting"),
+        "indexInCycle": microcycle.get("indexInCycle"),
+        "keyWorkouts": microcycle.get("keyWorkouts"),
+        "cycleType": microcycle.get("cycleType"),
+        "cycleNumber": microcycle.get("cycleNumber"),
+        "theoreticalLongWorkoutTSS": microcycle.get("theoreticalLongWorkoutTSS"),
+        "theoreticalRaceIntensityTSS": microcycle.get("theoreticalRaceIntensityTSS"),
+        "analyzed": microcycle.get("analyzed"),
+        "timeInZoneRepartition": microcycle.get("timeInZoneRepartition"),
+        "dayByDay": microcycle.get("dayByDay"),
+        "updateDate": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    # Append to previousVersion if there is an update
+    previousVersions = list(microcycle.get("previousVersion", []))
+    if any(microcycle.get(key) != new_values.get(key) for key in new_values):
+        previousVersions.append(previous_version)
+
+    # The new version with the new values, the given microcycle is left untouched
+    updatedMicrocycle = dict(microcycle)
+    updatedMicrocycle["previousVersion"] = previousVersions
+    updatedMicrocycle.update(new_values)
+
+    return updatedMicrocycle
+
+
+def fix_ending(weeks, cycleLength):
+    # Count how many worked weeks at the end
+    worked_streak = 0
+    for w in reversed(weeks):
+        if w["theoreticalResting"]:
+            break
+        worked_streak += 1
+
+    # Set allowed max to cycleLength - 1
+    allowed_max = cycleLength - 1
+
+    if worked_streak > allowed_max:
+        # Convert some ending worked weeks to resting weeks
+        to_convert = worked_streak - allowed_max
+        for i in range(len(weeks) - 1, -1, -1):
+            if to_convert <= 0:
+                break
+            w = weeks[i]
+            if not w["theoreticalResting"]:
+                w["theoreticalResting"] = True
+                w["theoreticalWeeklyTSS"] = w["theoreticalWeeklyTSS"] * 0.6
+                tracePlanEvent(
+                    TRACE_REST_WEEK, cycleType=w["cycleType"], cycleNumber=w["cycleNumber"], reason="ending"
+                )
+                to_convert -= 1
+    return weeks
+
+
+def getSpecificWeeks(
+    availableWeekNumber,
+    load,
+    cycleLength,
+    nextRestingWeek,
+    currentCycleNumber,
+    currentIndexInCycle,
+):
+    if availableWeekNumber == 0:
+        return []
+
+    pattern = (
+        ["W"] * nextRestingWeek + ["R"] + ["W"] * (cycleLength - nextRestingWeek - 1)
+    )
+
+    def build_week(week_type, cycle_num, index_in_cycle):
+        if week_type == "R":
+            tracePlanEvent(TRACE_REST_WEEK, cycleType="Specific", cycleNumber=cycle_num, load=int(load * 0.6))
+            return {
+                "cycleType": "Specific",
+                "cycleNumber": cycle_num,
+                "indexInCycle": index_in_cycle,
+                "theoreticalWeeklyTSS": load * 0.6,
+                "theoreticalResting": True,
+            }
+        else:
+            return {
+                "cycleType": "Specific",
+                "cycleNumber": cycle_num,
+                "indexInCycle": index_in_cycle,
+                "theoreticalWeeklyTSS": load,
+                "theoreticalResting": False,
+                "keyWorkouts": ["RaceIntensity", "Long", "ShortIntensity"],
+            }
+
+    def pattern_to_weeks(pat, cycle_num, start_idx):
+        weeks = []
+        for i, wtype in enumerate(pat):
+            weeks.append(build_week(wtype, cycle_num, start_idx + i))
+        return weeks
+
+    weeks = []
+    remaining = availableWeekNumber
+    # Full cycles, the next ones start at the beginning of a cycle
+    while remaining >= cycleLength and remaining > 0:
+        if len(weeks) >= MAX_PLANNED_WEEKS:
+            # A cycle length that does not shorten what is left, keep the cycles built so far
+            log_warning(
+                f"Specific weeks budget exceeded (inputs {hashPlanInputs(availableWeekNumber, load, cycleLength, nextRestingWeek)})"
+            )
+            tracePlanEvent(TRACE_BUDGET_EXCEEDED, loop="specific weeks", weeks=len(weeks))
+            return fix_ending(weeks, cycleLength)
+        weeks += pattern_to_weeks(pattern, currentCycleNumber, currentIndexInCycle)
+        remaining -= cycleLength
+        currentCycleNumber += 1
+        currentIndexInCycle = 1
+
+    if remaining > 0:
+        # Partial cycle
+        partial = pattern[:remaining]
+
+        def ends_in_resting(p):
+            return p[-1] == "R"
+
+        if ends_in_resting(partial) and len(partial) > 1:
+            # Try alternative partial
+            alt_partial = pattern[-remaining:]
+            if not ends_in_resting(alt_partial):
+                partial = alt_partial
+            else:
+                # Fallback: all worked
+                partial = ["W"] * remaining
+
+        weeks += pattern_to_weeks(partial, currentCycleNumber, currentIndexInCycle)
+
+    return fix_ending(weeks, cycleLength)
+
+# @st.cache_data
+def compute_training_plan(
+    inputs, persistedMicrocycles=None, completedWorkouts=None, withDayByDay=True, computation=None, currentDate=None
+):
+    """
+    Compute the training plan for all races.
+
+    When the athlete already has a persisted plan, it is replanned from today: past weeks are kept
+    as they are (and only analyzed once), the current and future weeks are regenerated.
+
+    Without withDayByDay only the weekly loads are planned, the weeks to organize day by day are
+    marked dayByDayPending and filled by complete_training_plan.
+
+    A computation token makes it stop between races and weeks once it is superseded
+    (PlanComputationCancelled is raised).
+    """
+    result = []
+    total_number_of_hours = 0
+    persistedIndex = buildCycleIndex(persistedMicrocycles or [])
+    for i in range(len(inputs["races"])):
+        checkPlanCancelled(computation)
+        log_info(f"Computing training plan for {i} race")
+        log_info(f"Inputs: {inputs}")
+        if inputs["races"][i]["distance"] >= 0:
+            new_weeks = compute_training_plan_1_race(
+                inputs, i, persistedIndex, completedWorkouts, withDayByDay, computation, currentDate
+            )
+            for week in new_weeks:
+                total_number_of_hours += week["theoreticalWeeklyTSS"]/60
+            result = result + new_weeks
+    log_info(f"Total number of hours: {total_number_of_hours}")
+    return freeze_plan(result)
+
+def planPendingWeeks(plan, positions, inputs, computation=None, currentDate=None):
+    """Plan day by day the pending weeks at the given positions of the plan, by position"""
+    pendingPositions = defaultdict(list)
+    for position in positions:
+        pendingPositions[plan[position]["raceNumber"]].append(position)
+
+    plannedWeeks = {}
+    for raceNumber, racePositions in pendingPositions.items():
+        checkPlanCancelled(computation)
+        raceInfo, loadsInfo, datesInfo, weekInfo = build_race_infos(inputs, raceNumber, currentDate)
+        weeks = [dict(plan[position]) for position in racePositions]
+        for week in weeks:
+            del week["dayByDayPending"]
+        planFutureWeeksDayByDay(weeks, weekInfo, raceInfo, loadsInfo, datesInfo, computation)
+        for position, week in zip(racePositions, weeks):
+            plannedWeeks[position] = freeze_plan(week)
+    return plannedWeeks
+
+
+def iter_completed_plan(plan, inputs, computation=None, currentDate=None):
+    """
+    Yield the weeks of a load only plan in date order, each once final. The pending weeks are
+    planned by batches starting with the current and next weeks, each batch twice the previous
+    one so that the later ones are large enough for the worker pool.
+    """
+    pending = [position for position, microcycle in enumerate(plan) if microcycle.get("dayByDayPending")]
+    nextPosition = 0
+    batchStart, batchSize = 0, STREAMED_FIRST_WEEKS
+    while batchStart < len(pending):
+        batch = pending[batchStart : batchStart + batchSize]
+        plannedWeeks = planPendingWeeks(plan, batch, inputs, computation, currentDate)
+        while nextPosition <= batch[-1]:
+            yield plannedWeeks.get(nextPosition, plan[nextPosition])
+            nextPosition += 1
+        batchStart += batchSize
+        batchSize *= 2
+    yield from plan[nextPosition:]
+
+
+def iter_training_plan(inputs, persistedMicrocycles=None, completedWorkouts=None, computation=None):
+    """Same plan as compute_training_plan, streamed week by week in date order as soon as each week is final"""
+    plan = compute_training_plan(
+        inputs, persistedMicrocycles, completedWorkouts, withDayByDay=False, computation=computation
+    )
+    yield from iter_completed_plan(plan, inputs, computation)
+
+
+def complete_training_plan(plan, inputs, computation=None, currentDate=None):
+    """Plan day by day the weeks left pending by a load only computation, the other weeks are shared"""
+    return tuple(iter_completed_plan(plan, inputs, computation, currentDate))
+
+
+def replaySeason(inputs, completedWorkouts, startDate, endDate=None):
+    """
+    Replay a season day by day as the athlete lived it, and yield a (day, plan) snapshot per day.
+    The plan is only replanned on the days that start a week, follow a race or see new completed
+    workouts, from the plan of the last replan, so the past weeks are analyzed once and the other
+    days share the snapshot of the day before. The races already run are dropped, their weeks stay
+    in the history of the next race.
+    """
+    workouts = sorted(completedWorkouts, key=lambda workout: final_date(workout["date"]))
+    workoutDates = [final_date(workout["date"]) for workout in workouts]
+    day = final_date(startDate)
+    if endDate is None:
+        endDate = max(final_date(race["date"]) for race in inputs["races"])
+    endDate = final_date(endDate)
+
+    plan = ()
+    replannedFor = None
+    while day <= endDate:
+        races = [race for race in inputs["races"] if final_date(race["date"]) >= day]
+        if not races:
+            break
+        completedCount = bisect_left(workoutDates, day)
+        replanFor = (len(races), day - timedelta(days=day.weekday()), completedCount)
+        if replanFor != replannedFor:
+            dayInputs = dict(inputs, races=races)
+            currentDate = datetime(day.year, day.month, day.day)
+            plan = compute_training_plan(
+                dayInputs, plan, workouts[:completedCount], withDayByDay=False, currentDate=currentDate
+            )
+            # The analysis of a week needs its days, the weeks unchanged since the last replan
+            # are served by the day by day cache
+            plan = complete_training_plan(plan, dayInputs, currentDate=currentDate)
+            replannedFor = replanFor
+        yield day, plan
+        day += timedelta(days=1)
+
+
+def has_pending_weeks(plan):
+    return any(microcycle.get("dayByDayPending") for microcycle in plan)
+
+
+def select_race_microcycles(microcycleIndex, inputs, i):
+    """
+    Select the persisted microcycles belonging to the i-th race: the weeks ending on or before the race
+    and after the previous race. The first race also keeps the older history.
+    """
+    previousRaceDate = inputs["races"][i - 1]["date"] if i > 0 else None
+    return cyclesBetweenDates(microcycleIndex, previousRaceDate, inputs["races"][i]["date"])
+
+def build_race_infos(inputs, i, currentDate=None):
+    """
+    The race, loads, dates and week organization infos the planner needs for the i-th race.
+    The first race is planned from currentDate, today by default.
+    """
+    raceDistanceKm = inputs["races"][i]["distance"]
+    targetTimeInMinutes = (
+        inputs["races"][i]["target_minutes"] + inputs["races"][i]["target_hours"] * 60
+    )
+    mainSport = inputs["races"][i]["sport"]
+    objective = inputs["races"][i]["objective"]
+    fitnessLevel = inputs["level"]
+    # The shares of the other sports are percentages of the training, the main sport keeps the rest
+    otherSportShares = {
+        sport: inputs["races"][i]["other_sport_shares"].get(sport, 0) / 100
+        for sport in inputs["races"][i]["other_sports"]
+        if sport != mainSport
+    }
+    mainSportShare = 1 - sum(otherSportShares.values())
+    eventSize = determineEventSize(raceDistanceKm, mainSport)
+    raceZone = determineRaceZone(eventSize, objective)
+    eventTSS = calculateEventTss(raceZone, mainSport, targetTimeInMinutes)
+
+    raceInfo = {
+        "raceDistanceKm": raceDistanceKm,
+        "targetTimeInMinutes": targetTimeInMinutes,
+        "eventSize": eventSize,
+        "raceZone": raceZone,
+        "eventTSS": eventTSS,
+        "objective": objective,
+        "fitnessLevel": fitnessLevel,
+        "mainSportShare": mainSportShare,
+        "mainSport": mainSport,
+        # Main sport first, the key workouts are planned in it
+        "sportShares": {mainSport: mainSportShare, **otherSportShares},
+    }
+
+    startLoad = inputs["races"][i]["weekly_start_hours"] * 70
+    endLoad = inputs["races"][i]["weekly_end_hours"] * 70
+    weeklyTssIncreaseRate = (
+        0.05
+        if inputs["increase"] == "Low"
+        else 0.07
+        if inputs["increase"] == "Medium"
+        else 0.1
+    )
+    cycleLength = 4 if inputs["recuperation_level"] == "Low" else 3
+    if i == 0:
+        nextRestingWeek = inputs["next_resting_week"]
+    else:
+        nextRestingWeek = 0
+    declaredHandableLoad = inputs["weekly_hours"] * (
+        60 if "intensity_workouts" not in inputs else 60
+        if inputs["intensity_workouts"] == 0
+        else 65
+        if inputs["intensity_workouts"] == 1
+        else 70
+        if inputs["intensity_workouts"] == 2
+        else 75
+        if inputs["intensity_workouts"] == 3
+        else 80
+        if inputs["intensity_workouts"] == 4
+        else 85
+        if inputs["intensity_workouts"] == 5
+        else 90
+    )
+    declaredNextRestingWeek = inputs["next_resting_week"]
+    currentLongRunTss = (
+        (inputs["longest_workout_hours"] * 60 + inputs["longest_workout_minutes"])
+        / 60
+        * 65
+    )
+
+    currentLongRaceIntensityTss = 0.2 * eventTSS
+    minTssPerWorkout = 30
+    maxTssPerWorkout = REGULAR_MAX_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL[
+        raceInfo["mainSport"]
+    ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
+    # maxTempoTssInLong = 50
+    maxTssPerDay = (
+        MAX_TSS_PER_DAY_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL[
+            raceInfo["mainSport"]
+        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
+    )
+    finalLongRunTss = (
+        LONG_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE[
+            raceInfo["mainSport"]
+        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
+        * eventTSS
+    )
+    finalRaceIntensityTss = (
+        RACE_INTENSITY_WORKOUT_TSS_BY_SPORT_BY_OBJECTIVE_BY_OBJECTIVE_SIZE_BY_ATHLETE_LEVEL_PERCENTAGE_OF_RACE[
+            raceInfo["mainSport"]
+        ][raceInfo["objective"]][raceInfo["eventSize"]][raceInfo["fitnessLevel"]]
+        * eventTSS
+    )
+    finalShortIntensityTss = 50
+    finalLongIntensityTss = 70
+
+    loadsInfo = {
+        "startLoad": startLoad,
+        "endLoad": endLoad,
+        "weeklyTssIncreaseRate": weeklyTssIncreaseRate,
+        "cycleLength": cycleLength,
+        "nextRestingWeek": nextRestingWeek,
+        "declaredHandableLoad": declaredHandableLoad,
+        "declaredNextRestingWeek": declaredNextRestingWeek,
+        "minTssPerWorkout": minTssPerWorkout,
+        "maxTssPerWorkout": maxTssPerWorkout,
+        # "maxTempoTssInLong": maxTempoTssInLong,
+        "maxTssPerDay": maxTssPerDay,
+        "currentLongRunTSS": currentLongRunTss,
+        "currentRaceIntensityTSS": currentLongRaceIntensityTss,
+        "finalLongRunTSS": finalLongRunTss,
+        "finalRaceIntensityTSS": finalRaceIntensityTss,
+        "finalShortIntensityTSS": finalShortIntensityTss,
+        "finalLongIntensityTSS": finalLongIntensityTss,
+    }
+
+    raceDate = inputs["races"][i]["date"]
+    
+    if i > 0:
+        # startDate is the next monday after the previous race, between 4 and 11 days after
+        lastRaceDate = inputs["races"][i - 1]["date"]
+
+        # startDate = lastRaceDate + timedelta(days=(7 - lastRaceDate.weekday() if lastRaceDate.weekday() >= 4 else 0))
+        startDate = lastRaceDate + timedelta(days=(6 - lastRaceDate.weekday()))
+        startDate = datetime(startDate.year, startDate.month, startDate.day)
+        # currentDate = lastRaceDate + timedelta(days=(7 - lastRaceDate.weekday() if lastRaceDate.weekday() >= 4 else 0))
+        currentDate = lastRaceDate + timedelta(days=(6 - lastRaceDate.weekday()))
+        # convert currentDate to datetime
+        currentDate = datetime(currentDate.year, currentDate.month, currentDate.day)
+    else:
+        if currentDate is None:
+            currentDate = datetime.today()
+        startDate = currentDate
+        # currentDate = datetime(year=2024, month=12, day=19)
+    
+    
+    # currentDate = datetime(currentDate.year, currentDate.month, currentDate.day)
+    datesInfo = {
+        "startDate": startDate,
+        "endDate": raceDate,
+        "currentDate": currentDate,
+        "currentWeekStart": currentDate - timedelta(currentDate.weekday()),
+        "currentWeekEnd": currentDate + timedelta(6 - currentDate.weekday()),
+        "raceWeekStart": raceDate - timedelta(raceDate.weekday()),
+        "raceWeekEnd": raceDate + timedelta(6 - raceDate.weekday()),
+        "numberOfWeeks": (
+            datetime(year=raceDate.year, month=raceDate.month, day=raceDate.day)
+            - timedelta(raceDate.weekday())
+            - currentDate
+            - timedelta(currentDate.weekday())
+        ).days
+        // 7,
+    }
+
+    longWorkoutDay = inputs["week_organization"]["long_workout_day"]
+    availableDays = inputs["week_organization"]["workout_days"]
+    dayAvailableDurations = inputs["week_organization"]["workout_durations"]
+    # convert the dayAvailableDurations from hours to seconds
+    dayAvailableDurations = {
+        day: dayAvailableDurations[day] * 60 * 60 for day in dayAvailableDurations
+    }
+    weekInfo = {
+        "longWorkoutDay": longWorkoutDay,
+        "availableDays": availableDays,
+        "dayAvailableDurations": dayAvailableDurations,
+    }
+    return raceInfo, loadsInfo, datesInfo, weekInfo
+
+
+# @st.cache_data
+def compute_training_plan_1_race(
+    inputs, i, persistedIndex=None, completedWorkouts=None, withDayByDay=True, computation=None, currentDate=None
+):
+    raceInfo, loadsInfo, datesInfo, weekInfo = build_race_infos(inputs, i, currentDate)
+    if completedWorkouts is None:
+        completedWorkouts = []
+
+    currentPlannedMacrocycles = []
+    currentPlannedMicrocycles = (
+        select_race_microcycles(persistedIndex, inputs, i) if persistedIndex is not None else []
+    )
+    totalMacrocycles, totalMicrocycles = planWeekLoads(
+        loadsInfo,
+        datesInfo,
+        raceInfo,
+        weekInfo,
+        currentPlannedMacrocycles,
+        currentPlannedMicrocycles,
+        completedWorkouts,
+        i,
+        withDayByDay,
+        computation,
+    )
+    return totalMicrocycles
+
+def encode_plan_value(value):
+    """
+    JSON encoder for the values found in a plan (dates, datetimes and timedeltas).
+    """
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"__timedelta__": value.total_seconds()}
+    raise TypeError(f"Cannot serialize {type(value)} in a plan")
+
+
+def decode_plan_value(obj):
+    """
+    JSON object hook reverting encode_plan_value, and restoring the integer zone keys.
+    """
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    if "__date__" in obj:
+        return date.fromisoformat(obj["__date__"])
+    if "__timedelta__" in obj:
+        return timedelta(seconds=obj["__timedelta__"])
+    return {int(key) if key.isdigit() else key: value for key, value in obj.items()}
+
+
+def serialize_plan(microcycles):
+    return json.dumps(list(microcycles), default=encode_plan_value)
+
+
+def deserialize_plan(plan_json):
+    return json.loads(plan_json, object_hook=decode_plan_value)